@@ -1,18 +1,22 @@
 import { VercelRequest, VercelResponse } from '@vercel/node'
+import { gunzipSync } from 'zlib'
 import githubVerifyAccessToken from '../apiHelpers/githubVerifyAccessToken'
 import JSONStringifyDeterminsitic from '../apiHelpers/jsonStringifyDeterministic'
 import clientLoadProjectHandler from '../apiHelpers/ProtocaasClientRequestHandlers/clientLoadProjectHandler'
 import { isClientLoadProjectRequest, isProtocaasClientRequest, ProtocaasClientRequest, ProtocaasClientResponse } from '../apiHelpers/ProtocaasClientRequestHandlers/ProtocaasClientRequest'
 import computeResourceGetAppsHandler from '../apiHelpers/ProtocaasComputeResourceRequestHandlers/computeResourceGetAppsHandler'
+import computeResourceGetJobStatusesHandler from '../apiHelpers/ProtocaasComputeResourceRequestHandlers/computeResourceGetJobStatusesHandler'
 import computeResourceGetPubsubSubscriptionHandler from '../apiHelpers/ProtocaasComputeResourceRequestHandlers/computeResourceGetPubsubSubscriptionHandler'
 import computeResourceGetUnfinishedJobsHandler from '../apiHelpers/ProtocaasComputeResourceRequestHandlers/computeResourceGetUnfinishedJobsHandler'
 import computeResourceSetSpecHandler from '../apiHelpers/ProtocaasComputeResourceRequestHandlers/computeResourceSetSpecHandler'
-import { isComputeResourceGetAppsRequest, isComputeResourceGetPubsubSubscriptionRequest, isComputeResourceGetUnfinishedJobsRequest, isComputeResourceSetSpecRequest, isProtocaasComputeResourceRequest, ProtocaasComputeResourceRequest, ProtocaasComputeResourceResponse } from '../apiHelpers/ProtocaasComputeResourceRequestHandlers/ProtocaasComputeResourceRequest'
+import { isComputeResourceGetAppsRequest, isComputeResourceGetJobStatusesRequest, isComputeResourceGetPubsubSubscriptionRequest, isComputeResourceGetUnfinishedJobsRequest, isComputeResourceSetSpecRequest, isProtocaasComputeResourceRequest, ProtocaasComputeResourceRequest, ProtocaasComputeResourceResponse } from '../apiHelpers/ProtocaasComputeResourceRequestHandlers/ProtocaasComputeResourceRequest'
+import { BatchRequest, BatchResponse, BatchSubRequest, BatchSubResponse, isBatchRequest, maxBatchSize } from '../apiHelpers/ProtocaasBatchRequestHandlers/ProtocaasBatchRequest'
+import processorAppendJobConsoleOutputHandler from '../apiHelpers/ProtocaasProcessorRequestHandlers/processorAppendJobConsoleOutputHandler'
 import processorGetJobHandler from '../apiHelpers/ProtocaasProcessorRequestHandlers/processorGetJobHandler'
 import processorGetOutputUploadUrlHandler from '../apiHelpers/ProtocaasProcessorRequestHandlers/processorGetOutputUploadUrlHandler'
 import processorSetJobConsoleOutputHandler from '../apiHelpers/ProtocaasProcessorRequestHandlers/processorSetJobConsoleOutputHandler'
 import processorSetJobStatusHandler from '../apiHelpers/ProtocaasProcessorRequestHandlers/processorSetJobStatusHandler'
-import { isProcessorGetJobRequest, isProcessorGetOutputUploadUrlRequest, isProcessorSetJobConsoleOutputRequest, isProcessorSetJobStatusRequest, isProtocaasProcessorRequest, ProtocaasProcessorRequest, ProtocaasProcessorResponse } from '../apiHelpers/ProtocaasProcessorRequestHandlers/ProtocaasProcessorRequest'
+import { isProcessorAppendJobConsoleOutputRequest, isProcessorGetJobRequest, isProcessorGetOutputUploadUrlRequest, isProcessorSetJobConsoleOutputRequest, isProcessorSetJobStatusRequest, isProtocaasProcessorRequest, ProtocaasProcessorRequest, ProtocaasProcessorResponse } from '../apiHelpers/ProtocaasProcessorRequestHandlers/ProtocaasProcessorRequest'
 import createJobHandler from '../apiHelpers/ProtocaasRequestHandlers/createJobHandler'
 import createProjectHandler from '../apiHelpers/ProtocaasRequestHandlers/createProjectHandler'
 import createWorkspaceHandler from '../apiHelpers/ProtocaasRequestHandlers/createWorkspaceHandler'
@@ -49,7 +53,11 @@ import { isCreateJobRequest, isCreateProjectRequest, isCreateWorkspaceRequest, i
 const ADMIN_USER_IDS = JSON.parse(process.env.ADMIN_USER_IDS || '[]') as string[]
 
 module.exports = (req: VercelRequest, res: VercelResponse) => {
-    const {body: request} = req
+    // Large requests may be gzipped by the python client (PROTOCAAS_API_GZIP). They
+    // are sent as application/octet-stream so that the body arrives as a Buffer.
+    const request = ((req.headers['content-encoding'] === 'gzip') && (Buffer.isBuffer(req.body))) ? (
+        JSON.parse(gunzipSync(req.body).toString('utf-8'))
+    ) : req.body
 
     // CORS ///////////////////////////////////
     res.setHeader('Access-Control-Allow-Credentials', 'true')
@@ -73,6 +81,10 @@ module.exports = (req: VercelRequest, res: VercelResponse) => {
     ///////////////////////////////////////////
 
     (async () => {
+        if (isBatchRequest(request)) {
+            return await handleBatchRequest(request)
+        }
+
         if (isProtocaasProcessorRequest(request)) {
             return await handleProcessorRequest(request)
         }
@@ -230,6 +242,50 @@ module.exports = (req: VercelRequest, res: VercelResponse) => {
     })
 }
 
+const handleBatchRequest = async (request: BatchRequest): Promise<BatchResponse> => {
+    if (request.requests.length > maxBatchSize) {
+        throw Error(`Too many requests in batch: ${request.requests.length} > ${maxBatchSize}`)
+    }
+    // requests concerning the same job are handled in order (e.g., status starting then running), the others concurrently
+    const groups: {[key: string]: number[]} = {}
+    request.requests.forEach((r, i) => {
+        const key = (r as any).jobId ? `job:${(r as any).jobId}` : `request:${i}`
+        if (!groups[key]) groups[key] = []
+        groups[key].push(i)
+    })
+    const responses: BatchSubResponse[] = new Array(request.requests.length)
+    await Promise.all(Object.values(groups).map(async indices => {
+        for (const i of indices) {
+            try {
+                responses[i] = {response: await handleBatchSubRequest(request.requests[i])}
+            }
+            catch (err: any) {
+                console.warn(err.message)
+                responses[i] = {error: err.message}
+            }
+        }
+    }))
+    return {
+        type: 'batch',
+        responses
+    }
+}
+
+const handleBatchSubRequest = async (request: BatchSubRequest) => {
+    if (isProtocaasProcessorRequest(request)) {
+        return await handleProcessorRequest(request)
+    }
+    else if (isProtocaasComputeResourceRequest(request)) {
+        return await handleComputeResourceRequest(request)
+    }
+    else if (isProtocaasClientRequest(request)) {
+        return await handleClientRequest(request)
+    }
+    else {
+        throw Error(`Unexpected batch request type: ${(request as any).type}`)
+    }
+}
+
 const handleProcessorRequest = async (request: ProtocaasProcessorRequest): Promise<ProtocaasProcessorResponse> => {
     if (isProcessorGetJobRequest(request)) {
         return await processorGetJobHandler(request)
@@ -240,6 +296,9 @@ const handleProcessorRequest = async (request: ProtocaasProcessorRequest): Promi
     else if (isProcessorSetJobConsoleOutputRequest(request)) {
         return await processorSetJobConsoleOutputHandler(request)
     }
+    else if (isProcessorAppendJobConsoleOutputRequest(request)) {
+        return await processorAppendJobConsoleOutputHandler(request)
+    }
     else if (isProcessorGetOutputUploadUrlRequest(request)) {
         return await processorGetOutputUploadUrlHandler(request)
     }
@@ -258,6 +317,9 @@ const handleComputeResourceRequest = async (request: ProtocaasComputeResourceReq
     else if (isComputeResourceGetPubsubSubscriptionRequest(request)) {
         return await computeResourceGetPubsubSubscriptionHandler(request)
     }
+    else if (isComputeResourceGetJobStatusesRequest(request)) {
+        return await computeResourceGetJobStatusesHandler(request)
+    }
     else if (isComputeResourceSetSpecRequest(request)) {
         return await computeResourceSetSpecHandler(request)
     }
@@ -0,0 +1,55 @@
+import validateObject, { isArrayOf, isEqualTo, isObject, isOneOf, isString, optional } from "../../src/types/validateObject";
+import { isProtocaasClientRequest, ProtocaasClientRequest, ProtocaasClientResponse } from "../ProtocaasClientRequestHandlers/ProtocaasClientRequest";
+import { isProtocaasComputeResourceRequest, ProtocaasComputeResourceRequest, ProtocaasComputeResourceResponse } from "../ProtocaasComputeResourceRequestHandlers/ProtocaasComputeResourceRequest";
+import { isProtocaasProcessorRequest, ProtocaasProcessorRequest, ProtocaasProcessorResponse } from "../ProtocaasProcessorRequestHandlers/ProtocaasProcessorRequest";
+
+// batch
+
+// Carries several processor, compute resource or client requests in one round trip.
+// Each of these requests is authenticated on its own, so they can be batched without a payload signature.
+// The responses are in the same order as the requests. A request that fails gets {error} rather than
+// failing the whole batch. Requests concerning the same job are handled in order.
+
+export const maxBatchSize = 500
+
+export type BatchSubRequest = ProtocaasProcessorRequest | ProtocaasComputeResourceRequest | ProtocaasClientRequest
+
+export const isBatchSubRequest = (x: any): x is BatchSubRequest => {
+    return isOneOf([
+        isProtocaasProcessorRequest,
+        isProtocaasComputeResourceRequest,
+        isProtocaasClientRequest
+    ])(x)
+}
+
+export type BatchRequest = {
+    type: 'batch'
+    requests: BatchSubRequest[]
+}
+
+export const isBatchRequest = (x: any): x is BatchRequest => {
+    return validateObject(x, {
+        type: isEqualTo('batch'),
+        requests: isArrayOf(isBatchSubRequest)
+    })
+}
+
+export type BatchSubResponse = {
+    response?: ProtocaasProcessorResponse | ProtocaasComputeResourceResponse | ProtocaasClientResponse
+    error?: string
+}
+
+export type BatchResponse = {
+    type: 'batch'
+    responses: BatchSubResponse[]
+}
+
+export const isBatchResponse = (x: any): x is BatchResponse => {
+    return validateObject(x, {
+        type: isEqualTo('batch'),
+        responses: isArrayOf(y => validateObject(y, {
+            response: optional(isObject),
+            error: optional(isString)
+        }))
+    })
+}
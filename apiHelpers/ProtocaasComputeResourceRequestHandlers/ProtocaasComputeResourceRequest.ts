@@ -1,14 +1,21 @@
-import { ComputeResourceAwsBatchOpts, ComputeResourceSlurmOpts, ComputeResourceSpec, isComputeResourceAwsBatchOpts, isComputeResourceSlurmOpts, isComputeResourceSpec, isProtocaasJob, ProtocaasJob } from "../../src/types/protocaas-types";
-import validateObject, { isArrayOf, isEqualTo, isOneOf, isString, optional } from "../../src/types/validateObject";
+import { ComputeResourceAwsBatchOpts, ComputeResourceSlurmOpts, ComputeResourceSpec, isComputeResourceAwsBatchOpts, isComputeResourceSlurmOpts, isComputeResourceSpec, isProtocaasJob, isProtocaasJobResourceUsage, ProtocaasJob, ProtocaasJobResourceUsage } from "../../src/types/protocaas-types";
+import validateObject, { isArrayOf, isBoolean, isEqualTo, isNull, isNumber, isObjectOf, isOneOf, isString, optional } from "../../src/types/validateObject";
 
 // computeResource.getUnfinishedJobs
 
+// If sinceCursor is provided, the jobs are returned incrementally:
+// * jobs only includes the unfinished jobs that were modified since the cursor (all of them if sinceCursor is 0)
+// * the consoleOutput field is omitted
+// * unfinishedJobIds lists the IDs of all unfinished jobs, so that the compute resource can drop the others
+// * cursor is to be passed as sinceCursor in the next request
+
 export type ComputeResourceGetUnfinishedJobsRequest = {
     type: 'computeResource.getUnfinishedJobs'
     computeResourceId: string
     signature: string
     nodeId: string
     nodeName: string
+    sinceCursor?: number
 }
 
 export const isComputeResourceGetUnfinishedJobsRequest = (x: any): x is ComputeResourceGetUnfinishedJobsRequest => {
@@ -17,19 +24,24 @@ export const isComputeResourceGetUnfinishedJobsRequest = (x: any): x is ComputeR
         computeResourceId: isString,
         signature: isString,
         nodeId: isString,
-        nodeName: isString
+        nodeName: isString,
+        sinceCursor: optional(isNumber)
     })
 }
 
 export type ComputeResourceGetUnfinishedJobsResponse = {
     type: 'computeResource.getUnfinishedJobs'
     jobs: ProtocaasJob[]
+    unfinishedJobIds?: string[]
+    cursor?: number
 }
 
 export const isComputeResourceGetUnfinishedJobsResponse = (x: any): x is ComputeResourceGetUnfinishedJobsResponse => {
     return validateObject(x, {
         type: isEqualTo('computeResource.getUnfinishedJobs'),
-        jobs: isArrayOf(isProtocaasJob)
+        jobs: isArrayOf(isProtocaasJob),
+        unfinishedJobIds: optional(isArrayOf(isString)),
+        cursor: optional(isNumber)
     })
 }
 
@@ -92,9 +104,10 @@ export const isComputeResourceGetPubsubSubscriptionRequest = (x: any): x is Comp
 export type ComputeResourceGetPubsubSubscriptionResponse = {
     type: 'computeResource.getPubsubSubscription'
     subscription: {
-        pubnubSubscribeKey: string
-        pubnubChannel: string
-        pubnubUser: string
+        pubnubSubscribeKey?: string
+        pubnubChannel?: string
+        pubnubUser?: string
+        relayUrl?: string
     }
 }
 
@@ -102,13 +115,53 @@ export const isComputeResourceGetPubsubSubscriptionResponse = (x: any): x is Com
     return validateObject(x, {
         type: isEqualTo('computeResource.getPubsubSubscription'),
         subscription: y => validateObject(y, {
-            pubnubSubscribeKey: isString,
-            pubnubChannel: isString,
-            pubnubUser: isString
+            pubnubSubscribeKey: optional(isString),
+            pubnubChannel: optional(isString),
+            pubnubUser: optional(isString),
+            relayUrl: optional(isString)
         })
     })
 }
 
+// computeResource.getJobStatuses
+
+// The statuses of the jobs that a compute resource node is running, so that it can tell them whether to keep going
+// (one request per node instead of one per job). The status is null for jobs that no longer exist.
+
+export const maxJobIdsPerGetJobStatuses = 5000
+
+export type ComputeResourceGetJobStatusesRequest = {
+    type: 'computeResource.getJobStatuses'
+    computeResourceId: string
+    signature: string
+    jobIds: string[]
+    includeResourceUsage?: boolean
+}
+
+export const isComputeResourceGetJobStatusesRequest = (x: any): x is ComputeResourceGetJobStatusesRequest => {
+    return validateObject(x, {
+        type: isEqualTo('computeResource.getJobStatuses'),
+        computeResourceId: isString,
+        signature: isString,
+        jobIds: isArrayOf(isString),
+        includeResourceUsage: optional(isBoolean)
+    })
+}
+
+export type ComputeResourceGetJobStatusesResponse = {
+    type: 'computeResource.getJobStatuses'
+    jobStatuses: {[jobId: string]: string | null}
+    jobResourceUsages?: {[jobId: string]: ProtocaasJobResourceUsage | null} // if includeResourceUsage
+}
+
+export const isComputeResourceGetJobStatusesResponse = (x: any): x is ComputeResourceGetJobStatusesResponse => {
+    return validateObject(x, {
+        type: isEqualTo('computeResource.getJobStatuses'),
+        jobStatuses: isObjectOf(isString, isOneOf([isString, isNull])),
+        jobResourceUsages: optional(isObjectOf(isString, isOneOf([isProtocaasJobResourceUsage, isNull])))
+    })
+}
+
 // computeResource.setSpec
 
 export type ComputeResourceSetSpecRequest = {
@@ -143,6 +196,7 @@ export type ProtocaasComputeResourceRequest =
     ComputeResourceGetUnfinishedJobsRequest |
     ComputeResourceGetAppsRequest |
     ComputeResourceGetPubsubSubscriptionRequest |
+    ComputeResourceGetJobStatusesRequest |
     ComputeResourceSetSpecRequest
 
 export const isProtocaasComputeResourceRequest = (x: any): x is ProtocaasComputeResourceRequest => {
@@ -150,6 +204,7 @@ export const isProtocaasComputeResourceRequest = (x: any): x is ProtocaasCompute
         isComputeResourceGetUnfinishedJobsRequest,
         isComputeResourceGetAppsRequest,
         isComputeResourceGetPubsubSubscriptionRequest,
+        isComputeResourceGetJobStatusesRequest,
         isComputeResourceSetSpecRequest
     ])(x)
 }
@@ -158,6 +213,7 @@ export type ProtocaasComputeResourceResponse =
     ComputeResourceGetUnfinishedJobsResponse |
     ComputeResourceGetAppsResponse |
     ComputeResourceGetPubsubSubscriptionResponse |
+    ComputeResourceGetJobStatusesResponse |
     ComputeResourceSetSpecResponse
 
 export const isProtocaasComputeResourceResponse = (x: any): x is ProtocaasComputeResourceResponse => {
@@ -165,6 +221,7 @@ export const isProtocaasComputeResourceResponse = (x: any): x is ProtocaasComput
         isComputeResourceGetUnfinishedJobsResponse,
         isComputeResourceGetAppsResponse,
         isComputeResourceGetPubsubSubscriptionResponse,
+        isComputeResourceGetJobStatusesResponse,
         isComputeResourceSetSpecResponse
     ])(x)
 }
\ No newline at end of file
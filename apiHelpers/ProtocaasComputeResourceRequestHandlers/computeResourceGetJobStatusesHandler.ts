@@ -0,0 +1,65 @@
+import { isProtocaasComputeResource, ProtocaasJobResourceUsage } from "../../src/types/protocaas-types"
+import { getMongoClient } from "../getMongoClient"
+import JSONStringifyDeterministic from "../jsonStringifyDeterministic"
+import removeIdField from "../removeIdField"
+import verifySignature from "../verifySignature"
+import { ComputeResourceGetJobStatusesRequest, ComputeResourceGetJobStatusesResponse, maxJobIdsPerGetJobStatuses } from "./ProtocaasComputeResourceRequest"
+
+const computeResourceGetJobStatusesHandler = async (request: ComputeResourceGetJobStatusesRequest): Promise<ComputeResourceGetJobStatusesResponse> => {
+    const client = await getMongoClient()
+
+    const computeResourcesCollection = client.db('protocaas').collection('computeResources')
+    const computeResource = removeIdField(await computeResourcesCollection.findOne({computeResourceId: request.computeResourceId}))
+    if (!isProtocaasComputeResource(computeResource)) {
+        console.warn(computeResource)
+        throw new Error('Invalid compute resource in database (6)')
+    }
+    const okay = await verifySignature(JSONStringifyDeterministic({type: 'computeResource.getJobStatuses'}), computeResource.computeResourceId, request.signature)
+    if (!okay) {
+        throw new Error('Invalid signature for computeResource.getJobStatuses')
+    }
+    if (request.jobIds.length > maxJobIdsPerGetJobStatuses) {
+        throw new Error(`Too many job IDs: ${request.jobIds.length} > ${maxJobIdsPerGetJobStatuses}`)
+    }
+
+    const jobsCollection = client.db('protocaas').collection('jobs')
+    const jobs = await jobsCollection.find({
+        jobId: {$in: request.jobIds},
+        computeResourceId: request.computeResourceId
+    }, {
+        projection: request.includeResourceUsage ? {jobId: 1, status: 1, resourceUsage: 1} : {jobId: 1, status: 1}
+    }).toArray()
+
+    // null for the jobs that no longer exist (e.g., deleted)
+    const jobStatuses: {[jobId: string]: string | null} = {}
+    for (const jobId of request.jobIds) {
+        jobStatuses[jobId] = null
+    }
+    for (const job of jobs) {
+        jobStatuses[job.jobId] = job.status
+    }
+
+    if (!request.includeResourceUsage) {
+        return {
+            type: 'computeResource.getJobStatuses',
+            jobStatuses
+        }
+    }
+
+    // reported by the job wrapper with the final status of a job, if at all
+    const jobResourceUsages: {[jobId: string]: ProtocaasJobResourceUsage | null} = {}
+    for (const jobId of request.jobIds) {
+        jobResourceUsages[jobId] = null
+    }
+    for (const job of jobs) {
+        jobResourceUsages[job.jobId] = job.resourceUsage || null
+    }
+
+    return {
+        type: 'computeResource.getJobStatuses',
+        jobStatuses,
+        jobResourceUsages
+    }
+}
+
+export default computeResourceGetJobStatusesHandler
@@ -19,13 +19,18 @@ const computeResourceGetPubsubSubscriptionHandler = async (request: ComputeResou
         throw new Error('Invalid signature for computeResource.getPubsubSubscription')
     }
 
-    if (!process.env.VITE_PUBNUB_SUBSCRIBE_KEY) {
-        throw Error('Environment variable not set: VITE_PUBNUB_SUBSCRIBE_KEY')
+    // the node uses the relay if there is one (see publishComputeResourceMessage)
+    const subscription: ComputeResourceGetPubsubSubscriptionResponse['subscription'] = {}
+    if (process.env.VITE_PUBNUB_SUBSCRIBE_KEY) {
+        subscription.pubnubSubscribeKey = process.env.VITE_PUBNUB_SUBSCRIBE_KEY
+        subscription.pubnubChannel = request.computeResourceId
+        subscription.pubnubUser = request.computeResourceId
     }
-    const subscription = {
-        pubnubSubscribeKey: process.env.VITE_PUBNUB_SUBSCRIBE_KEY,
-        pubnubChannel: request.computeResourceId,
-        pubnubUser: request.computeResourceId
+    if (process.env.PUBSUB_RELAY_URL) {
+        subscription.relayUrl = process.env.PUBSUB_RELAY_URL
+    }
+    if ((!subscription.pubnubSubscribeKey) && (!subscription.relayUrl)) {
+        throw Error('Environment variable not set: VITE_PUBNUB_SUBSCRIBE_KEY or PUBSUB_RELAY_URL')
     }
 
     return {
@@ -5,6 +5,11 @@ import removeIdField from "../removeIdField"
 import verifySignature from "../verifySignature"
 import { ComputeResourceGetUnfinishedJobsRequest, ComputeResourceGetUnfinishedJobsResponse } from "./ProtocaasComputeResourceRequest"
 
+const unfinishedJobStatuses = ['pending', 'queued', 'starting', 'running']
+
+// the job timestamps are set by different serverless instances, so allow for some clock skew
+const cursorOverlapSec = 10
+
 const computeResourceGetUnfinishedJobsHandler = async (request: ComputeResourceGetUnfinishedJobsRequest): Promise<ComputeResourceGetUnfinishedJobsResponse> => {
     const client = await getMongoClient()
 
@@ -21,11 +26,22 @@ const computeResourceGetUnfinishedJobsHandler = async (request: ComputeResourceG
 
     const jobsCollection = client.db('protocaas').collection('jobs')
 
+    // take the cursor before querying so that modifications made during the query are picked up next time
+    const cursor = Date.now() / 1000
+    const incremental = request.sinceCursor !== undefined
+
     const filter: {[k: string]: any} = {}
     filter['computeResourceId'] = request.computeResourceId
-    filter['status'] = {$in: ['pending', 'queued', 'starting', 'running']}
+    filter['status'] = {$in: unfinishedJobStatuses}
+    if ((incremental) && (request.sinceCursor)) {
+        filter['$or'] = [
+            {timestampModified: {$gte: request.sinceCursor - cursorOverlapSec}},
+            {timestampModified: {$exists: false}} // jobs that were last modified before timestampModified was introduced
+        ]
+    }
+    const projection = incremental ? {consoleOutput: 0} : {}
 
-    const jobs = removeIdField(await jobsCollection.find(filter).toArray())
+    const jobs = removeIdField(await jobsCollection.find(filter, {projection}).toArray())
     for (const job of jobs) {
         if (!isProtocaasJob(job)) {
             console.warn(JSON.stringify(job, null, 2))
@@ -41,6 +57,15 @@ const computeResourceGetUnfinishedJobsHandler = async (request: ComputeResourceG
     }
     const jobsVerified: ProtocaasJob[] = jobs
 
+    let unfinishedJobIds: string[] | undefined = undefined
+    if (incremental) {
+        const x = await jobsCollection.find({
+            computeResourceId: request.computeResourceId,
+            status: {$in: unfinishedJobStatuses}
+        }, {projection: {jobId: 1}}).toArray()
+        unfinishedJobIds = x.map(j => j.jobId)
+    }
+
     const computeResourceNodesCollection = client.db('protocaas').collection('computeResourceNodes')
     await computeResourceNodesCollection.updateOne({
         computeResourceId: request.computeResourceId,
@@ -56,6 +81,14 @@ const computeResourceGetUnfinishedJobsHandler = async (request: ComputeResourceG
         upsert: true
     })
 
+    if (incremental) {
+        return {
+            type: 'computeResource.getUnfinishedJobs',
+            jobs: jobsVerified,
+            unfinishedJobIds,
+            cursor
+        }
+    }
     return {
         type: 'computeResource.getUnfinishedJobs',
         jobs: jobsVerified
@@ -1,4 +1,5 @@
-import validateObject, { isArrayOf, isBoolean, isEqualTo, isOneOf, isString, optional } from "../../src/types/validateObject";
+import validateObject, { isArrayOf, isBoolean, isEqualTo, isNumber, isOneOf, isString, optional } from "../../src/types/validateObject";
+import { isProtocaasJobResourceUsage, ProtocaasJobResourceUsage } from "../../src/types/protocaas-types";
 
 // processor.getJob
 
@@ -62,6 +63,7 @@ export type ProcessorSetJobStatusRequest = {
     jobPrivateKey: string
     status: string
     error?: string
+    resourceUsage?: ProtocaasJobResourceUsage
 }
 
 export const isProcessorSetJobStatusRequest = (x: any): x is ProcessorSetJobStatusRequest => {
@@ -70,7 +72,8 @@ export const isProcessorSetJobStatusRequest = (x: any): x is ProcessorSetJobStat
         jobId: isString,
         jobPrivateKey: isString,
         status: isString,
-        error: optional(isString)
+        error: optional(isString),
+        resourceUsage: optional(isProtocaasJobResourceUsage)
     })
 }
 
@@ -116,6 +119,45 @@ export const isProcessorSetJobConsoleOutputResponse = (x: any): x is ProcessorSe
     })
 }
 
+// processor.appendJobConsoleOutput
+
+// Appends the bytes of the console output starting at offset (the raw output, before carriage returns are applied)
+// data is base64 of the gzipped bytes
+// If offset does not match what the server has received so far, nothing is appended (apart from the part
+// of a repeated segment that is new) and the response says where to continue from
+
+export type ProcessorAppendJobConsoleOutputRequest = {
+    type: 'processor.appendJobConsoleOutput'
+    jobId: string
+    jobPrivateKey: string
+    offset: number
+    data: string
+}
+
+export const isProcessorAppendJobConsoleOutputRequest = (x: any): x is ProcessorAppendJobConsoleOutputRequest => {
+    return validateObject(x, {
+        type: isEqualTo('processor.appendJobConsoleOutput'),
+        jobId: isString,
+        jobPrivateKey: isString,
+        offset: isNumber,
+        data: isString
+    })
+}
+
+export type ProcessorAppendJobConsoleOutputResponse = {
+    type: 'processor.appendJobConsoleOutput'
+    success: boolean
+    consoleOutputSize: number
+}
+
+export const isProcessorAppendJobConsoleOutputResponse = (x: any): x is ProcessorAppendJobConsoleOutputResponse => {
+    return validateObject(x, {
+        type: isEqualTo('processor.appendJobConsoleOutput'),
+        success: isBoolean,
+        consoleOutputSize: isNumber
+    })
+}
+
 // processor.getOutputUploadUrl
 
 export type ProcessorGetOutputUploadUrlRequest = {
@@ -152,6 +194,7 @@ export type ProtocaasProcessorRequest =
     ProcessorGetJobRequest |
     ProcessorSetJobStatusRequest |
     ProcessorSetJobConsoleOutputRequest |
+    ProcessorAppendJobConsoleOutputRequest |
     ProcessorGetOutputUploadUrlRequest
 
 export const isProtocaasProcessorRequest = (x: any): x is ProtocaasProcessorRequest => {
@@ -159,6 +202,7 @@ export const isProtocaasProcessorRequest = (x: any): x is ProtocaasProcessorRequ
         isProcessorGetJobRequest,
         isProcessorSetJobStatusRequest,
         isProcessorSetJobConsoleOutputRequest,
+        isProcessorAppendJobConsoleOutputRequest,
         isProcessorGetOutputUploadUrlRequest
     ])(x)
 }
@@ -167,6 +211,7 @@ export type ProtocaasProcessorResponse =
     ProcessorGetJobResponse |
     ProcessorSetJobStatusResponse |
     ProcessorSetJobConsoleOutputResponse |
+    ProcessorAppendJobConsoleOutputResponse |
     ProcessorGetOutputUploadUrlResponse
 
 export const isProtocaasProcessorResponse = (x: any): x is ProtocaasProcessorResponse => {
@@ -174,6 +219,7 @@ export const isProtocaasProcessorResponse = (x: any): x is ProtocaasProcessorRes
         isProcessorGetJobResponse,
         isProcessorSetJobStatusResponse,
         isProcessorSetJobConsoleOutputResponse,
+        isProcessorAppendJobConsoleOutputResponse,
         isProcessorGetOutputUploadUrlResponse
     ])(x)
 }
\ No newline at end of file
@@ -0,0 +1,191 @@
+import { gunzipSync, gzipSync } from "zlib";
+import { Binary, Collection, MongoServerError } from "mongodb";
+import { isProtocaasJob } from "../../src/types/protocaas-types";
+import { getMongoClient } from "../getMongoClient";
+import removeIdField from "../removeIdField";
+import { ProcessorAppendJobConsoleOutputRequest, ProcessorAppendJobConsoleOutputResponse } from "./ProtocaasProcessorRequest";
+import { Bucket, bucketNameFromUri, putObject } from './s3Helpers'
+
+// The job document only keeps the beginning and the end of the console output (see below)
+const headSize = Number(process.env['CONSOLE_OUTPUT_HEAD_KB'] || 64) * 1024
+const tailSize = Number(process.env['CONSOLE_OUTPUT_TAIL_KB'] || 1024) * 1024
+
+// The raw output received so far is tracked in the jobConsoleOutputs collection ({jobId, size, head, tail}).
+// The consoleOutput field of the job is rendered from the head and the tail. If OUTPUT_BUCKET_URI is set,
+// each segment is also stored (gzipped) in the bucket at protocaas-console-output/<jobId>/<offset>.gz,
+// so that the full output is the concatenation of the segments in order of offset.
+
+// When the head and the tail don't overlap, they are trimmed to whole lines (or at least to whole utf-8 characters)
+// where they meet the omitted part, looking this far for a newline
+const maxLineTrimSize = 4 * 1024
+
+// A unique index on jobId, so that two segments that arrive together for a new job can't create two documents
+let consoleOutputsIndexCreated = false
+const ensureConsoleOutputsIndex = async (consoleOutputsCollection: Collection) => {
+    if (consoleOutputsIndexCreated) return
+    try {
+        await consoleOutputsCollection.createIndex({jobId: 1}, {unique: true})
+        consoleOutputsIndexCreated = true
+    }
+    catch(err) {
+        console.warn('Unable to create the jobId index of jobConsoleOutputs', err)
+    }
+}
+
+const processorAppendJobConsoleOutputHandler = async (request: ProcessorAppendJobConsoleOutputRequest): Promise<ProcessorAppendJobConsoleOutputResponse> => {
+    const client = await getMongoClient()
+    const jobsCollection = client.db('protocaas').collection('jobs')
+    const consoleOutputsCollection = client.db('protocaas').collection('jobConsoleOutputs')
+    await ensureConsoleOutputsIndex(consoleOutputsCollection)
+
+    const job = removeIdField(await jobsCollection.findOne({
+        jobId: request.jobId
+    }))
+    if (!job) {
+        throw new Error(`No job with ID ${request.jobId}`)
+    }
+    if (!isProtocaasJob(job)) {
+        console.warn(job)
+        throw new Error('Invalid job in database (2)')
+    }
+
+    if (job.jobPrivateKey !== request.jobPrivateKey) {
+        throw new Error('Invalid job private key')
+    }
+
+    const existing = await consoleOutputsCollection.findOne({jobId: request.jobId})
+    const size: number = existing ? existing.size : 0
+    let head: Buffer = existing ? Buffer.from((existing.head as Binary).buffer) : Buffer.alloc(0)
+    let tail: Buffer = existing ? Buffer.from((existing.tail as Binary).buffer) : Buffer.alloc(0)
+
+    let data = gunzipSync(Buffer.from(request.data, 'base64'))
+    if ((request.offset > size) || (request.offset + data.length < size)) {
+        // not contiguous with what we have, so the processor needs to continue from size
+        return {
+            type: 'processor.appendJobConsoleOutput',
+            success: false,
+            consoleOutputSize: size
+        }
+    }
+    // the part of a repeated segment (e.g., a retried request) that we already have is skipped
+    data = data.subarray(size - request.offset)
+    if (data.length === 0) {
+        return {
+            type: 'processor.appendJobConsoleOutput',
+            success: true,
+            consoleOutputSize: size
+        }
+    }
+
+    const bucket: Bucket = {
+        uri: process.env['OUTPUT_BUCKET_URI'] || '',
+        credentials: process.env['OUTPUT_BUCKET_CREDENTIALS'] || ''
+    }
+    // stored before the segment is accepted, so that an accepted segment is never missing from the bucket
+    if ((bucket.uri) && (bucket.credentials)) {
+        await putObject(bucket, {
+            Bucket: bucketNameFromUri(bucket.uri),
+            Key: `protocaas-console-output/${request.jobId}/${String(size).padStart(12, '0')}.gz`,
+            Body: request.offset === size ? Buffer.from(request.data, 'base64') : gzipSync(data)
+        })
+    }
+
+    if (head.length < headSize) {
+        const n = Math.min(headSize - head.length, data.length)
+        head = Buffer.concat([head, data.subarray(0, n)])
+    }
+    tail = Buffer.concat([tail, data])
+    if (tail.length > tailSize) {
+        tail = tail.subarray(tail.length - tailSize)
+    }
+    const newSize = size + data.length
+
+    // only apply the segment if nothing else was appended in the meantime
+    // (for the first segment, the unique index makes the upsert fail if another one created the document first)
+    let applied: boolean
+    try {
+        const result = await consoleOutputsCollection.updateOne({
+            jobId: request.jobId,
+            size
+        }, {
+            $set: {jobId: request.jobId, size: newSize, head: new Binary(head), tail: new Binary(tail)}
+        }, {
+            upsert: size === 0
+        })
+        applied = (result.modifiedCount > 0) || (result.upsertedCount > 0)
+    }
+    catch(err) {
+        if ((err instanceof MongoServerError) && (err.code === 11000)) {
+            applied = false // duplicate key
+        }
+        else throw err
+    }
+    if (!applied) {
+        const current = await consoleOutputsCollection.findOne({jobId: request.jobId})
+        return {
+            type: 'processor.appendJobConsoleOutput',
+            success: false,
+            consoleOutputSize: current ? current.size : 0
+        }
+    }
+
+    await jobsCollection.updateOne({
+        jobId: request.jobId
+    }, {
+        $set: {
+            consoleOutput: renderConsoleOutput(head, tail, newSize)
+        }
+    })
+
+    return {
+        type: 'processor.appendJobConsoleOutput',
+        success: true,
+        consoleOutputSize: newSize
+    }
+}
+
+const renderConsoleOutput = (head: Buffer, tail: Buffer, size: number) => {
+    if (head.length + tail.length >= size) {
+        // the tail overlaps the head, so together they are the whole output
+        const all = Buffer.concat([head, tail.subarray(head.length + tail.length - size)])
+        return applyCarriageReturns(all.toString('utf-8'))
+    }
+    // a multibyte character split at the edge of the head or the tail would otherwise be rendered as U+FFFD
+    const head2 = head.subarray(0, getHeadEnd(head))
+    const tail2 = tail.subarray(getTailStart(tail))
+    const numOmitted = size - head2.length - tail2.length
+    return applyCarriageReturns(head2.toString('utf-8')) + `\n... (${numOmitted} bytes omitted) ...\n` + applyCarriageReturns(tail2.toString('utf-8'))
+}
+
+// The end of the head: after its last newline, or else before an incomplete utf-8 character at its end
+const getHeadEnd = (head: Buffer) => {
+    const i = head.lastIndexOf(0x0a)
+    if ((i >= 0) && (i >= head.length - maxLineTrimSize)) return i + 1
+    let j = head.length
+    // back over the continuation bytes (10xxxxxx) to the lead byte of the last character
+    while ((j > 0) && (head.length - j < 4) && ((head[j - 1] & 0xc0) === 0x80)) j--
+    if (j === 0) return head.length
+    const lead = head[j - 1]
+    const charLength = lead >= 0xf0 ? 4 : lead >= 0xe0 ? 3 : lead >= 0xc0 ? 2 : 1
+    return (j - 1 + charLength > head.length) ? j - 1 : head.length
+}
+
+// The start of the tail: after its first newline, or else after the continuation bytes of a character that began before it
+const getTailStart = (tail: Buffer) => {
+    const i = tail.indexOf(0x0a)
+    if ((i >= 0) && (i < maxLineTrimSize)) return i + 1
+    let j = 0
+    while ((j < tail.length) && (j < 3) && ((tail[j] & 0xc0) === 0x80)) j++
+    return j
+}
+
+// Same as the console output buffer of the processor: a carriage return erases the current line, but is itself kept
+const applyCarriageReturns = (text: string) => {
+    if (!text.includes('\r')) return text
+    return text.split('\n').map(line => {
+        const i = line.lastIndexOf('\r')
+        return i >= 0 ? line.slice(i) : line
+    }).join('\n')
+}
+
+export default processorAppendJobConsoleOutputHandler
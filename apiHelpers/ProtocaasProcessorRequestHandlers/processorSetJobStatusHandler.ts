@@ -1,6 +1,6 @@
 import { isProtocaasFile, isProtocaasJob } from "../../src/types/protocaas-types";
 import { getMongoClient } from "../getMongoClient";
-import getPubnubClient from "../getPubnubClient";
+import publishComputeResourceMessage from "../publishComputeResourceMessage";
 import removeIdField from "../removeIdField";
 import { ProcessorSetJobStatusRequest, ProcessorSetJobStatusResponse } from "./ProtocaasProcessorRequest";
 import setFileHandler from "../ProtocaasRequestHandlers/setFileHandler";
@@ -75,6 +75,16 @@ const processorSetJobStatusHandler = async (request: ProcessorSetJobStatusReques
         }
     }
 
+    if (request.resourceUsage) {
+        if ((newStatus !== 'completed') && (newStatus !== 'failed')) {
+            return {
+                type: 'processor.setJobStatus',
+                success: false,
+                error: `Cannot set job resource usage when status is ${newStatus}`
+            }
+        }
+    }
+
     if (newStatus === 'completed') {
         // we need to create the output files before marking the job as completed
         const outputBucketBaseUrl = process.env['OUTPUT_BUCKET_BASE_URL'] || ''
@@ -107,9 +117,13 @@ const processorSetJobStatusHandler = async (request: ProcessorSetJobStatusReques
 
     const update: {[k: string]: any} = {}
     update['status'] = newStatus
+    update['timestampModified'] = Date.now() / 1000
     if (request.error) {
         update['error'] = request.error
     }
+    if (request.resourceUsage) {
+        update['resourceUsage'] = request.resourceUsage
+    }
     if (newStatus === 'queued') {
         update['timestampQueued'] = Date.now() / 1000
     }
@@ -132,20 +146,14 @@ const processorSetJobStatusHandler = async (request: ProcessorSetJobStatusReques
         $set: update
     })
 
-    const pnClient = await getPubnubClient()
-    if (pnClient) {
-        await pnClient.publish({
-            channel: job.computeResourceId,
-            message: {
-                type: 'jobStatusChanged',
-                workspaceId: job.workspaceId,
-                projectId: job.projectId,
-                computeResourceId: job.computeResourceId,
-                jobId: job.jobId,
-                status: newStatus
-            }
-        })
-    }
+    await publishComputeResourceMessage(job.computeResourceId, {
+        type: 'jobStatusChanged',
+        workspaceId: job.workspaceId,
+        projectId: job.projectId,
+        computeResourceId: job.computeResourceId,
+        jobId: job.jobId,
+        status: newStatus
+    })
 
     return {
         type: 'processor.setJobStatus',
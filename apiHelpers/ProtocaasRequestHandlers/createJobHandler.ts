@@ -3,7 +3,7 @@ import { CreateJobRequest, CreateJobResponse, DeleteFileRequest, DeleteJobReques
 import createRandomId from "../createRandomId";
 import { getMongoClient } from "../getMongoClient";
 import getProject from "../getProject";
-import getPubnubClient from "../getPubnubClient";
+import publishComputeResourceMessage from "../publishComputeResourceMessage";
 import getWorkspace from "../getWorkspace";
 import getWorkspaceRole from "../getWorkspaceRole";
 import removeIdField from "../removeIdField";
@@ -146,6 +146,7 @@ const createJobHandler = async (request: CreateJobRequest, o: {verifiedClientId?
         inputParameters: request.inputParameters,
         outputFiles,
         timestampCreated: Date.now() / 1000,
+        timestampModified: Date.now() / 1000,
         computeResourceId,
         status: 'pending',
         processorSpec: request.processorSpec
@@ -155,20 +156,13 @@ const createJobHandler = async (request: CreateJobRequest, o: {verifiedClientId?
     }
     await jobsCollection.insertOne(job)
 
-    const pnClient = await getPubnubClient()
-    if (pnClient) {
-        await pnClient.publish({
-            channel: computeResourceId,
-            message: {
-                type: 'newPendingJob',
-                workspaceId,
-                projectId: request.projectId,
-                computeResourceId,
-                jobId
-            }
-        })
-        
-    }
+    await publishComputeResourceMessage(computeResourceId, {
+        type: 'newPendingJob',
+        workspaceId,
+        projectId: request.projectId,
+        computeResourceId,
+        jobId
+    })
 
     return {
         type: 'createJob',
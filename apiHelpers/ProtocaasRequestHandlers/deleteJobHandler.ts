@@ -3,6 +3,7 @@ import getProject from "../getProject";
 import { getMongoClient } from "../getMongoClient";
 import getWorkspace from "../getWorkspace";
 import getWorkspaceRole from "../getWorkspaceRole";
+import publishComputeResourceMessage from "../publishComputeResourceMessage";
 import { cleanupProject } from "./deleteFileHandler";
 
 const deleteJobHandler = async (request: DeleteJobRequest, o: {verifiedClientId?: string, verifiedUserId?: string}): Promise<DeleteJobResponse> => {
@@ -24,8 +25,23 @@ const deleteJobHandler = async (request: DeleteJobRequest, o: {verifiedClientId?
     }
 
     const jobsCollection = client.db('protocaas').collection('jobs')
+    const job = await jobsCollection.findOne({jobId: request.jobId})
     await jobsCollection.deleteOne({jobId: request.jobId})
 
+    // so that the compute resource stops the job right away, rather than when the job next checks its status
+    if ((job) && (job.computeResourceId) && (!['completed', 'failed'].includes(job.status))) {
+        await publishComputeResourceMessage(job.computeResourceId, {
+            type: 'jobCanceled',
+            workspaceId: request.workspaceId,
+            projectId: request.projectId,
+            computeResourceId: job.computeResourceId,
+            jobId: request.jobId
+        })
+    }
+
+    const consoleOutputsCollection = client.db('protocaas').collection('jobConsoleOutputs')
+    await consoleOutputsCollection.deleteOne({jobId: request.jobId})
+
     const projectsCollection = client.db('protocaas').collection('projects')
     await projectsCollection.updateOne({projectId: request.projectId}, {$set: {timestampModified: Date.now() / 1000}})
 
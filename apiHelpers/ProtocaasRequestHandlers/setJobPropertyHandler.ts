@@ -1,7 +1,7 @@
 import { SetJobPropertyRequest, SetJobPropertyResponse } from "../../src/types/ProtocaasRequest";
 import { isProtocaasJob } from "../../src/types/protocaas-types";
 import { getMongoClient } from "../getMongoClient";
-import getPubnubClient from "../getPubnubClient";
+import publishComputeResourceMessage from "../publishComputeResourceMessage";
 import removeIdField from "../removeIdField";
 
 const setJobPropertyHandler = async (request: SetJobPropertyRequest, o: {verifiedClientId?: string, verifiedUserId?: string}): Promise<SetJobPropertyResponse> => {
@@ -66,6 +66,12 @@ const setJobPropertyHandler = async (request: SetJobPropertyRequest, o: {verifie
         throw new Error(`Invalid property: ${request.property}`)
     }
 
+    if (request.property !== 'consoleOutput') {
+        // compute resources sync unfinished jobs incrementally based on this timestamp
+        // console output is not relevant to them, so it does not count as a modification
+        update.timestampModified = Date.now() / 1000
+    }
+
     if (request.computeResourceNodeId) {
         update.computeResourceNodeId = request.computeResourceNodeId
     }
@@ -130,20 +136,14 @@ const setJobPropertyHandler = async (request: SetJobPropertyRequest, o: {verifie
     }
 
     if (request.property === 'status') {
-        const pnClient = await getPubnubClient()
-        if (pnClient) {
-            await pnClient.publish({
-                channel: job.computeResourceId,
-                message: {
-                    type: 'jobStatusChanged',
-                    workspaceId: request.workspaceId,
-                    projectId: request.projectId,
-                    computeResourceId: job.computeResourceId,
-                    jobId: job.jobId,
-                    status: request.value
-                }
-            })
-        }
+        await publishComputeResourceMessage(job.computeResourceId, {
+            type: 'jobStatusChanged',
+            workspaceId: request.workspaceId,
+            projectId: request.projectId,
+            computeResourceId: job.computeResourceId,
+            jobId: job.jobId,
+            status: request.value
+        })
     }
 
     return {
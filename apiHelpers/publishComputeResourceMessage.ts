@@ -0,0 +1,38 @@
+import getPubnubClient from "./getPubnubClient";
+
+// Publishes a message to the compute resource nodes of computeResourceId, on
+// PubNub (channel = compute resource ID) and/or on the self-hosted relay (topic
+// = compute resource ID), whichever are configured
+export const publishComputeResourceMessage = async (computeResourceId: string, message: {[key: string]: any}) => {
+    const pnClient = await getPubnubClient()
+    if (pnClient) {
+        await pnClient.publish({
+            channel: computeResourceId,
+            message
+        })
+    }
+    const PUBSUB_RELAY_URL = process.env['PUBSUB_RELAY_URL']
+    if (PUBSUB_RELAY_URL) {
+        const headers: {[key: string]: string} = {'Content-Type': 'application/json'}
+        const PUBSUB_RELAY_PUBLISH_TOKEN = process.env['PUBSUB_RELAY_PUBLISH_TOKEN']
+        if (PUBSUB_RELAY_PUBLISH_TOKEN) {
+            headers['Authorization'] = `Bearer ${PUBSUB_RELAY_PUBLISH_TOKEN}`
+        }
+        try {
+            const response = await fetch(`${PUBSUB_RELAY_URL.replace(/\/+$/, '')}/publish`, {
+                method: 'POST',
+                headers,
+                body: JSON.stringify({topic: computeResourceId, message})
+            })
+            if (!response.ok) {
+                console.warn(`Unable to publish to pubsub relay: ${response.status} ${response.statusText}`)
+            }
+        }
+        catch (err) {
+            // the nodes resync periodically, so a lost message only delays them
+            console.warn('Unable to publish to pubsub relay', err)
+        }
+    }
+}
+
+export default publishComputeResourceMessage
@@ -0,0 +1,98 @@
+# Throughput of the console output capture of _run_job, for a job that writes a lot of output
+#
+# python devel/benchmark_console_capture.py [num_mb]
+
+import os
+import sys
+import time
+import queue
+import random
+import threading
+import subprocess
+from protocaas.sdk._run_job import ConsoleOutputBuffer, _read_output
+
+
+# writes lines and progress bars (carriage returns) to stdout
+child_script = '''
+import sys
+num_bytes = int(sys.argv[1])
+line = b'x' * 70 + b'\\n'
+progress = b''.join(b'\\r%d%%' % i for i in range(100)) + b'\\n'
+out = sys.stdout.buffer
+n = 0
+while n < num_bytes:
+    block = line * 100 + progress
+    out.write(block)
+    n += len(block)
+out.flush()
+'''
+
+def _capture_old(cmd):
+    # the capture before ConsoleOutputBuffer: one byte at a time through a queue, quadratic appends
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    outq = queue.Queue()
+    def output_reader():
+        while True:
+            x = proc.stdout.read(1)
+            if len(x) == 0:
+                break
+            outq.put(x)
+    t = threading.Thread(target=output_reader)
+    t.start()
+    all_output = b''
+    last_newline_index_in_output = -1
+    while True:
+        try:
+            x = outq.get(timeout=0.1)
+        except queue.Empty:
+            if not t.is_alive() and outq.empty():
+                break
+            continue
+        if x == b'\n':
+            last_newline_index_in_output = len(all_output)
+        if x == b'\r':
+            all_output = all_output[:last_newline_index_in_output + 1]
+        all_output += x
+    proc.wait()
+    return all_output
+
+def _capture_new(cmd):
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    console_output = ConsoleOutputBuffer()
+    _read_output(proc.stdout.fileno(), console_output)
+    proc.wait()
+    return bytes(console_output._data)
+
+def _check_same_as_old():
+    # random chunking of random newline / carriage return heavy output
+    rng = random.Random(0)
+    data = bytes(rng.choice(b'ab\n\r') for _ in range(20000))
+    expected = b''
+    last_newline_index = -1
+    for i in range(len(data)):
+        x = data[i:i + 1]
+        if x == b'\n':
+            last_newline_index = len(expected)
+        if x == b'\r':
+            expected = expected[:last_newline_index + 1]
+        expected += x
+    buf = ConsoleOutputBuffer()
+    i = 0
+    while i < len(data):
+        n = rng.randint(1, 500)
+        buf.append(data[i:i + n])
+        i += n
+    assert bytes(buf._data) == expected
+
+def main():
+    _check_same_as_old()
+    num_mb = float(sys.argv[1]) if len(sys.argv) > 1 else 100
+    for label, capture, mb in [('old', _capture_old, 1), ('new', _capture_new, num_mb)]:
+        num_bytes = int(mb * 1024 * 1024)
+        timer = time.perf_counter()
+        output = capture([sys.executable, '-c', child_script, str(num_bytes)])
+        elapsed = time.perf_counter() - timer
+        print(f'{label}: {mb:g} MB in {elapsed:.2f} sec ({mb / elapsed:.1f} MB/sec), {len(output)} bytes kept')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+# Micro-benchmark of message signing, as done by the compute resource daemon for every API request
+#
+# python devel/benchmark_signing.py
+
+import time
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+from protocaas.crypto_keys import generate_keypair, sign_message, Signer, _deterministic_json_dumps, _sha1_of_string
+
+
+def _sign_message_uncached(msg: dict, public_key_hex: str, private_key_hex: str) -> str:
+    # what sign_message did before the Signer: parse the keys, sign and verify on every call
+    msg_json = _deterministic_json_dumps(msg)
+    msg_bytes = bytes.fromhex(_sha1_of_string(msg_json))
+    privk = Ed25519PrivateKey.from_private_bytes(bytes.fromhex(private_key_hex))
+    pubk = Ed25519PublicKey.from_public_bytes(bytes.fromhex(public_key_hex))
+    signature = privk.sign(msg_bytes).hex()
+    pubk.verify(bytes.fromhex(signature), msg_bytes)
+    return signature
+
+def _time_it(label: str, func, num_iterations: int):
+    timer = time.perf_counter()
+    for i in range(num_iterations):
+        func(i)
+    elapsed = time.perf_counter() - timer
+    print(f'{label}: {elapsed / num_iterations * 1e6:.1f} us per signature')
+
+def main():
+    public_key_hex, private_key_hex = generate_keypair()
+    constant_msg = {'type': 'computeResource.getUnfinishedJobs'}
+    assert sign_message(constant_msg, public_key_hex, private_key_hex) == _sign_message_uncached(constant_msg, public_key_hex, private_key_hex)
+
+    num_iterations = 5000
+    _time_it('uncached, constant message', lambda i: _sign_message_uncached(constant_msg, public_key_hex, private_key_hex), num_iterations)
+    _time_it('sign_message, constant message', lambda i: sign_message(constant_msg, public_key_hex, private_key_hex), num_iterations)
+    _time_it('sign_message, distinct messages', lambda i: sign_message({'type': 'x', 'i': i}, public_key_hex, private_key_hex), num_iterations)
+    signer = Signer(public_key_hex, private_key_hex)
+    _time_it('Signer.sign, constant message', lambda i: signer.sign(constant_msg), num_iterations)
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 import click
 from .compute_resource.init_compute_resource_node import init_compute_resource_node as init_compute_resource_node_function
 from .compute_resource.start_compute_resource_node import start_compute_resource_node as start_compute_resource_node_function
+from .compute_resource.PubsubRelayServer import start_pubsub_relay as start_pubsub_relay_function
 
 @click.group(help="protocaas command line interface")
 def main():
@@ -16,5 +17,12 @@ def init_compute_resource_node(compute_resource_id: str, compute_resource_privat
 def start_compute_resource_node():
     start_compute_resource_node_function(dir='.')
 
+@click.command(help="Start a pubsub relay that compute resource nodes can use instead of PubNub")
+@click.option('--host', default='0.0.0.0', help='Host to listen on')
+@click.option('--port', default=8765, help='Port to listen on')
+def start_pubsub_relay(host: str, port: int):
+    start_pubsub_relay_function(host=host, port=port)
+
 main.add_command(init_compute_resource_node)
-main.add_command(start_compute_resource_node)
\ No newline at end of file
+main.add_command(start_compute_resource_node)
+main.add_command(start_pubsub_relay)
\ No newline at end of file
@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Union
 from ..sdk._post_api_request import _post_api_request
 
 
@@ -25,6 +25,11 @@ class Project:
             if f._file_name == file_name:
                 return f
         raise Exception(f'File not found: {file_name}')
+    def get_job(self, job_id: str) -> 'ProjectJob':
+        for j in self._jobs:
+            if j._job_id == job_id:
+                return j
+        raise Exception(f'Job not found: {job_id}')
 
 class ProjectFile:
     def __init__(self, file_data: dict) -> None:
@@ -108,6 +113,13 @@ class ProjectJob:
         self._timestamp_finished = job_data.get('timestampFinished', None)
         self._output_file_ids = job_data.get('outputFileIds', None)
         self._processor_spec = job_data['processorSpec']
+        self._resource_usage = job_data.get('resourceUsage', None)
+    def get_resource_usage(self) -> Union[dict, None]:
+        """The resources used by the job (cpu time, peak memory, I/O and a time series), or None if it was not reported
+
+        This is reported when the job finishes, see ProtocaasJobResourceUsage in protocaas-types.ts
+        """
+        return self._resource_usage
 
 def load_project(project_id: str) -> Project:
     req = {
@@ -181,4 +193,17 @@ def load_project(project_id: str) -> Project:
 #     timestampFinished?: number
 #     outputFileIds?: string[]
 #     processorSpec: ComputeResourceSpecProcessor
+#     resourceUsage?: {
+#         wallTimeSec: number
+#         cpuTimeSec: number
+#         meanCpus: number
+#         peakMemoryGb: number
+#         ioReadBytes: number
+#         ioWriteBytes: number
+#         timeSeries?: {
+#             intervalSec: number
+#             cpus: number[]
+#             memoryGb: number[]
+#         }
+#     }
 # }
\ No newline at end of file
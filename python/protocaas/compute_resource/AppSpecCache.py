@@ -0,0 +1,65 @@
+from typing import Union
+import os
+import json
+import shutil
+import hashlib
+import subprocess
+
+
+class AppSpecCache:
+    """On-disk cache of app specs, so that a restart does not re-run unchanged executables
+
+    The key is the executable path plus a fingerprint of what would be run:
+    the image ID (docker) or the digest-named SIF file (singularity) for
+    containerized apps, and the modification time and size of the executable
+    otherwise. Apps without a fingerprint (e.g., the docker image has not been
+    pulled yet) are not looked up.
+    """
+    def __init__(self, *, cache_dir: str):
+        self._cache_dir = cache_dir
+        os.makedirs(self._cache_dir, exist_ok=True)
+    def get(self, key: str) -> Union[dict, None]:
+        path = self._get_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r') as f:
+                x = json.load(f)
+        except Exception as e:
+            print(f'Unable to read cached app spec {path}: {str(e)}')
+            return None
+        if x.get('key', None) != key:
+            return None
+        return x['spec']
+    def set(self, key: str, spec: dict):
+        path = self._get_path(key)
+        tmp_path = f'{path}.{os.urandom(4).hex()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'key': key, 'spec': spec}, f)
+        os.replace(tmp_path, path)
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self._cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+def _get_app_spec_cache_key(*, executable_path: str, container: Union[str, None], container_image_path: Union[str, None]) -> Union[str, None]:
+    if not container:
+        path = shutil.which(executable_path) or executable_path
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return f'{executable_path}|file|{st.st_mtime_ns}|{st.st_size}'
+    container_method = os.environ.get('CONTAINER_METHOD', 'docker')
+    if container_method == 'singularity':
+        if not container_image_path:
+            return None
+        # the SIF is named after the digest of the image
+        return f'{executable_path}|{container}|sif|{os.path.basename(container_image_path)}|{os.path.getsize(container_image_path)}'
+    if container_method == 'docker':
+        try:
+            result = subprocess.run(['docker', 'image', 'inspect', '--format', '{{.Id}}', container], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, timeout=60)
+        except Exception:
+            return None
+        if result.returncode != 0 or not result.stdout.strip():
+            return None # not pulled yet
+        return f'{executable_path}|{container}|docker|{result.stdout.strip()}'
+    return None
@@ -0,0 +1,193 @@
+from typing import Any, Dict, List, Tuple
+import os
+import math
+import time
+import threading
+from ._resource_requirements import ResourceRequirements
+
+# You must first setup the AWS credentials
+# You can do this in multiple ways like using the aws configure command
+# or by setting environment variables (AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, etc.).
+
+# a job definition that was validated is trusted for this long before it is looked up again
+job_definition_cache_ttl_sec = 60 * 10
+
+# the daemon submits at most this many jobs at once, so the client needs as many connections
+max_concurrent_aws_batch_submissions = 16
+
+# what every job used to get, for processors that do not declare num_cpus / memory_gb
+default_aws_batch_resource_requirements = ResourceRequirements(num_cpus=4, memory_gb=16, disk_gb=0)
+
+# describe_jobs accepts at most this many job IDs per call
+max_jobs_per_describe_jobs = 100
+
+# statuses of a Batch job after which it will not run (any more)
+aws_batch_terminal_statuses = ['SUCCEEDED', 'FAILED']
+
+class AwsBatchExecutor:
+    """Submits jobs to AWS Batch
+
+    The boto3 client is created once and reused, and job definitions are
+    validated once per TTL rather than once per job. This is safe to use from
+    multiple threads, so that a burst of jobs can be submitted concurrently.
+
+    For testing, a client can be passed in (e.g., one wrapped in a botocore
+    Stubber, or one created under moto).
+    """
+    def __init__(self, *, client: Any = None):
+        self._client = client
+        self._client_lock = threading.Lock()
+        # (job definition, container, command) -> time of validation
+        self._validated_job_definitions: Dict[Tuple[str, str, str], float] = {}
+        self._job_definitions_lock = threading.Lock()
+    def submit_job(self, *,
+        job_id: str,
+        job_private_key: str,
+        aws_batch_job_queue: str,
+        aws_batch_job_definition: str,
+        container: str, # for verifying consistent with job definition
+        command: str, # for verifying consistent with job definition
+        resource_requirements: ResourceRequirements = None,
+        env_vars: Dict[str, str] = None # in addition to the ones that every job gets
+    ) -> str:
+        if resource_requirements is None:
+            resource_requirements = default_aws_batch_resource_requirements
+        client = self._get_client()
+        self._validate_job_definition(
+            aws_batch_job_definition=aws_batch_job_definition,
+            container=container,
+            command=command
+        )
+
+        job_name = f'protocaas-job-{job_id}'
+
+        env_vars = {
+            **(env_vars or {}),
+            'JOB_ID': job_id,
+            'JOB_PRIVATE_KEY': job_private_key,
+            'APP_EXECUTABLE': command
+        }
+        from ._start_job import _get_kachery_cloud_credentials # avoid circular import
+        kachery_cloud_client_id, kachery_cloud_private_key = _get_kachery_cloud_credentials()
+        if kachery_cloud_client_id is not None:
+            env_vars['KACHERY_CLOUD_CLIENT_ID'] = kachery_cloud_client_id
+            env_vars['KACHERY_CLOUD_PRIVATE_KEY'] = kachery_cloud_private_key
+
+        response = client.submit_job(
+            jobName=job_name,
+            jobQueue=aws_batch_job_queue,
+            jobDefinition=aws_batch_job_definition,
+            containerOverrides={
+                'environment': [
+                    {
+                        'name': k,
+                        'value': v
+                    }
+                    for k, v in env_vars.items()
+                ],
+                'resourceRequirements': [
+                    {
+                        'type': 'VCPU',
+                        'value': str(max(1, math.ceil(resource_requirements.num_cpus)))
+                    },
+                    {
+                        'type': 'MEMORY', # MiB
+                        'value': str(max(1, math.ceil(resource_requirements.memory_gb * 1024)))
+                    }
+                ]
+            }
+        )
+
+        batch_job_id = response['jobId']
+        print(f'AWS Batch job submitted: {job_id} {batch_job_id}')
+        return batch_job_id
+    def terminate_job(self, batch_job_id: str, *, reason: str):
+        """Cancel the Batch job if it has not started, or stop its container if it is running"""
+        client = self._get_client()
+        client.terminate_job(jobId=batch_job_id, reason=reason)
+    def describe_jobs(self, batch_job_ids: List[str]) -> Dict[str, dict]:
+        """Returns a map from Batch job ID to job description. Jobs that Batch does not know about are left out."""
+        client = self._get_client()
+        ret: Dict[str, dict] = {}
+        for i in range(0, len(batch_job_ids), max_jobs_per_describe_jobs):
+            resp = client.describe_jobs(jobs=batch_job_ids[i:i + max_jobs_per_describe_jobs])
+            for job in resp['jobs']:
+                ret[job['jobId']] = job
+        return ret
+    def _get_client(self):
+        with self._client_lock:
+            if self._client is None:
+                self._client = _create_batch_client()
+            return self._client
+    def _validate_job_definition(self, *, aws_batch_job_definition: str, container: str, command: str):
+        key = (aws_batch_job_definition, container, command)
+        with self._job_definitions_lock:
+            timestamp_validated = self._validated_job_definitions.get(key, None)
+        if timestamp_validated is not None and time.time() - timestamp_validated < job_definition_cache_ttl_sec:
+            return
+        # Concurrent submissions may look up the same definition, which is harmless
+        job_def_resp = self._get_client().describe_job_definitions(jobDefinitionName=aws_batch_job_definition)
+        job_defs = job_def_resp['jobDefinitions']
+        if len(job_defs) == 0:
+            raise Exception(f'Job definition not found: {aws_batch_job_definition}')
+        job_def = job_defs[0]
+        job_def_container = job_def['containerProperties']['image']
+        if job_def_container != container:
+            raise Exception(f'Job definition container does not match: {job_def_container} != {container}')
+        job_def_command = job_def['containerProperties']['command']
+        if not _command_matches(job_def_command, command):
+            raise Exception(f'Job definition command does not match: {job_def_command} != {command}')
+        with self._job_definitions_lock:
+            self._validated_job_definitions[key] = time.time()
+
+def _create_batch_client():
+    import boto3
+    from botocore.config import Config
+
+    aws_access_key_id = os.getenv('BATCH_AWS_ACCESS_KEY_ID', None)
+    if aws_access_key_id is None:
+        raise Exception('BATCH_AWS_ACCESS_KEY_ID is not set')
+    aws_secret_access_key = os.getenv('BATCH_AWS_SECRET_ACCESS_KEY', None)
+    if aws_secret_access_key is None:
+        raise Exception('BATCH_AWS_SECRET_ACCESS_KEY is not set')
+    aws_region = os.getenv('BATCH_AWS_REGION', None)
+    if aws_region is None:
+        raise Exception('BATCH_AWS_REGION is not set')
+
+    return boto3.client(
+        'batch',
+        aws_access_key_id=aws_access_key_id,
+        aws_secret_access_key=aws_secret_access_key,
+        region_name=aws_region,
+        config=Config(max_pool_connections=max_concurrent_aws_batch_submissions)
+    )
+
+def _get_aws_batch_job_failure_reason(job: dict) -> str:
+    # The reason of the container (e.g., CannotPullContainerError, OutOfMemoryError) is the most specific
+    attempts = job.get('attempts', [])
+    if len(attempts) > 0:
+        container_reason = attempts[-1].get('container', {}).get('reason', None)
+        if container_reason:
+            return container_reason
+    container_reason = job.get('container', {}).get('reason', None)
+    if container_reason:
+        return container_reason
+    return job.get('statusReason', '') or 'unknown reason'
+
+def _aws_batch_job_lost_its_host(job: dict) -> bool:
+    # e.g., a spot instance that was reclaimed: "Host EC2 (instance i-0123) terminated."
+    reasons = [job.get('statusReason', '')] + [a.get('statusReason', '') for a in job.get('attempts', [])]
+    return any(r.startswith('Host EC2') for r in reasons if r)
+
+def _command_matches(cmd1: List[str], cmd2: str) -> bool:
+    return ' '.join(cmd1) == cmd2
+
+_global_aws_batch_executor: AwsBatchExecutor = None
+_global_aws_batch_executor_lock = threading.Lock()
+
+def _get_aws_batch_executor() -> AwsBatchExecutor:
+    global _global_aws_batch_executor
+    with _global_aws_batch_executor_lock:
+        if _global_aws_batch_executor is None:
+            _global_aws_batch_executor = AwsBatchExecutor()
+        return _global_aws_batch_executor
@@ -0,0 +1,176 @@
+from typing import Dict, List, Union
+import os
+import time
+import threading
+import subprocess
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+
+
+# the pool keeps enough containers per image for the largest number of jobs of that image that ran at once during this window
+warm_pool_demand_window_sec = 60 * 10
+
+# label of the containers of the pool, so that leftovers from a previous run can be found
+warm_pool_label = 'protocaas-warm-pool'
+
+@dataclass
+class WarmContainer:
+    container_id: str
+    image: str
+    num_jobs: int = 0
+    job_id: Union[str, None] = None # the job that is running in the container, if any
+
+@dataclass
+class ImageDemand:
+    # (timestamp, number of running jobs of the image) samples over the demand window
+    samples: List[tuple] = field(default_factory=list)
+
+class DockerWarmPool:
+    """Idle docker containers that are ready to run local jobs
+
+    Instead of a cold `docker run` per job, a container of the app image is
+    started ahead of time (sleeping), with the jobs directory mounted at the
+    same path as on the host. A job is then run in it with `docker exec`, in
+    its own working directory. A container runs one job at a time, and is
+    replaced after DOCKER_WARM_POOL_MAX_JOBS_PER_CONTAINER jobs so that state
+    left behind by jobs does not accumulate.
+
+    The number of containers per image follows the recent demand for that
+    image, up to DOCKER_WARM_POOL_MAX_SIZE. Starting and removing containers
+    happens on a background thread, so it never delays starting a job.
+    """
+    def __init__(self, *, jobs_dir: str):
+        self._jobs_dir = os.path.abspath(jobs_dir)
+        self._max_jobs_per_container = int(os.getenv('DOCKER_WARM_POOL_MAX_JOBS_PER_CONTAINER', '') or 10)
+        self._max_size = int(os.getenv('DOCKER_WARM_POOL_MAX_SIZE', '') or 4)
+        self._containers: Dict[str, WarmContainer] = {} # by container id
+        self._job_images: Dict[str, str] = {} # image of each running job, whether in a warm container or not
+        self._demand: Dict[str, ImageDemand] = {} # by image
+        self._num_starting: Dict[str, int] = {} # by image
+        self._lock = threading.Lock()
+        self._maintenance_executor = ThreadPoolExecutor(max_workers=1)
+        self._maintenance_executor.submit(_remove_stale_containers)
+    def acquire(self, *, image: str, job_id: str) -> Union[str, None]:
+        """Reserve an idle container of the image for the job. Returns None if there is none, in which case the job should be started cold."""
+        with self._lock:
+            container = next((c for c in self._containers.values() if c.image == image and c.job_id is None), None)
+            if container is not None:
+                container.job_id = job_id
+                container.num_jobs += 1
+            self._job_images[job_id] = image
+            self._record_demand(image)
+        self.maintain()
+        return container.container_id if container is not None else None
+    def release(self, job_id: str):
+        """Called when the job has finished"""
+        with self._lock:
+            image = self._job_images.pop(job_id, None)
+            if image is None:
+                return
+            self._record_demand(image)
+            container = next((c for c in self._containers.values() if c.job_id == job_id), None)
+            if container is None:
+                return
+            container.job_id = None
+            if container.num_jobs >= self._max_jobs_per_container:
+                del self._containers[container.container_id]
+                self._maintenance_executor.submit(_remove_container, container.container_id)
+        self.maintain()
+    def kill_job(self, job_id: str) -> bool:
+        """Send SIGTERM to the processes of the job in its warm container. Returns False if the job is not running in a warm container.
+
+        Signalling the docker exec client does not reach the processes in the container, so they are signalled from inside it.
+        The container is retired once the job has exited, because the job may have been killed in the middle of anything.
+        """
+        with self._lock:
+            container = next((c for c in self._containers.values() if c.job_id == job_id), None)
+            if container is None:
+                return False
+            container.num_jobs = max(container.num_jobs, self._max_jobs_per_container)
+        # the container runs one job at a time, so this is every process of the job (kill -1 spares the sleep, which is pid 1)
+        cmd = ['docker', 'exec', container.container_id, 'sh', '-c', 'kill -TERM -1']
+        try:
+            subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=60)
+        except Exception as e:
+            print(f'Unable to kill job {job_id} in warm container {container.container_id[:12]}: {str(e)}')
+        return True
+    def maintain(self):
+        """Start or remove containers in the background so that each image has as many as it needs"""
+        self._maintenance_executor.submit(self._maintain)
+    def _maintain(self):
+        now = time.time()
+        to_start: List[str] = []
+        to_remove: List[str] = []
+        with self._lock:
+            for image, demand in list(self._demand.items()):
+                demand.samples = [s for s in demand.samples if now - s[0] < warm_pool_demand_window_sec]
+                target = min(self._max_size, max([s[1] for s in demand.samples], default=0))
+                containers = [c for c in self._containers.values() if c.image == image]
+                num_missing = target - len(containers) - self._num_starting.get(image, 0)
+                for _ in range(num_missing):
+                    to_start.append(image)
+                    self._num_starting[image] = self._num_starting.get(image, 0) + 1
+                idle_containers = [c for c in containers if c.job_id is None]
+                for c in idle_containers[:max(0, len(containers) - target)]:
+                    del self._containers[c.container_id]
+                    to_remove.append(c.container_id)
+                if len(demand.samples) == 0 and len(containers) == 0:
+                    del self._demand[image]
+        for container_id in to_remove:
+            _remove_container(container_id)
+        for image in to_start:
+            container_id = None
+            try:
+                container_id = self._start_container(image)
+            except Exception as e:
+                print(f'Unable to start warm container for {image}: {str(e)}')
+            with self._lock:
+                self._num_starting[image] -= 1
+                if container_id is not None:
+                    self._containers[container_id] = WarmContainer(container_id=container_id, image=image)
+    def _start_container(self, image: str) -> str:
+        cmd = [
+            'docker', 'run', '-d', '--rm',
+            '--label', f'{warm_pool_label}=1',
+            '-v', f'{self._jobs_dir}:{self._jobs_dir}',
+            '--entrypoint', 'sleep',
+            image,
+            'infinity'
+        ]
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=60 * 10)
+        if result.returncode != 0:
+            raise Exception(f'docker run failed: {result.stderr.strip()}')
+        container_id = result.stdout.strip()
+        print(f'Started warm container {container_id[:12]} for {image}')
+        return container_id
+    def _record_demand(self, image: str):
+        # must be called with the lock held
+        num_jobs = len([im for im in self._job_images.values() if im == image])
+        if image not in self._demand:
+            self._demand[image] = ImageDemand()
+        self._demand[image].samples.append((time.time(), num_jobs))
+
+def _get_docker_exec_command(*, container_id: str, working_dir: str, env_vars: dict, executable_path: str) -> List[str]:
+    cmd = ['docker', 'exec', '-w', working_dir]
+    for k, v in env_vars.items():
+        cmd.extend(['-e', f'{k}={v}'])
+    cmd.extend([container_id, executable_path])
+    return cmd
+
+def _remove_container(container_id: str):
+    try:
+        subprocess.run(['docker', 'rm', '-f', container_id], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=60)
+    except Exception as e:
+        print(f'Unable to remove warm container {container_id[:12]}: {str(e)}')
+
+def _remove_stale_containers():
+    # containers left by a previous run of the daemon, except those that are still running a job
+    try:
+        result = subprocess.run(['docker', 'ps', '-q', '--filter', f'label={warm_pool_label}'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, timeout=60)
+        for container_id in result.stdout.split():
+            result2 = subprocess.run(['docker', 'top', container_id, '-o', 'pid'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, timeout=60)
+            # header + the sleep process means that nothing else is running
+            if len(result2.stdout.strip().splitlines()) <= 2:
+                _remove_container(container_id)
+    except Exception as e:
+        print(f'Unable to remove stale warm containers: {str(e)}')
@@ -0,0 +1,96 @@
+from typing import List, Set
+import os
+import time
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from .JobJournal import JobJournal
+from .LocalJobScheduler import _get_float_env
+
+
+# how often the jobs directory is checked
+job_directory_collection_interval_sec = 60
+
+# a directory that was modified this recently is never removed, even if the journal does not know about its job
+job_directory_min_age_sec = 60 * 10
+
+# number of directories that are removed at once
+max_concurrent_job_directory_removals = 4
+
+class JobDirectoryCollector:
+    """Removes the working directories of finished jobs
+
+    A directory is removed when it is older than JOB_DIR_MAX_AGE_HOURS (default
+    24), or sooner, oldest first, when the disk of the jobs directory is more
+    than JOB_DIR_DISK_HIGH_WATER full (default 0.9), until it is below
+    JOB_DIR_DISK_LOW_WATER (default 0.8). The directories of jobs that are
+    active according to the job journal are never removed.
+
+    This runs in its own process because removing many small files (e.g., the
+    remfile caches) can take a long time.
+    """
+    def __init__(self, *, jobs_dir: str, journal_path: str):
+        self._jobs_dir = jobs_dir
+        self._journal_path = journal_path
+        self._max_age_sec = _get_float_env('JOB_DIR_MAX_AGE_HOURS', 24) * 60 * 60
+        self._high_water = _get_float_env('JOB_DIR_DISK_HIGH_WATER', 0.9)
+        self._low_water = _get_float_env('JOB_DIR_DISK_LOW_WATER', 0.8)
+        if self._low_water > self._high_water:
+            raise Exception(f'JOB_DIR_DISK_LOW_WATER ({self._low_water}) must not be greater than JOB_DIR_DISK_HIGH_WATER ({self._high_water})')
+        self._journal: JobJournal = None
+    def run_forever(self):
+        while True:
+            try:
+                self.collect_once()
+            except Exception as e:
+                print(f'Error cleaning up job directories: {str(e)}')
+            time.sleep(job_directory_collection_interval_sec)
+    def collect_once(self):
+        if not os.path.isdir(self._jobs_dir):
+            return
+        if self._journal is None:
+            self._journal = JobJournal(self._journal_path)
+        active_job_ids: Set[str] = set(e.job_id for e in self._journal.get_active_jobs())
+        now = time.time()
+        candidates = []
+        for entry in os.scandir(self._jobs_dir):
+            if not entry.is_dir(follow_symlinks=False) or entry.name in active_job_ids:
+                continue
+            try:
+                mtime = entry.stat(follow_symlinks=False).st_mtime
+            except FileNotFoundError:
+                continue
+            if now - mtime < job_directory_min_age_sec:
+                continue
+            candidates.append((mtime, entry.path))
+        candidates.sort() # oldest first
+
+        expired = [path for mtime, path in candidates if now - mtime > self._max_age_sec]
+        remaining = [path for mtime, path in candidates if now - mtime <= self._max_age_sec]
+        if len(expired) > 0:
+            print(f'Removing {len(expired)} old job directories')
+            self._remove_directories(expired)
+
+        if self._get_disk_usage_fraction() > self._high_water:
+            print(f'Disk of {self._jobs_dir} is more than {self._high_water * 100:.0f}% full, removing job directories')
+            # remove a batch at a time and check again, so that we stop once enough space is free
+            while len(remaining) > 0 and self._get_disk_usage_fraction() > self._low_water:
+                batch = remaining[:max_concurrent_job_directory_removals]
+                remaining = remaining[max_concurrent_job_directory_removals:]
+                self._remove_directories(batch)
+            if self._get_disk_usage_fraction() > self._low_water:
+                print(f'Disk of {self._jobs_dir} is still more than {self._low_water * 100:.0f}% full, but only directories of active jobs remain')
+    def _remove_directories(self, paths: List[str]):
+        with ThreadPoolExecutor(max_workers=max_concurrent_job_directory_removals) as executor:
+            list(executor.map(_remove_directory, paths))
+    def _get_disk_usage_fraction(self) -> float:
+        usage = shutil.disk_usage(self._jobs_dir)
+        return usage.used / usage.total
+
+def _remove_directory(path: str):
+    print(f'Removing job directory {path}')
+    shutil.rmtree(path, ignore_errors=True)
+
+def _run_job_directory_collector(jobs_dir: str, journal_path: str):
+    # the removals should not compete with the jobs for the CPU
+    os.nice(10)
+    JobDirectoryCollector(jobs_dir=jobs_dir, journal_path=journal_path).run_forever()
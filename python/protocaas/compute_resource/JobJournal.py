@@ -0,0 +1,188 @@
+from typing import List, Set, Union
+import time
+import sqlite3
+import threading
+from dataclasses import dataclass
+from ._resource_requirements import ResourceUsage
+
+
+# States that a job can have in the journal
+# * attempted: the daemon is about to start the job
+# * start_failed: starting the job failed
+# * started: the job was handed to its backend (process, slurm batch or aws batch job)
+# * requeued: the backend lost the job before it ran, and it is being submitted again
+# * pending / queued / starting / running: status reported by the server after the job was started
+# * finished: the job is no longer unfinished on the server (completed, failed or deleted)
+terminal_states = ['start_failed', 'finished']
+
+# resource usage is kept for this many recent runs of each processor
+max_resource_usage_samples_per_processor = 100
+
+@dataclass
+class JobJournalEntry:
+    """The journal record of a job that this node attempted to start"""
+    job_id: str
+    processor_name: str
+    resource_type: str
+    state: str
+    handle_type: Union[str, None] # 'pid' (the handle is <pid>:<start time>), 'slurm_batch', 'slurm_array_task' or 'aws_batch_job'
+    handle: Union[str, None]
+    timestamp_created: float
+    timestamp_updated: float
+
+class JobJournal:
+    """Durable record of the jobs started by this compute resource node
+
+    Stored as a SQLite database in WAL mode, so that a restarted daemon can
+    rebuild its state without asking the server about every job, and so that
+    other processes (e.g., the working directory cleanup) can read it while
+    the daemon writes.
+    """
+    def __init__(self, path: str):
+        self._path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                processor_name TEXT NOT NULL,
+                resource_type TEXT,
+                state TEXT NOT NULL,
+                handle_type TEXT,
+                handle TEXT,
+                timestamp_created REAL NOT NULL,
+                timestamp_updated REAL NOT NULL
+            )
+        ''')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS transitions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT NOT NULL,
+                state TEXT NOT NULL,
+                detail TEXT,
+                timestamp REAL NOT NULL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS transitions_job_id ON transitions (job_id)')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS resource_usage (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                processor_name TEXT NOT NULL,
+                job_id TEXT NOT NULL,
+                peak_memory_gb REAL NOT NULL,
+                mean_cpus REAL NOT NULL,
+                timestamp REAL NOT NULL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS resource_usage_processor_name ON resource_usage (processor_name)')
+    def record_start_attempt(self, *, job_id: str, processor_name: str, resource_type: str):
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.execute('BEGIN')
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO jobs (job_id, processor_name, resource_type, state, handle_type, handle, timestamp_created, timestamp_updated) VALUES (?, ?, ?, ?, NULL, NULL, ?, ?)',
+                    (job_id, processor_name, resource_type, 'attempted', now, now)
+                )
+                self._insert_transition(job_id, 'attempted', None, now)
+    def record_handle(self, *, job_id: str, handle_type: str, handle: str):
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.execute('BEGIN')
+                self._conn.execute(
+                    'UPDATE jobs SET state = ?, handle_type = ?, handle = ?, timestamp_updated = ? WHERE job_id = ?',
+                    ('started', handle_type, handle, now, job_id)
+                )
+                self._insert_transition(job_id, 'started', f'{handle_type}:{handle}', now)
+    def record_state(self, *, job_id: str, state: str, detail: str = None):
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.execute('BEGIN')
+                self._conn.execute(
+                    'UPDATE jobs SET state = ?, timestamp_updated = ? WHERE job_id = ?',
+                    (state, now, job_id)
+                )
+                self._insert_transition(job_id, state, detail, now)
+    def record_requeue(self, *, job_id: str, detail: str = None):
+        """The old handle is dropped, a new one is recorded when the job is submitted again"""
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.execute('BEGIN')
+                self._conn.execute(
+                    'UPDATE jobs SET state = ?, handle_type = NULL, handle = NULL, timestamp_updated = ? WHERE job_id = ?',
+                    ('requeued', now, job_id)
+                )
+                self._insert_transition(job_id, 'requeued', detail, now)
+    def get_num_transitions(self, *, job_id: str, state: str) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT COUNT(*) FROM transitions WHERE job_id = ? AND state = ?',
+                (job_id, state)
+            ).fetchone()
+        return row[0]
+    def record_resource_usage(self, *, job_id: str, processor_name: str, usage: ResourceUsage):
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.execute('BEGIN')
+                self._conn.execute(
+                    'INSERT INTO resource_usage (processor_name, job_id, peak_memory_gb, mean_cpus, timestamp) VALUES (?, ?, ?, ?, ?)',
+                    (processor_name, job_id, usage.peak_memory_gb, usage.mean_cpus, now)
+                )
+                self._conn.execute(
+                    'DELETE FROM resource_usage WHERE processor_name = ? AND id NOT IN (SELECT id FROM resource_usage WHERE processor_name = ? ORDER BY id DESC LIMIT ?)',
+                    (processor_name, processor_name, max_resource_usage_samples_per_processor)
+                )
+    def get_resource_usage_history(self, *, processor_name: str) -> List[ResourceUsage]:
+        """Oldest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT peak_memory_gb, mean_cpus FROM resource_usage WHERE processor_name = ? ORDER BY id',
+                (processor_name,)
+            ).fetchall()
+        return [ResourceUsage(peak_memory_gb=r[0], mean_cpus=r[1]) for r in rows]
+    def get_job(self, job_id: str) -> Union[JobJournalEntry, None]:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT job_id, processor_name, resource_type, state, handle_type, handle, timestamp_created, timestamp_updated FROM jobs WHERE job_id = ?',
+                (job_id,)
+            ).fetchone()
+        return JobJournalEntry(*row) if row is not None else None
+    def get_attempted_job_ids(self) -> Set[str]:
+        with self._lock:
+            rows = self._conn.execute('SELECT job_id FROM jobs').fetchall()
+        return set(r[0] for r in rows)
+    def get_active_jobs(self) -> List[JobJournalEntry]:
+        """Jobs that were started and are not known to be finished"""
+        placeholders = ', '.join('?' for _ in terminal_states)
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT job_id, processor_name, resource_type, state, handle_type, handle, timestamp_created, timestamp_updated FROM jobs WHERE state NOT IN ({placeholders})',
+                terminal_states
+            ).fetchall()
+        return [JobJournalEntry(*r) for r in rows]
+    def prune(self, *, older_than_sec: float):
+        """Forget finished jobs that have not been updated for a while"""
+        cutoff = time.time() - older_than_sec
+        placeholders = ', '.join('?' for _ in terminal_states)
+        with self._lock:
+            with self._conn:
+                self._conn.execute('BEGIN')
+                self._conn.execute(
+                    f'DELETE FROM transitions WHERE job_id IN (SELECT job_id FROM jobs WHERE state IN ({placeholders}) AND timestamp_updated < ?)',
+                    (*terminal_states, cutoff)
+                )
+                self._conn.execute(
+                    f'DELETE FROM jobs WHERE state IN ({placeholders}) AND timestamp_updated < ?',
+                    (*terminal_states, cutoff)
+                )
+    def _insert_transition(self, job_id: str, state: str, detail: Union[str, None], timestamp: float):
+        self._conn.execute(
+            'INSERT INTO transitions (job_id, state, detail, timestamp) VALUES (?, ?, ?, ?)',
+            (job_id, state, detail, timestamp)
+        )
@@ -0,0 +1,98 @@
+from typing import List, Tuple, Callable
+import os
+import shutil
+from ._resource_requirements import ResourceRequirements
+
+
+class LocalJobScheduler:
+    """Decides which pending local jobs fit on this node
+
+    The node capacity (CPUs, memory, disk) is detected automatically and can be
+    overridden with LOCAL_JOB_NUM_CPUS, LOCAL_JOB_MEMORY_GB and LOCAL_JOB_DISK_GB.
+    CPU and memory may be overcommitted by the factors LOCAL_JOB_CPU_OVERCOMMIT
+    and LOCAL_JOB_MEMORY_OVERCOMMIT (default 1, i.e., no overcommit). Disk is never
+    overcommitted.
+    """
+    def __init__(self, *, jobs_dir: str):
+        num_cpus = _get_float_env('LOCAL_JOB_NUM_CPUS', None)
+        if num_cpus is None:
+            num_cpus = _get_num_available_cpus()
+        memory_gb = _get_float_env('LOCAL_JOB_MEMORY_GB', None)
+        if memory_gb is None:
+            memory_gb = _get_total_memory_gb()
+        disk_gb = _get_float_env('LOCAL_JOB_DISK_GB', None)
+        if disk_gb is None:
+            disk_gb = _get_free_disk_gb(jobs_dir)
+        cpu_overcommit = _get_float_env('LOCAL_JOB_CPU_OVERCOMMIT', 1)
+        memory_overcommit = _get_float_env('LOCAL_JOB_MEMORY_OVERCOMMIT', 1)
+        self._capacity = ResourceRequirements(
+            num_cpus=num_cpus * cpu_overcommit,
+            memory_gb=memory_gb * memory_overcommit,
+            disk_gb=disk_gb
+        )
+        print(f'Local job capacity: {self._capacity.num_cpus:g} CPUs, {self._capacity.memory_gb:.1f} GB memory, {self._capacity.disk_gb:.1f} GB disk')
+    def schedule(self, *,
+        running_jobs: List[dict],
+        pending_jobs: List[dict],
+        get_requirements: Callable[[dict], ResourceRequirements]
+    ) -> Tuple[List[dict], List[dict]]:
+        """Pack pending jobs into the capacity that is not used by the running jobs
+
+        Pending jobs are considered in the order given (oldest first), and a job
+        that does not fit is skipped so that smaller jobs behind it can still start.
+
+        Returns:
+            The jobs to start, and the jobs that can never fit on this node
+        """
+        free = ResourceRequirements(
+            num_cpus=self._capacity.num_cpus,
+            memory_gb=self._capacity.memory_gb,
+            disk_gb=self._capacity.disk_gb
+        )
+        for job in running_jobs:
+            _subtract(free, get_requirements(job))
+        jobs_to_start = []
+        jobs_too_large = []
+        for job in pending_jobs:
+            rr = get_requirements(job)
+            if not _fits(rr, self._capacity):
+                jobs_too_large.append(job)
+            elif _fits(rr, free):
+                _subtract(free, rr)
+                jobs_to_start.append(job)
+        return jobs_to_start, jobs_too_large
+    def get_capacity(self) -> ResourceRequirements:
+        return self._capacity
+
+def _fits(rr: ResourceRequirements, free: ResourceRequirements) -> bool:
+    return rr.num_cpus <= free.num_cpus and rr.memory_gb <= free.memory_gb and rr.disk_gb <= free.disk_gb
+
+def _subtract(free: ResourceRequirements, rr: ResourceRequirements):
+    free.num_cpus -= rr.num_cpus
+    free.memory_gb -= rr.memory_gb
+    free.disk_gb -= rr.disk_gb
+
+def _get_float_env(name: str, default):
+    # unset keys in .protocaas-compute-resource-node.yaml come through as empty strings
+    value = os.getenv(name, '')
+    if value == '':
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        raise Exception(f'Invalid value for {name}: {value}')
+
+def _get_num_available_cpus() -> int:
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def _get_total_memory_gb() -> float:
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1024 ** 3
+
+def _get_free_disk_gb(jobs_dir: str) -> float:
+    # the jobs directory may not exist yet, so measure the nearest existing parent
+    path = os.path.abspath(jobs_dir)
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    return shutil.disk_usage(path).free / 1024 ** 3
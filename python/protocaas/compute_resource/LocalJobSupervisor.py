@@ -0,0 +1,146 @@
+from typing import Callable, Dict, List, Tuple, Union
+import os
+import signal
+import threading
+import subprocess
+from dataclasses import dataclass
+
+
+@dataclass
+class SupervisedJobProcess:
+    """A local job process owned by the supervisor"""
+    job_id: str
+    job_private_key: Union[str, None] # None for adopted processes
+    pid: int
+    process: Union[subprocess.Popen, None] # None for processes adopted from a previous run of the daemon
+    # start time of the process (clock ticks after boot), so that another process that reuses the pid (e.g., after a reboot) is not taken for it
+    # None if unknown (no /proc, or adopted from a journal that did not record it)
+    start_time: Union[int, None] = None
+
+class LocalJobSupervisor:
+    """Tracks the processes of the local jobs and reaps them as soon as they exit
+
+    Each job process is the leader of its own process group (it is started with
+    start_new_session=True), so the whole group can be signaled at once.
+
+    The handle of a process, which is recorded in the journal, is <pid>:<start time>,
+    so that a process adopted after a restart of the daemon is only considered
+    the job process if it is still the same process.
+
+    on_exit(job_id, job_private_key, returncode) is called for each process
+    that exits. The returncode is negative if the process was killed by a signal,
+    and None if the process was adopted, in which case it is not a child of this
+    process and its exit status can't be known.
+    """
+    def __init__(self, *, on_exit: Callable[[str, str, Union[int, None]], None]):
+        self._on_exit = on_exit
+        self._processes: Dict[str, SupervisedJobProcess] = {}
+        self._lock = threading.Lock()
+    def add(self, *, job_id: str, job_private_key: str, process: subprocess.Popen) -> str:
+        """Returns the handle of the process"""
+        start_time = _get_process_start_time(process.pid)
+        with self._lock:
+            self._processes[job_id] = SupervisedJobProcess(job_id=job_id, job_private_key=job_private_key, pid=process.pid, process=process, start_time=start_time)
+        return f'{process.pid}:{start_time}' if start_time is not None else str(process.pid)
+    def adopt(self, *, job_id: str, job_private_key: Union[str, None], handle: str):
+        """Keep track of a job process that was started by a previous run of the daemon
+
+        If the process is gone, or the pid now belongs to another process, it is reported as exited at the next reap().
+        """
+        pid, start_time = _parse_handle(handle)
+        with self._lock:
+            self._processes[job_id] = SupervisedJobProcess(job_id=job_id, job_private_key=job_private_key, pid=pid, process=None, start_time=start_time)
+    def reap(self) -> int:
+        """Collect the processes that have exited and report them through on_exit
+
+        Returns:
+            The number of processes that exited
+        """
+        exited: List[Tuple[SupervisedJobProcess, Union[int, None]]] = []
+        with self._lock:
+            for p in list(self._processes.values()):
+                if p.process is not None:
+                    returncode = p.process.poll() # this reaps the child if it has exited
+                    if returncode is None:
+                        continue
+                else:
+                    if _pid_is_alive(p.pid, p.start_time):
+                        continue
+                    returncode = None
+                del self._processes[p.job_id]
+                exited.append((p, returncode))
+        for p, returncode in exited:
+            self._on_exit(p.job_id, p.job_private_key, returncode)
+        return len(exited)
+    def get_running_job_ids(self) -> List[str]:
+        with self._lock:
+            return list(self._processes.keys())
+    def get_num_running(self) -> int:
+        with self._lock:
+            return len(self._processes)
+    def is_running(self, job_id: str) -> bool:
+        with self._lock:
+            return job_id in self._processes
+    def signal(self, job_id: str, sig: int) -> bool:
+        """Send a signal to the process group of a job. Returns False if there is no such process."""
+        with self._lock:
+            p = self._processes.get(job_id, None)
+        if p is None:
+            return False
+        if p.process is None and not _pid_is_alive(p.pid, p.start_time):
+            return False # the pid may belong to another process by now
+        try:
+            os.killpg(p.pid, sig)
+        except ProcessLookupError:
+            return False
+        return True
+
+def _pid_is_alive(pid: int, start_time: Union[int, None]) -> bool:
+    """Whether the process is running, and is the one that started at start_time (if known)"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        if start_time is None:
+            return True # exists, but owned by another user
+    fields = _read_proc_stat_fields(pid)
+    if fields is None:
+        # exited in the meantime, or no /proc (in which case we can't tell)
+        return not os.path.isdir('/proc')
+    if fields[0] == 'Z':
+        return False # a zombie has exited but has not been reaped yet
+    if start_time is not None and int(fields[19]) != start_time:
+        return False
+    return True
+
+def _get_process_start_time(pid: int) -> Union[int, None]:
+    fields = _read_proc_stat_fields(pid)
+    return int(fields[19]) if fields is not None else None
+
+def _read_proc_stat_fields(pid: int) -> Union[List[str], None]:
+    # the fields after the command name (which is in parentheses and can contain spaces), starting with the state (field 3)
+    # so the start time (field 22) is at index 19
+    try:
+        with open(f'/proc/{pid}/stat', 'r') as f:
+            stat = f.read()
+        fields = stat[stat.rindex(')') + 2:].split()
+        return fields if len(fields) >= 20 else None
+    except (OSError, ValueError):
+        return None
+
+def _parse_handle(handle: str) -> Tuple[int, Union[int, None]]:
+    # <pid>:<start time>, or just <pid> as recorded by older versions
+    a = handle.split(':')
+    return int(a[0]), int(a[1]) if len(a) > 1 else None
+
+def _describe_returncode(returncode: Union[int, None]) -> str:
+    if returncode is None:
+        return 'exited with unknown status'
+    if returncode < 0:
+        try:
+            signal_name = signal.Signals(-returncode).name
+        except ValueError:
+            signal_name = str(-returncode)
+        return f'killed by signal {signal_name}'
+    return f'exited with code {returncode}'
@@ -1,38 +1,104 @@
-from typing import List
-import queue
+from typing import Callable
+import json
+import time
+import threading
+import requests
 from pubnub.pnconfiguration import PNConfiguration
 from pubnub.callbacks import SubscribeCallback
 from pubnub.pubnub import PubNub
 
+
+class PubsubClient:
+    """Receives the messages addressed to a compute resource
+
+    on_message is called on a background thread for each message.
+    """
+    def close(self):
+        pass
+
 class MySubscribeCallback(SubscribeCallback):
-    def __init__(self, message_queue: queue.Queue, compute_resource_id: str):
-        self._message_queue = message_queue
+    def __init__(self, on_message: Callable[[dict], None], compute_resource_id: str):
+        self._on_message = on_message
         self._compute_resource_id = compute_resource_id
     def message(self, pubnub, message):
         msg = message.message
         if msg.get('computeResourceId', None) == self._compute_resource_id:
-            self._message_queue.put(msg)
+            self._on_message(msg)
 
-class PubsubClient:
+class PubnubPubsubClient(PubsubClient):
     def __init__(self, *,
         pubnub_subscribe_key: str,
         pubnub_channel: str,
         pubnub_user: str,
-        compute_resource_id: str
+        compute_resource_id: str,
+        on_message: Callable[[dict], None]
     ):
-        self._message_queue = queue.Queue()
         pnconfig = PNConfiguration()
         pnconfig.subscribe_key = pubnub_subscribe_key
         pnconfig.user_id = pubnub_user
-        pubnub = PubNub(pnconfig)
-        pubnub.add_listener(MySubscribeCallback(message_queue=self._message_queue, compute_resource_id=compute_resource_id))
-        pubnub.subscribe().channels([pubnub_channel]).execute()
-    def take_messages(self) -> List[dict]:
-        ret = []
-        while True:
+        self._pubnub = PubNub(pnconfig)
+        self._pubnub.add_listener(MySubscribeCallback(on_message=on_message, compute_resource_id=compute_resource_id))
+        self._pubnub.subscribe().channels([pubnub_channel]).execute()
+    def close(self):
+        self._pubnub.unsubscribe_all()
+
+# the relay sends a keepalive line at least this often, so a silent connection is a dead connection
+relay_read_timeout_sec = 90
+
+class RelayPubsubClient(PubsubClient):
+    """Subscribes to the topic of the compute resource on a self-hosted relay (see protocaas start-pubsub-relay)
+
+    The relay only sends the messages of the subscribed topic, as
+    newline-delimited JSON over a long-lived HTTP response. The connection is
+    re-established with backoff if it drops.
+    """
+    def __init__(self, *,
+        relay_url: str,
+        compute_resource_id: str,
+        on_message: Callable[[dict], None]
+    ):
+        self._url = f'{relay_url.rstrip("/")}/subscribe/{compute_resource_id}'
+        self._on_message = on_message
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    def close(self):
+        self._closed = True
+    def _run(self):
+        backoff_sec = 1
+        while not self._closed:
             try:
-                msg = self._message_queue.get(block=False)
-                ret.append(msg)
-            except queue.Empty:
-                break
-        return ret
+                with requests.get(self._url, stream=True, timeout=(10, relay_read_timeout_sec)) as resp:
+                    resp.raise_for_status()
+                    print(f'Connected to pubsub relay {self._url}')
+                    backoff_sec = 1
+                    # chunk_size=1 so that each line is delivered as soon as it arrives, rather than when a buffer fills up (messages are small)
+                    for line in resp.iter_lines(chunk_size=1):
+                        if self._closed:
+                            return
+                        if not line:
+                            continue # keepalive
+                        self._on_message(json.loads(line))
+            except Exception as e:
+                print(f'Pubsub relay connection lost, reconnecting in {backoff_sec} sec: {str(e)}')
+            time.sleep(backoff_sec)
+            backoff_sec = min(backoff_sec * 2, 30)
+
+def _create_pubsub_client(*, subscription: dict, compute_resource_id: str, on_message: Callable[[dict], None], relay_url: str = None) -> PubsubClient:
+    """The relay is used if the server (or relay_url, for a local relay) provides one, otherwise PubNub"""
+    relay_url = relay_url or subscription.get('relayUrl', None)
+    if relay_url:
+        return RelayPubsubClient(
+            relay_url=relay_url,
+            compute_resource_id=compute_resource_id,
+            on_message=on_message
+        )
+    if not subscription.get('pubnubSubscribeKey', None):
+        raise Exception('The pubsub subscription has neither a relay nor a pubnub subscribe key')
+    return PubnubPubsubClient(
+        pubnub_subscribe_key=subscription['pubnubSubscribeKey'],
+        pubnub_channel=subscription['pubnubChannel'],
+        pubnub_user=subscription['pubnubUser'],
+        compute_resource_id=compute_resource_id,
+        on_message=on_message
+    )
@@ -0,0 +1,126 @@
+from typing import Dict, Set
+import os
+import json
+import queue
+import socket
+import ipaddress
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+# a subscriber that falls this far behind loses messages (the daemon resyncs periodically anyway)
+max_queued_messages_per_subscriber = 1000
+
+# send something at least this often so that subscribers can detect dead connections
+keepalive_interval_sec = 30
+
+class PubsubRelay:
+    """Fans out published messages to the subscribers of their topic
+
+    The protocaas API publishes each message to the topic of its compute
+    resource, so a node only receives its own messages.
+    """
+    def __init__(self):
+        self._subscribers: Dict[str, Set[queue.Queue]] = {}
+        self._lock = threading.Lock()
+    def publish(self, topic: str, message: dict) -> int:
+        line = json.dumps(message)
+        with self._lock:
+            subscribers = list(self._subscribers.get(topic, []))
+        for q in subscribers:
+            try:
+                q.put_nowait(line)
+            except queue.Full:
+                pass
+        return len(subscribers)
+    def subscribe(self, topic: str) -> queue.Queue:
+        q = queue.Queue(maxsize=max_queued_messages_per_subscriber)
+        with self._lock:
+            self._subscribers.setdefault(topic, set()).add(q)
+        return q
+    def unsubscribe(self, topic: str, q: queue.Queue):
+        with self._lock:
+            subscribers = self._subscribers.get(topic, set())
+            subscribers.discard(q)
+            if len(subscribers) == 0:
+                self._subscribers.pop(topic, None)
+
+def _create_request_handler(relay: PubsubRelay, publish_token: str):
+    class RequestHandler(BaseHTTPRequestHandler):
+        # the subscription response is delimited by closing the connection
+        protocol_version = 'HTTP/1.0'
+        def do_POST(self):
+            if self.path != '/publish':
+                self.send_error(404)
+                return
+            if publish_token and self.headers.get('Authorization', '') != f'Bearer {publish_token}':
+                self.send_error(403)
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                topic = body['topic']
+                message = body['message']
+            except Exception:
+                self.send_error(400)
+                return
+            num_subscribers = relay.publish(topic, message)
+            resp = json.dumps({'success': True, 'numSubscribers': num_subscribers}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(resp)))
+            self.end_headers()
+            self.wfile.write(resp)
+        def do_GET(self):
+            if not self.path.startswith('/subscribe/'):
+                self.send_error(404)
+                return
+            topic = self.path[len('/subscribe/'):]
+            if not topic:
+                self.send_error(400)
+                return
+            q = relay.subscribe(topic)
+            try:
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                self.wfile.flush()
+                while True:
+                    try:
+                        line = q.get(timeout=keepalive_interval_sec)
+                    except queue.Empty:
+                        line = '' # keepalive
+                    self.wfile.write((line + '\n').encode('utf-8'))
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                relay.unsubscribe(topic, q)
+        def log_message(self, format, *args):
+            pass
+    return RequestHandler
+
+def start_pubsub_relay(*, host: str, port: int):
+    """Run a relay that compute resource nodes can use instead of PubNub
+
+    Set PUBSUB_RELAY_URL for the protocaas API to publish to it. Publishing
+    requires PUBSUB_RELAY_PUBLISH_TOKEN as a bearer token (set the same variable
+    for the API), which may only be left unset when listening on a loopback
+    address. Subscribing is not authenticated: messages only contain IDs and statuses.
+    """
+    relay = PubsubRelay()
+    publish_token = os.getenv('PUBSUB_RELAY_PUBLISH_TOKEN', '')
+    if not publish_token and not _is_loopback_host(host):
+        # otherwise anyone who can reach the relay could, e.g., make nodes cancel jobs
+        raise Exception(f'PUBSUB_RELAY_PUBLISH_TOKEN must be set when listening on {host}, which is not a loopback address')
+    server = ThreadingHTTPServer((host, port), _create_request_handler(relay, publish_token))
+    server.daemon_threads = True
+    print(f'Pubsub relay listening on {host}:{port}')
+    server.serve_forever()
+
+def _is_loopback_host(host: str) -> bool:
+    try:
+        addresses = [info[4][0] for info in socket.getaddrinfo(host, None)]
+    except socket.gaierror:
+        return False
+    return len(addresses) > 0 and all(ipaddress.ip_address(a.split('%')[0]).is_loopback for a in addresses)
@@ -0,0 +1,151 @@
+from typing import Callable, Dict, Set, Tuple, Union
+import os
+import re
+import time
+import shutil
+import threading
+import subprocess
+
+
+# the digest that a tag points to is looked up again after this long
+digest_cache_ttl_sec = 60 * 10
+
+# a pull that takes longer than this is abandoned (e.g., the registry hangs), so that it does not hold up job starts forever
+singularity_pull_timeout_sec = 60 * 60
+
+class SingularityImageCache:
+    """Node-level cache of SIF images for the singularity container method
+
+    Each container reference is converted to a SIF file once and shared by all
+    jobs (and by the spec extraction when the apps are loaded), rather than
+    resolving docker://... on every launch. Images are keyed by digest: either
+    the one in the reference (image@sha256:...), or the one the tag currently
+    points to according to skopeo, if it is installed. Without skopeo, images
+    are keyed by the reference itself, so a moved tag is not noticed.
+
+    SIF files are written atomically, and the least recently used ones are
+    evicted when the total size exceeds SINGULARITY_IMAGE_CACHE_GB. The image
+    of a job is pinned (in the pins directory, so that this survives restarts)
+    until get_active_job_ids no longer returns the job, because a SLURM task
+    script that refers to the SIF may still be waiting in the queue.
+    """
+    def __init__(self, *, cache_dir: str, get_active_job_ids: Callable[[], Set[str]] = None):
+        self._cache_dir = os.path.abspath(cache_dir)
+        self._pins_dir = os.path.join(self._cache_dir, 'pins')
+        os.makedirs(self._pins_dir, exist_ok=True)
+        self._get_active_job_ids = get_active_job_ids
+        self._budget_bytes = float(os.getenv('SINGULARITY_IMAGE_CACHE_GB', '') or 50) * 1024 ** 3
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self._digests: Dict[str, Tuple[Union[str, None], float]] = {} # reference -> (digest, time of lookup)
+        self._has_skopeo = shutil.which('skopeo') is not None
+    def get_image_path(self, container: str, *, job_id: str = None) -> str:
+        """Path of the SIF file for the container reference, pulling it if needed. If job_id is given, the image is pinned for the job."""
+        digest = self._get_digest(container)
+        if digest is not None:
+            key = 'sha256_' + digest.split(':')[-1]
+            pull_ref = f'{_strip_tag_and_digest(container)}@{digest}'
+        else:
+            key = 'ref_' + re.sub(r'[^A-Za-z0-9._-]', '_', container)
+            pull_ref = container
+        path = os.path.join(self._cache_dir, key + '.sif')
+        if job_id is not None:
+            with open(os.path.join(self._pins_dir, job_id), 'w') as f:
+                f.write(path)
+        with self._get_key_lock(key):
+            if os.path.exists(path):
+                os.utime(path) # for LRU
+                return path
+            print(f'Pulling singularity image for {container}')
+            tmp_path = os.path.join(self._cache_dir, f'.{key}.{os.urandom(4).hex()}.sif.tmp')
+            try:
+                try:
+                    result = subprocess.run(['singularity', 'pull', tmp_path, f'docker://{pull_ref}'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, timeout=singularity_pull_timeout_sec)
+                except subprocess.TimeoutExpired:
+                    raise Exception(f'singularity pull timed out after {singularity_pull_timeout_sec} sec for {container}')
+                if result.returncode != 0:
+                    raise Exception(f'singularity pull failed for {container}: {result.stdout.strip()[-1000:]}')
+                os.replace(tmp_path, path) # atomic, so a partially written file is never used
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        self._evict(keep=path)
+        return path
+    def _get_digest(self, container: str) -> Union[str, None]:
+        m = re.search(r'@(sha256:[0-9a-f]{64})$', container)
+        if m:
+            return m.group(1)
+        if not self._has_skopeo:
+            return None
+        with self._lock:
+            cached = self._digests.get(container, None)
+        if cached is not None and time.time() - cached[1] < digest_cache_ttl_sec:
+            return cached[0]
+        digest = None
+        try:
+            result = subprocess.run(['skopeo', 'inspect', '--format', '{{.Digest}}', f'docker://{container}'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=60)
+            if result.returncode == 0 and result.stdout.strip().startswith('sha256:'):
+                digest = result.stdout.strip()
+        except Exception as e:
+            print(f'Unable to look up the digest of {container}: {str(e)}')
+        if digest is None and cached is not None:
+            digest = cached[0] # e.g., the registry is unreachable, so keep using what we have
+        with self._lock:
+            self._digests[container] = (digest, time.time())
+        return digest
+    def _get_key_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            if key not in self._key_locks:
+                self._key_locks[key] = threading.Lock()
+            return self._key_locks[key]
+    def _evict(self, *, keep: str):
+        # Running containers keep their SIF open, so removing it does not affect them
+        pinned = self._get_pinned_paths()
+        with self._lock:
+            files = []
+            for fname in os.listdir(self._cache_dir):
+                if not fname.endswith('.sif'):
+                    continue
+                path = os.path.join(self._cache_dir, fname)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+            total = sum(f[1] for f in files)
+            for _, size, path in sorted(files):
+                if total <= self._budget_bytes:
+                    break
+                if path == keep or path in pinned:
+                    continue
+                print(f'Evicting singularity image {path}')
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def _get_pinned_paths(self) -> Set[str]:
+        if self._get_active_job_ids is None:
+            return set()
+        active_job_ids = self._get_active_job_ids()
+        ret: Set[str] = set()
+        for job_id in os.listdir(self._pins_dir):
+            pin_path = os.path.join(self._pins_dir, job_id)
+            try:
+                if job_id not in active_job_ids:
+                    os.remove(pin_path)
+                    continue
+                with open(pin_path, 'r') as f:
+                    ret.add(f.read().strip())
+            except FileNotFoundError:
+                pass
+        return ret
+
+def _strip_tag_and_digest(container: str) -> str:
+    container = container.split('@')[0]
+    # a colon after the last slash separates the tag (a colon before it would be a registry port)
+    i = container.rfind(':')
+    if i > container.rfind('/'):
+        container = container[:i]
+    return container
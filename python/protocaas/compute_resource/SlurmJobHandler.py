@@ -0,0 +1,240 @@
+from typing import List
+import os
+import math
+import time
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from ..sdk._run_job import _set_job_status
+from ..sdk._api_request_batcher import max_requests_per_batch
+
+
+# How jobs are submitted to slurm (SLURM_SUBMIT_METHOD)
+# * srun (default): each batch runs in a single srun allocation with one task per job
+# * sbatch-array: each batch is submitted as a job array, so that every job gets its own allocation and finishes on its own
+slurm_submit_methods = ['srun', 'sbatch-array']
+
+# The most jobs in a batch. Below that, the size of a batch adapts to the arrival rate (see _get_max_jobs_in_batch)
+max_jobs_per_srun_batch = 20
+max_jobs_per_slurm_array = 1000 # slurm's default MaxArraySize is 1001
+
+# A batch is started once it has about as many jobs as are expected to arrive within this long
+slurm_batch_target_window_sec = 10
+
+# After a job is added we wait for a quiet period before starting a batch, because maybe more will be added
+# The quiet period adapts to the arrival rate (see _get_quiet_period)
+slurm_batch_min_quiet_period_sec = 1
+slurm_batch_max_quiet_period_sec = 5
+
+# ... but never hold a job back for longer than this
+slurm_batch_max_wait_sec = 60
+
+# The jobs of a batch are prepared concurrently, so that their status updates are sent to the API together
+# (as many at once as fit in one batch request, so that a large array takes a single round trip)
+max_concurrent_slurm_job_preparations = max_requests_per_batch
+
+class SlurmJobHandler:
+    def __init__(self, daemon, slurm_opts: dict):
+        self._daemon = daemon
+        self._slurm_opts = slurm_opts
+        self._submit_method = os.getenv('SLURM_SUBMIT_METHOD', '') or 'srun'
+        if self._submit_method not in slurm_submit_methods:
+            raise Exception(f'Unexpected SLURM_SUBMIT_METHOD: {self._submit_method}')
+        self._jobs = []
+        self._job_ids = set()
+        self._requeued_job_ids = set() # jobs that are submitted again after slurm lost them
+        self._time_of_last_job_added = 0
+        self._time_of_first_job_added = 0 # the oldest job that is waiting
+        self._batch_deadline = 0
+        self._mean_interarrival_sec = None # exponential moving average
+        # only one timer is pending at a time, for the earliest time that a batch may be due
+        self._time_work_due: float = None
+        self._timer_token = 0
+        self._prepare_executor = ThreadPoolExecutor(max_workers=max_concurrent_slurm_job_preparations)
+    def add_job(self, job: dict, *, requeue: bool = False):
+        job_id = job['jobId']
+        if job_id not in self._job_ids:
+            if requeue:
+                self._requeued_job_ids.add(job_id)
+            now = time.time()
+            if self._time_of_last_job_added > 0:
+                dt = now - self._time_of_last_job_added
+                if self._mean_interarrival_sec is None:
+                    self._mean_interarrival_sec = dt
+                else:
+                    self._mean_interarrival_sec = 0.8 * self._mean_interarrival_sec + 0.2 * dt
+            if len(self._jobs) == 0:
+                self._time_of_first_job_added = now
+            self._jobs.append(job)
+            self._job_ids.add(job_id)
+            self._time_of_last_job_added = now
+            quiet_period = self._get_quiet_period()
+            self._batch_deadline = now + quiet_period
+            if len(self._jobs) >= self._get_max_jobs_in_batch():
+                self._schedule_work(0)
+            else:
+                self._schedule_work(quiet_period)
+    def do_work(self):
+        if len(self._jobs) == 0:
+            return
+        now = time.time()
+        batch_is_full = len(self._jobs) >= self._get_max_jobs_in_batch()
+        waited_too_long = now - self._time_of_first_job_added >= slurm_batch_max_wait_sec
+        if not batch_is_full and not waited_too_long and now < self._batch_deadline:
+            # the quiet period was extended by jobs that were added since the timer was set
+            self._schedule_work(min(self._batch_deadline, self._time_of_first_job_added + slurm_batch_max_wait_sec) - now)
+            return
+        max_jobs_in_batch = self._get_max_jobs_in_batch()
+        num_jobs_to_start = min(max_jobs_in_batch, len(self._jobs))
+        if num_jobs_to_start > 0:
+            jobs_to_start = self._jobs[:num_jobs_to_start]
+            self._jobs = self._jobs[num_jobs_to_start:]
+            for job in jobs_to_start:
+                self._job_ids.remove(job['jobId'])
+            self._time_of_first_job_added = now
+            self._run_slurm_batch(jobs_to_start)
+        if len(self._jobs) > 0:
+            # start the next batch right away
+            self._schedule_work(0)
+    def _schedule_work(self, delay: float):
+        due = time.time() + max(0, delay)
+        if self._time_work_due is not None and self._time_work_due <= due:
+            return # the pending timer comes first, and do_work sets a new one if needed
+        self._time_work_due = due
+        self._timer_token += 1
+        token = self._timer_token
+        self._daemon._call_later(max(0, delay), lambda: self._on_timer(token))
+    def _on_timer(self, token: int):
+        if token != self._timer_token:
+            return # replaced by an earlier timer
+        self._time_work_due = None
+        self.do_work()
+    def _get_quiet_period(self) -> float:
+        # Wait a few inter-arrival times, so that the jobs that arrive together end up in one batch
+        if self._mean_interarrival_sec is None:
+            return slurm_batch_max_quiet_period_sec
+        return min(slurm_batch_max_quiet_period_sec, max(slurm_batch_min_quiet_period_sec, 3 * self._mean_interarrival_sec))
+    def _get_max_jobs_in_batch(self) -> int:
+        # During a burst, batches grow up to the maximum (e.g., thousands of jobs become a few large arrays)
+        # When jobs trickle in, more are unlikely to come soon, so a batch is started with fewer jobs (down to one)
+        max_jobs = max_jobs_per_slurm_array if self._submit_method == 'sbatch-array' else max_jobs_per_srun_batch
+        if self._mean_interarrival_sec is None:
+            return max_jobs
+        expected_num_jobs = math.ceil(slurm_batch_target_window_sec / max(self._mean_interarrival_sec, 1e-3))
+        return max(1, min(max_jobs, expected_num_jobs))
+    def _run_slurm_batch(self, jobs: List[dict]):
+        if self._submit_method == 'sbatch-array':
+            self._submit_slurm_array(jobs)
+        else:
+            self._run_srun_batch(jobs)
+    def _run_srun_batch(self, jobs: List[dict]):
+        if not os.path.exists('slurm_scripts'):
+            os.mkdir('slurm_scripts')
+        random_str = os.urandom(16).hex()
+        slurm_script_fname = f'slurm_scripts/slurm_batch_{random_str}.sh'
+        script_has_at_least_one_job = False # important to do this so we don't run an empty script
+        job_ids_in_batch: List[str] = []
+        cmds = self._start_jobs(jobs)
+        with open(slurm_script_fname, 'w') as f:
+            f.write('#!/bin/bash\n')
+            f.write('\n')
+            f.write('set -e\n')
+            f.write('\n')
+            for ii, (job, cmd) in enumerate(zip(jobs, cmds)):
+                if cmd:
+                    job_ids_in_batch.append(job['jobId'])
+                    f.write(f'if [ "$SLURM_PROCID" == "{ii}" ]; then\n')
+                    f.write(f'    {cmd}\n')
+                    f.write('fi\n')
+                    f.write('\n')
+                    script_has_at_least_one_job = True
+            f.write('\n')
+        if script_has_at_least_one_job:
+            # run the slurm script with srun
+            slurm_opts_str = ' '.join(self._get_slurm_opts_list())
+            # the job name is how the reconciler finds the batch in sacct/squeue
+            cmd = f'srun -n {len(jobs)} --job-name=slurm_batch_{random_str} {slurm_opts_str} bash {slurm_script_fname}'
+            print(f'Running slurm batch: {cmd}')
+            subprocess.Popen(
+                cmd.split(),
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True
+            )
+            for job_id in job_ids_in_batch:
+                self._daemon._journal.record_handle(job_id=job_id, handle_type='slurm_batch', handle=f'slurm_batch_{random_str}')
+    def _submit_slurm_array(self, jobs: List[dict]):
+        random_str = os.urandom(16).hex()
+        batch_dir = os.path.abspath(f'slurm_scripts/slurm_array_{random_str}')
+        os.makedirs(batch_dir)
+        # one script per array task, so that each job runs in its own allocation
+        jobs_in_array: List[dict] = []
+        cmds = self._start_jobs(jobs)
+        for job, cmd in zip(jobs, cmds):
+            if cmd:
+                with open(f'{batch_dir}/task_{len(jobs_in_array)}.sh', 'w') as f:
+                    f.write('#!/bin/bash\n')
+                    f.write('\n')
+                    f.write('set -e\n')
+                    f.write('\n')
+                    f.write(f'{cmd}\n')
+                jobs_in_array.append(job)
+        if len(jobs_in_array) == 0:
+            return # important so we don't submit an empty array
+        array_script_fname = f'{batch_dir}/array.sh'
+        with open(array_script_fname, 'w') as f:
+            f.write('#!/bin/bash\n')
+            f.write('\n')
+            f.write(f'exec bash {batch_dir}/task_$SLURM_ARRAY_TASK_ID.sh\n')
+        cmd = [
+            'sbatch',
+            '--parsable',
+            f'--array=0-{len(jobs_in_array) - 1}',
+            f'--job-name=slurm_array_{random_str}',
+            '--output=/dev/null',
+            *self._get_slurm_opts_list(),
+            array_script_fname
+        ]
+        print(f'Submitting slurm array: {" ".join(cmd)}')
+        try:
+            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=60)
+            if result.returncode != 0:
+                raise Exception(f'sbatch failed: {result.stderr.strip()}')
+        except Exception as e:
+            # the jobs were already set to starting, so we need to fail them
+            msg = f'Failed to submit slurm array: {str(e)}'
+            print(msg)
+            for job in jobs_in_array:
+                self._daemon._journal.record_state(job_id=job['jobId'], state='start_failed', detail=msg)
+                try:
+                    _set_job_status(job_id=job['jobId'], job_private_key=job['jobPrivateKey'], status='failed', error=msg)
+                except Exception as e2:
+                    print(f'Unable to set job status to failed: {str(e2)}')
+            return
+        # the output of --parsable is <job_id>[;<cluster>]
+        slurm_job_id = result.stdout.strip().split(';')[0]
+        print(f'Submitted slurm array {slurm_job_id} with {len(jobs_in_array)} tasks')
+        for ii, job in enumerate(jobs_in_array):
+            self._daemon._journal.record_handle(job_id=job['jobId'], handle_type='slurm_array_task', handle=f'{slurm_job_id}_{ii}')
+    def _start_jobs(self, jobs: List[dict]) -> List[str]:
+        requeue_flags = [job['jobId'] in self._requeued_job_ids for job in jobs]
+        for job in jobs:
+            self._requeued_job_ids.discard(job['jobId'])
+        # _start_job is safe to run concurrently for distinct jobs
+        return list(self._prepare_executor.map(self._start_job, jobs, requeue_flags))
+    def _start_job(self, job: dict, requeue: bool) -> str:
+        return self._daemon._start_job(job, run_process=False, return_shell_command=True, requeue=requeue)
+    def _get_slurm_opts_list(self) -> List[str]:
+        slurm_cpus_per_task = self._slurm_opts.get('cpusPerTask', None)
+        slurm_partition = self._slurm_opts.get('partition', None)
+        slurm_time = self._slurm_opts.get('time', None)
+        slurm_other_opts = self._slurm_opts.get('otherOpts', None)
+        oo = []
+        if slurm_cpus_per_task is not None:
+            oo.append(f'--cpus-per-task={slurm_cpus_per_task}')
+        if slurm_partition is not None:
+            oo.append(f'--partition={slurm_partition}')
+        if slurm_time is not None:
+            oo.append(f'--time={slurm_time}')
+        if slurm_other_opts is not None:
+            oo.extend(slurm_other_opts.split())
+        return oo
@@ -0,0 +1,117 @@
+from typing import Dict, List
+import time
+import getpass
+import subprocess
+from .JobJournal import JobJournalEntry
+
+
+# SLURM job states after which the job will not run (any more)
+slurm_terminal_states = [
+    'BOOT_FAIL', 'CANCELLED', 'COMPLETED', 'DEADLINE', 'FAILED', 'NODE_FAIL', 'OUT_OF_MEMORY', 'PREEMPTED', 'TIMEOUT'
+]
+
+# state reported for a job that SLURM does not know about
+slurm_state_not_found = 'NOT_FOUND'
+
+# a job may take a while to show up in sacct/squeue after it was submitted
+slurm_job_not_found_grace_period_sec = 60 * 5
+
+class SlurmJobReconciler:
+    """Finds out which of the slurm jobs submitted by this node have ended
+
+    All jobs of the current user are queried with a single sacct call and
+    matched against the journal handles: by job name for srun batches
+    (slurm_batch_<id>) and by job ID for array tasks (<job_id>_<task>).
+    If sacct is not available (e.g., accounting is disabled) squeue is used
+    instead, in which case a job that is no longer listed is considered ended.
+    """
+    def __init__(self, *, sacct_command: str = 'sacct', squeue_command: str = 'squeue'):
+        self._sacct_command = sacct_command
+        self._squeue_command = squeue_command
+        self._use_squeue = False
+    def get_ended_jobs(self, entries: List[JobJournalEntry]) -> Dict[str, str]:
+        """Returns a map from protocaas job ID to the final slurm state, for the entries whose slurm job has ended"""
+        if len(entries) == 0:
+            return {}
+        states_by_name, states_by_id = self._query(start_time=min(e.timestamp_created for e in entries))
+        now = time.time()
+        ret: Dict[str, str] = {}
+        for entry in entries:
+            if entry.handle_type == 'slurm_batch':
+                state = states_by_name.get(entry.handle, None)
+            elif entry.handle_type == 'slurm_array_task':
+                state = states_by_id.get(entry.handle, None)
+            else:
+                continue
+            if state is None:
+                if now - entry.timestamp_updated > slurm_job_not_found_grace_period_sec:
+                    ret[entry.job_id] = slurm_state_not_found
+            elif state in slurm_terminal_states:
+                ret[entry.job_id] = state
+        return ret
+    def _query(self, *, start_time: float):
+        if not self._use_squeue:
+            try:
+                return self._query_sacct(start_time=start_time)
+            except Exception as e:
+                print(f'Unable to query sacct, falling back to squeue: {str(e)}')
+                self._use_squeue = True
+        return self._query_squeue()
+    def _query_sacct(self, *, start_time: float):
+        cmd = [
+            self._sacct_command,
+            '-X', # allocations only, not the individual steps
+            '--parsable2',
+            '--noheader',
+            '--format=JobID,JobName,State',
+            f'--starttime={time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(start_time))}'
+        ]
+        return _parse_rows(_run_command(cmd))
+    def _query_squeue(self):
+        cmd = [
+            self._squeue_command,
+            f'--user={getpass.getuser()}',
+            '--array', # one line per array task
+            '--noheader',
+            '--format=%i|%j|%T'
+        ]
+        return _parse_rows(_run_command(cmd))
+
+def _run_command(cmd: List[str]) -> str:
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=60)
+    if result.returncode != 0:
+        raise Exception(f'{cmd[0]} failed: {result.stderr.strip()}')
+    return result.stdout
+
+def _parse_rows(output: str):
+    # each line is <job_id>|<job_name>|<state>
+    states_by_name: Dict[str, str] = {}
+    states_by_id: Dict[str, str] = {}
+    for line in output.splitlines():
+        parts = line.strip().split('|')
+        if len(parts) < 3:
+            continue
+        job_id, job_name, state = parts[0], parts[1], parts[2]
+        # sacct reports, e.g., "CANCELLED by 1234"
+        state = state.split(' ')[0]
+        # a job that was requeued appears more than once, and the last one is the current one
+        states_by_name[job_name] = state
+        for id0 in _expand_slurm_job_id(job_id):
+            states_by_id[id0] = state
+    return states_by_name, states_by_id
+
+def _expand_slurm_job_id(job_id: str) -> List[str]:
+    # pending array tasks are collapsed into a single row, e.g., 1234_[5-9,12%4]
+    if '_[' not in job_id or not job_id.endswith(']'):
+        return [job_id]
+    base, ranges = job_id[:-1].split('_[', 1)
+    ranges = ranges.split('%')[0]
+    ret: List[str] = []
+    for r in ranges.split(','):
+        a, b = r.split('-', 1) if '-' in r else (r, r)
+        try:
+            for i in range(int(a), int(b) + 1):
+                ret.append(f'{base}_{i}')
+        except ValueError:
+            continue
+    return ret
@@ -0,0 +1,25 @@
+import os
+import json
+import time
+
+
+# The daemon tells the wrappers of its running jobs (see sdk/_run_job.py) about the status of their job through this file
+job_control_file_name = 'protocaas-job-control.json'
+
+def _get_job_control_file_path(working_dir: str, *, containerized: bool) -> str:
+    """Where the control file of the job with this working directory is, on the host
+
+    A containerized job sees the tmp directory of its working directory as /tmp
+    (docker run, singularity), or is pointed to it (docker exec in a warm container),
+    so its control file is there. This is also what _start_job tells the wrapper.
+    """
+    if containerized:
+        return working_dir + '/tmp/' + job_control_file_name
+    return working_dir + '/' + job_control_file_name
+
+def _write_job_control_file(path: str, *, status: str):
+    """status is the status of the job on the server, or 'deleted'"""
+    tmp_path = f'{path}.{os.urandom(4).hex()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'status': status, 'timestamp': time.time()}, f)
+    os.replace(tmp_path, path) # atomic, so the wrapper never reads a partial file
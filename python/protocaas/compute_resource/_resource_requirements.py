@@ -0,0 +1,132 @@
+from typing import Dict, List, Union
+import os
+import math
+from dataclasses import dataclass, replace
+from ..sdk.App import App
+
+
+# Processors declare their resource needs with attributes, for example
+#   @attribute('num_cpus', '4')
+#   @attribute('memory_gb', '16')
+#   @attribute('disk_gb', '50')
+# Anything that is not declared falls back to the defaults below
+# A job can override these with input parameters of the same names, if the processor has such parameters
+default_num_cpus = 1
+default_memory_gb = 1
+default_disk_gb = 0
+
+@dataclass
+class ResourceRequirements:
+    """The resources needed by a single job"""
+    num_cpus: float
+    memory_gb: float
+    disk_gb: float
+
+@dataclass
+class ResourceUsage:
+    """The resources used by a single run of a processor"""
+    peak_memory_gb: float
+    mean_cpus: float # cpu time divided by wall time
+
+# Processors can also declare limits, which the job wrapper enforces (see sdk/_job_limits.py), for example
+#   @attribute('wall_time_limit_sec', '3600')
+#   @attribute('memory_limit_gb', '32')
+#   @attribute('cpu_limit', '8')
+# Anything that is not declared falls back to the node config (JOB_WALL_TIME_LIMIT_SEC, JOB_MEMORY_LIMIT_GB, JOB_CPU_LIMIT), and otherwise is not limited
+# As above, a job can override these with input parameters of the same names
+
+@dataclass
+class ResourceLimits:
+    """The limits of a single job (None for no limit)"""
+    wall_time_limit_sec: Union[float, None]
+    memory_limit_gb: Union[float, None]
+    cpu_limit: Union[float, None]
+
+# the environment variables of the node config, which are also how the limits are passed to the job wrapper
+resource_limit_env_vars = {
+    'wall_time_limit_sec': 'JOB_WALL_TIME_LIMIT_SEC',
+    'memory_limit_gb': 'JOB_MEMORY_LIMIT_GB',
+    'cpu_limit': 'JOB_CPU_LIMIT'
+}
+
+default_resource_requirements = ResourceRequirements(num_cpus=default_num_cpus, memory_gb=default_memory_gb, disk_gb=default_disk_gb)
+
+# Right-sizing: once a processor has run this many times, its requirements are derived from the recent runs
+right_sizing_min_num_samples = 5
+right_sizing_num_samples = 20
+right_sizing_memory_headroom = 1.25
+
+def _get_processor_resource_requirements(app: App, processor_name: str, *, defaults: ResourceRequirements = default_resource_requirements) -> ResourceRequirements:
+    processor = next((p for p in app._processors if p._name == processor_name), None)
+    if processor is None:
+        raise Exception(f'Processor not found in app {app._name}: {processor_name}')
+    attributes = {a.name: a.value for a in processor._attributes}
+    return ResourceRequirements(
+        num_cpus=_get_numeric_attribute(attributes, 'num_cpus', defaults.num_cpus),
+        memory_gb=_get_numeric_attribute(attributes, 'memory_gb', defaults.memory_gb),
+        disk_gb=_get_numeric_attribute(attributes, 'disk_gb', defaults.disk_gb)
+    )
+
+def _apply_job_resource_overrides(rr: ResourceRequirements, job: dict) -> ResourceRequirements:
+    overrides = _get_job_numeric_parameters(job, ['num_cpus', 'memory_gb', 'disk_gb'])
+    if len(overrides) == 0:
+        return rr
+    return replace(rr, **overrides)
+
+def _get_processor_resource_limits(app: App, processor_name: str) -> ResourceLimits:
+    processor = next((p for p in app._processors if p._name == processor_name), None)
+    if processor is None:
+        raise Exception(f'Processor not found in app {app._name}: {processor_name}')
+    attributes = {a.name: a.value for a in processor._attributes}
+    limits = {}
+    for name, env_var in resource_limit_env_vars.items():
+        value = _get_numeric_attribute(attributes, name, None)
+        if value is None and os.environ.get(env_var, ''):
+            value = float(os.environ[env_var])
+        limits[name] = value if value is not None and value > 0 else None
+    return ResourceLimits(**limits)
+
+def _apply_job_resource_limit_overrides(rl: ResourceLimits, job: dict) -> ResourceLimits:
+    overrides = _get_job_numeric_parameters(job, list(resource_limit_env_vars.keys()))
+    if len(overrides) == 0:
+        return rl
+    return replace(rl, **overrides)
+
+def _get_resource_limits_env_vars(rl: ResourceLimits) -> Dict[str, str]:
+    """The environment variables that tell the job wrapper the limits of the job"""
+    ret = {}
+    for name, env_var in resource_limit_env_vars.items():
+        value = getattr(rl, name)
+        if value is not None:
+            ret[env_var] = str(value)
+    return ret
+
+def _get_job_numeric_parameters(job: dict, names: List[str]) -> Dict[str, float]:
+    ret = {}
+    for p in job.get('inputParameters', []):
+        if p['name'] in names:
+            value = p.get('value', None)
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0:
+                ret[p['name']] = float(value)
+    return ret
+
+def _right_size_resource_requirements(rr: ResourceRequirements, usage_history: List[ResourceUsage]) -> ResourceRequirements:
+    """Size a job by the peak usage of the recent runs of its processor, if there are enough of them"""
+    if len(usage_history) < right_sizing_min_num_samples:
+        return rr
+    recent = usage_history[-right_sizing_num_samples:]
+    peak_memory_gb = max(u.peak_memory_gb for u in recent)
+    peak_cpus = max(u.mean_cpus for u in recent)
+    return replace(rr,
+        num_cpus=max(1, math.ceil(peak_cpus)),
+        memory_gb=max(0.5, peak_memory_gb * right_sizing_memory_headroom)
+    )
+
+def _get_numeric_attribute(attributes: dict, name: str, default: float) -> float:
+    value = attributes.get(name, None)
+    if value is None or value == '':
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        raise Exception(f'Invalid value for processor attribute {name}: {value}')
@@ -1,8 +1,12 @@
 import os
 import subprocess
 from ..sdk.App import App
-from ..sdk._post_api_request import _post_api_request
+from ..sdk._api_request_batcher import _post_api_request_batched
 from ._run_job_in_aws_batch import _run_job_in_aws_batch
+from ._resource_requirements import ResourceRequirements, ResourceLimits, _get_resource_limits_env_vars
+from .DockerWarmPool import DockerWarmPool, _get_docker_exec_command
+from .SingularityImageCache import SingularityImageCache
+from ._job_control import job_control_file_name, _get_job_control_file_path
 
 
 def _set_job_status_to_starting(*,
@@ -15,7 +19,8 @@ def _set_job_status_to_starting(*,
         'jobPrivateKey': job_private_key,
         'status': 'starting'
     }
-    resp = _post_api_request(req)
+    # when many jobs are started at once (e.g., a SLURM batch), these are sent together
+    resp = _post_api_request_batched(req)
     if not resp['success']:
         raise Exception(f'Error setting job status to starting: {resp["error"]}')
 
@@ -25,17 +30,23 @@ def _start_job(*,
     processor_name: str,
     app: App,
     run_process: bool = True,
-    return_shell_command: bool = False
+    return_shell_command: bool = False,
+    set_status_to_starting: bool = True, # False when resubmitting a job that is already starting
+    resource_requirements: ResourceRequirements = None, # used for AWS Batch jobs
+    resource_limits: ResourceLimits = None, # enforced by the job wrapper
+    docker_warm_pool: DockerWarmPool = None, # used for local docker jobs, if enabled
+    singularity_image_cache: SingularityImageCache = None # used for singularity jobs
 ):
     if return_shell_command and run_process:
         raise Exception('Cannot set both run_process and return_shell_command to True')
     if not return_shell_command and not run_process:
         raise Exception('Cannot set both run_process and return_shell_command to False')
 
-    _set_job_status_to_starting(
-        job_id=job_id,
-        job_private_key=job_private_key
-    )
+    if set_status_to_starting:
+        _set_job_status_to_starting(
+            job_id=job_id,
+            job_private_key=job_private_key
+        )
     if not hasattr(app, '_executable_path'):
         raise Exception(f'App does not have an executable path')
     executable_path: str = app._executable_path
@@ -43,6 +54,7 @@ def _start_job(*,
     aws_batch_job_queue: str = app._aws_batch_job_queue
     aws_batch_job_definition: str = app._aws_batch_job_definition
     slurm_opts: dict = app._slurm_opts
+    limits_env_vars = _get_resource_limits_env_vars(resource_limits) if resource_limits is not None else {}
 
     if slurm_opts is not None:
         if run_process:
@@ -57,13 +69,15 @@ def _start_job(*,
             raise Exception(f'aws_batch_job_queue is set but container is not set')
         print(f'Running job in AWS Batch: {job_id} {processor_name} {aws_batch_job_queue} {aws_batch_job_definition}')
         try:
-            _run_job_in_aws_batch(
+            return _run_job_in_aws_batch(
                 job_id=job_id,
                 job_private_key=job_private_key,
                 aws_batch_job_queue=aws_batch_job_queue,
                 aws_batch_job_definition=aws_batch_job_definition,
                 container=container, # for verifying consistent with job definition
-                command=executable_path # for verifying consistent with job definition
+                command=executable_path, # for verifying consistent with job definition
+                resource_requirements=resource_requirements,
+                env_vars=limits_env_vars
             )
         except Exception as e:
             raise Exception(f'Error running job in AWS Batch: {e}')
@@ -83,8 +97,10 @@ def _start_job(*,
     if kachery_cloud_client_id is not None:
         env_vars['KACHERY_CLOUD_CLIENT_ID'] = kachery_cloud_client_id
         env_vars['KACHERY_CLOUD_PRIVATE_KEY'] = kachery_cloud_private_key
+    env_vars.update(limits_env_vars)
 
     if not container:
+        env_vars['JOB_CONTROL_FILE'] = _get_job_control_file_path(working_dir, containerized=False)
         if run_process:
             print(f'Running: {executable_path}')
             process = subprocess.Popen(
@@ -99,23 +115,45 @@ def _start_job(*,
                     **env_vars
                 }
             )
+            return process
         elif return_shell_command:
-            return f'cd {working_dir} && PYTHONUNBUFFERED=1 JOB_ID={job_id} JOB_PRIVATE_KEY={job_private_key} APP_EXECUTABLE={executable_path} {executable_path}'
+            limits_str = ''.join([f'{k}={v} ' for k, v in limits_env_vars.items()])
+            return f'cd {working_dir} && PYTHONUNBUFFERED=1 JOB_ID={job_id} JOB_PRIVATE_KEY={job_private_key} APP_EXECUTABLE={executable_path} JOB_CONTROL_FILE={env_vars["JOB_CONTROL_FILE"]} {limits_str}{executable_path}'
     else:
         container_method = os.environ.get('CONTAINER_METHOD', 'docker')
         if container_method == 'docker':
             tmpdir = working_dir + '/tmp'
             os.makedirs(tmpdir, exist_ok=True)
             os.makedirs(tmpdir + '/working', exist_ok=True)
+            env_vars['JOB_CONTROL_FILE'] = '/tmp/' + job_control_file_name # tmpdir is /tmp in the container
             cmd2 = [
-                'docker', 'run', '-it'
+                'docker', 'run', '-it', '--rm'
             ]
-            cmd2.extend(['v', f'{tmpdir}:/tmp'])
+            cmd2.extend(['--name', _get_job_container_name(job_id)]) # so that the daemon can kill it
+            # docker enforces the memory and cpu limits of the whole container (the job wrapper inside also enforces them, see sdk/_job_limits.py)
+            if resource_limits is not None and resource_limits.memory_limit_gb is not None:
+                memory_limit_mb = int(resource_limits.memory_limit_gb * 1024)
+                cmd2.extend(['--memory', f'{memory_limit_mb}m', '--memory-swap', f'{memory_limit_mb}m'])
+            if resource_limits is not None and resource_limits.cpu_limit is not None:
+                cmd2.extend(['--cpus', str(resource_limits.cpu_limit)])
+            cmd2.extend(['-v', f'{tmpdir}:/tmp'])
             cmd2.extend(['--workdir', '/tmp/working']) # the working directory will be /tmp/working
             for k, v in env_vars.items():
                 cmd2.extend(['-e', f'{k}={v}'])
             cmd2.extend([container])
             cmd2.extend([executable_path])
+            # docker exec can't limit a single job, and the limits of a warm container would outlast the job, so such jobs are started cold
+            has_container_limits = resource_limits is not None and (resource_limits.memory_limit_gb is not None or resource_limits.cpu_limit is not None)
+            warm_container_id = docker_warm_pool.acquire(image=container, job_id=job_id) if docker_warm_pool is not None and run_process and not has_container_limits else None
+            if warm_container_id is not None:
+                # The jobs directory is mounted at the same path in the warm container, so the job gets the same working directory
+                # /tmp of the container is shared by its jobs, so point TMPDIR to the tmp directory of the job
+                cmd2 = _get_docker_exec_command(
+                    container_id=warm_container_id,
+                    working_dir=tmpdir + '/working',
+                    env_vars={**env_vars, 'TMPDIR': tmpdir, 'JOB_CONTROL_FILE': _get_job_control_file_path(working_dir, containerized=True)},
+                    executable_path=executable_path
+                )
             if run_process:
                 print(f'Running: {" ".join(cmd2)}')
                 process = subprocess.Popen(
@@ -126,12 +164,14 @@ def _start_job(*,
                     stdout=subprocess.DEVNULL,
                     stderr=subprocess.DEVNULL,
                 )
+                return process
             elif return_shell_command:
                 return f'cd {working_dir} && {" ".join(cmd2)}'
         elif container_method == 'singularity':
             tmpdir = working_dir + '/tmp' # important to provide a /tmp directory for singularity so that it doesn't run out of disk space
             os.makedirs(tmpdir, exist_ok=True)
             os.makedirs(tmpdir + '/working', exist_ok=True)
+            env_vars['JOB_CONTROL_FILE'] = '/tmp/' + job_control_file_name # tmpdir is /tmp in the container
             cmd2 = ['singularity', 'exec']
             cmd2.extend(['--bind', f'{tmpdir}:/tmp'])
             # The working directory should be /tmp/working so that if the container wants to write to the working directory, it will not run out of space
@@ -141,7 +181,13 @@ def _start_job(*,
             cmd2.extend(['--nv'])
             for k, v in env_vars.items():
                 cmd2.extend(['--env', f'{k}={v}'])
-            cmd2.extend([f'docker://{container}'])
+            image = f'docker://{container}'
+            if singularity_image_cache is not None:
+                try:
+                    image = singularity_image_cache.get_image_path(container, job_id=job_id)
+                except Exception as e:
+                    print(f'Unable to get cached singularity image, using {image}: {str(e)}')
+            cmd2.extend([image])
             cmd2.extend([executable_path])
             if run_process:
                 print(f'Running: {" ".join(cmd2)}')
@@ -153,6 +199,7 @@ def _start_job(*,
                     stdout=subprocess.DEVNULL,
                     stderr=subprocess.DEVNULL,
                 )
+                return process
             elif return_shell_command:
                 return f'cd {working_dir} && {" ".join(cmd2)}'
         else:
@@ -179,6 +226,10 @@ def _start_job(*,
 #         else:
 #             break
 
+def _get_job_container_name(job_id: str) -> str:
+    """The name of the docker container of a job that is started with docker run"""
+    return f'protocaas-job-{job_id}'
+
 def _get_kachery_cloud_credentials():
     try:
         from kachery_cloud._client_keys import _get_client_keys_hex
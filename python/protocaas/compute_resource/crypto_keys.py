@@ -1,61 +1,2 @@
-import os
-import base64
-import numpy as np
-
-def sign_message(msg: dict, public_key_hex: str, private_key_hex: str) -> str:
-    return _sign_message(msg, public_key_hex, private_key_hex)
-
-ed25519PubKeyPrefix = "302a300506032b6570032100"
-ed25519PrivateKeyPrefix = "302e020100300506032b657004220420"
-
-def _deterministic_json_dumps(x: dict):
-    import simplejson
-    return simplejson.dumps(x, separators=(',', ':'), indent=None, allow_nan=False, sort_keys=True)
-
-def _sha1_of_string(txt: str) -> str:
-    import hashlib
-    hh = hashlib.sha1(txt.encode('utf-8'))
-    ret = hh.hexdigest()
-    return ret
-
-def _sign_message(msg: dict, public_key_hex: str, private_key_hex: str) -> str:
-    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
-    msg_json = _deterministic_json_dumps(msg)
-    msg_hash = _sha1_of_string(msg_json)
-    msg_bytes = bytes.fromhex(msg_hash)
-    privk = Ed25519PrivateKey.from_private_bytes(bytes.fromhex(private_key_hex))
-    pubk = Ed25519PublicKey.from_public_bytes(bytes.fromhex(public_key_hex))
-    signature = privk.sign(msg_bytes).hex()
-    pubk.verify(bytes.fromhex(signature), msg_bytes)
-    return signature
-
-def _verify_signature(msg: dict, public_key_hex: str, signature: str):
-    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
-    msg_json = _deterministic_json_dumps(msg)
-    msg_hash = _sha1_of_string(msg_json)
-    msg_bytes = bytes.fromhex(msg_hash)
-    pubk = Ed25519PublicKey.from_public_bytes(bytes.fromhex(public_key_hex))
-    try:
-        pubk.verify(bytes.fromhex(signature), msg_bytes)
-    except:
-        return False
-    return True
-
-def generate_keypair():
-    from cryptography.hazmat.primitives import serialization
-    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
-    privk = Ed25519PrivateKey.generate()
-    pubk = privk.public_key()
-    private_key_hex = privk.private_bytes(
-        encoding=serialization.Encoding.Raw,
-        format=serialization.PrivateFormat.Raw,
-        encryption_algorithm=serialization.NoEncryption()
-    ).hex()
-    public_key_hex = pubk.public_bytes(
-        encoding=serialization.Encoding.Raw,
-        format=serialization.PublicFormat.Raw
-    ).hex()
-    test_msg = {'a': 1}
-    test_signature = _sign_message(test_msg, public_key_hex, private_key_hex)
-    assert _verify_signature(test_msg, public_key_hex, test_signature)
-    return public_key_hex, private_key_hex
\ No newline at end of file
+# The compute resource signs with the same (cached) signers as the rest of the package
+from ..crypto_keys import sign_message, generate_keypair, Signer, _sign_message, _verify_signature, _deterministic_json_dumps, _sha1_of_string
@@ -15,7 +15,29 @@ env_var_keys = [
     'SINGLETON_JOB_ID',
     'BATCH_AWS_ACCESS_KEY_ID',
     'BATCH_AWS_SECRET_ACCESS_KEY',
-    'BATCH_AWS_REGION'
+    'BATCH_AWS_REGION',
+    'LOCAL_JOB_NUM_CPUS',
+    'LOCAL_JOB_MEMORY_GB',
+    'LOCAL_JOB_DISK_GB',
+    'LOCAL_JOB_CPU_OVERCOMMIT',
+    'LOCAL_JOB_MEMORY_OVERCOMMIT',
+    'SLURM_SUBMIT_METHOD',
+    'AWS_BATCH_RIGHT_SIZING',
+    'DOCKER_WARM_POOL',
+    'DOCKER_WARM_POOL_MAX_SIZE',
+    'DOCKER_WARM_POOL_MAX_JOBS_PER_CONTAINER',
+    'SINGULARITY_IMAGE_CACHE_GB',
+    'JOB_DIR_MAX_AGE_HOURS',
+    'JOB_DIR_DISK_HIGH_WATER',
+    'JOB_DIR_DISK_LOW_WATER',
+    'PUBSUB_RELAY_URL',
+    'PROTOCAAS_API_TIMEOUT_SEC',
+    'PROTOCAAS_API_MAX_RETRIES',
+    'PROTOCAAS_API_GZIP',
+    'JOB_WALL_TIME_LIMIT_SEC',
+    'JOB_MEMORY_LIMIT_GB',
+    'JOB_CPU_LIMIT',
+    'JOB_CGROUP_PARENT'
 ]
 
 def init_compute_resource_node(*, dir: str, compute_resource_id: Optional[str]=None, compute_resource_private_key: Optional[str]=None):
@@ -1,22 +1,77 @@
-from typing import List, Dict
+from typing import List, Dict, Callable, Tuple, Union
 import os
 import yaml
 import time
+import asyncio
+import signal
 import subprocess
-from pathlib import Path
-import shutil
+from concurrent.futures import ThreadPoolExecutor
 import multiprocessing
 from .init_compute_resource_node import env_var_keys
 from ..sdk.App import App
 from ..sdk._post_api_request import _post_api_request
 from ..sdk._run_job import _set_job_status
-from .PubsubClient import PubsubClient
+from .PubsubClient import PubsubClient, _create_pubsub_client
+from .LocalJobScheduler import LocalJobScheduler
+from .JobJournal import JobJournal, JobJournalEntry, terminal_states
+from .LocalJobSupervisor import LocalJobSupervisor, _describe_returncode
+from ._resource_requirements import ResourceRequirements, ResourceUsage, ResourceLimits, _get_processor_resource_requirements, _apply_job_resource_overrides, _right_size_resource_requirements, _get_processor_resource_limits, _apply_job_resource_limit_overrides
 from .crypto_keys import sign_message
 from ..sdk.App import App
-from ._start_job import _start_job
+from ._start_job import _start_job, _get_job_container_name
+from .SlurmJobHandler import SlurmJobHandler
+from .DockerWarmPool import DockerWarmPool
+from .SingularityImageCache import SingularityImageCache
+from .AppSpecCache import AppSpecCache, _get_app_spec_cache_key
+from .JobDirectoryCollector import _run_job_directory_collector
+from ._job_control import _get_job_control_file_path, _write_job_control_file
+from .SlurmJobReconciler import SlurmJobReconciler, slurm_state_not_found
+from .AwsBatchExecutor import max_concurrent_aws_batch_submissions, default_aws_batch_resource_requirements, aws_batch_terminal_statuses, _get_aws_batch_executor, _get_aws_batch_job_failure_reason, _aws_batch_job_lost_its_host
 
 
-max_simultaneous_local_jobs = 2
+# safety net: resync with the server periodically even if no pubsub messages arrive
+handle_jobs_resync_interval_sec = 60
+
+# the unfinished jobs are synced incrementally, but every so often we fetch the full list
+full_unfinished_jobs_sync_interval_sec = 60 * 10
+
+# at most this many apps are loaded at once at startup
+max_concurrent_app_loads = 8
+
+# finished jobs are kept in the journal for this long
+journal_retention_sec = 60 * 60 * 24 * 7
+
+# how often to ask slurm about the jobs we submitted
+slurm_reconcile_interval_sec = 60
+
+# after the slurm job of a protocaas job has ended, give the job wrapper this long to report the final status
+slurm_ended_job_grace_period_sec = 60 * 2
+
+# a job that slurm lost before it started running is submitted again, at most this many times
+slurm_requeue_states = ['BOOT_FAIL', 'NODE_FAIL', 'PREEMPTED']
+max_slurm_requeues = 2
+
+# how often to ask AWS Batch about the jobs we submitted
+aws_batch_reconcile_interval_sec = 60
+
+# after the Batch job of a protocaas job has ended, give the job wrapper this long to report the final status
+aws_batch_ended_job_grace_period_sec = 60 * 2
+
+# how often the statuses of the jobs running on this node (or its slurm cluster) are fetched and passed to their wrappers
+# (the wrappers look for a new control file every second, see sdk/_run_job.py)
+job_heartbeat_interval_sec = 30
+
+# the jobs whose wrappers can read a control file written by this node (AWS Batch jobs run elsewhere)
+job_heartbeat_handle_types = ['pid', 'slurm_batch', 'slurm_array_task']
+
+# a canceled job that is still running this long after its wrapper was told is killed by the daemon
+job_cancel_kill_timeout_sec = 10
+
+# a Batch job that is missing from describe_jobs this long after it was submitted is considered lost
+aws_batch_job_not_found_grace_period_sec = 60 * 5
+
+# a job whose instance went away (e.g., spot reclaim) before it started running is submitted again, at most this many times
+max_aws_batch_resubmits = 2
 
 class Daemon:
     def __init__(self, *, dir: str):
@@ -28,19 +83,75 @@ class Daemon:
             raise ValueError('Compute resource has not been initialized in this directory, and the environment variable COMPUTE_RESOURCE_ID is not set.')
         if self._compute_resource_private_key is None:
             raise ValueError('Compute resource has not been initialized in this directory, and the environment variable COMPUTE_RESOURCE_PRIVATE_KEY is not set.')
-        self._apps: List[App] = _load_apps(compute_resource_id=self._compute_resource_id, compute_resource_private_key=self._compute_resource_private_key)
+        # The journal records every job we attempted to start, its backend handle, and its state transitions
+        # It survives restarts of the daemon
+        self._journal_path = os.path.join(dir, '.protocaas-compute-resource-node-journal.db')
+        self._journal = JobJournal(self._journal_path)
+        self._journal.prune(older_than_sec=journal_retention_sec)
+
+        # With singularity, each container is converted to a SIF once and shared by all jobs
+        # Loading the apps pulls the images of all apps ahead of the first job
+        # The images of the active jobs are not evicted, since a queued SLURM task may refer to one
+        self._singularity_image_cache: SingularityImageCache = None
+        if os.environ.get('CONTAINER_METHOD', 'docker') == 'singularity':
+            self._singularity_image_cache = SingularityImageCache(
+                cache_dir=os.getcwd() + '/singularity_images',
+                get_active_job_ids=lambda: set(e.job_id for e in self._journal.get_active_jobs())
+            )
+        self._apps: List[App] = _load_apps(
+            compute_resource_id=self._compute_resource_id,
+            compute_resource_private_key=self._compute_resource_private_key,
+            singularity_image_cache=self._singularity_image_cache,
+            app_spec_cache=AppSpecCache(cache_dir=os.path.join(dir, '.protocaas-app-spec-cache'))
+        )
+
+        # processor name -> (app, resource type), so that routing a job is a single lookup
+        self._processor_routes: Dict[str, Tuple[App, str]] = _build_processor_routes(self._apps)
+        self._resource_requirements_by_processor: Dict[str, ResourceRequirements] = {}
+        self._resource_limits_by_processor: Dict[str, ResourceLimits] = {}
+        # size AWS Batch jobs by the resources that past runs of the processor actually used
+        self._aws_batch_right_sizing = os.getenv('AWS_BATCH_RIGHT_SIZING', '') in ['1', 'true', 'True']
+        # the usage is reported by the job wrapper running in Batch, and fetched from the API once the job ended
+        self._job_resource_usage_supported = True
 
         # important to keep track of which jobs we attempted to start
         # so that we don't attempt multiple times in the case where starting failed
-        self._attempted_to_start_job_ids = set()
+        self._attempted_to_start_job_ids = self._journal.get_attempted_job_ids()
+        print(f'Restored {len(self._journal.get_active_jobs())} active jobs from the journal')
+
+        # The supervisor owns the processes of the local jobs
+        # Processes started by a previous run of the daemon are adopted, so we notice when they exit
+        self._local_job_supervisor = LocalJobSupervisor(on_exit=self._on_local_job_process_exit)
+        for entry in self._journal.get_active_jobs():
+            if entry.handle_type == 'pid':
+                self._local_job_supervisor.adopt(job_id=entry.job_id, job_private_key=None, handle=entry.handle)
+
+        # local mirror of the unfinished jobs for this compute resource, kept up to date incrementally
+        self._unfinished_jobs: Dict[str, dict] = {}
+        self._unfinished_jobs_cursor: float = None
+        # False if the API predates incremental syncs, in which case every sync is a full one
+        self._incremental_unfinished_jobs_sync_supported = True
+        self._timestamp_last_full_unfinished_jobs_sync = 0
 
         print(f'Loaded apps: {", ".join([app._name for app in self._apps])}')
 
+        self._local_job_scheduler = LocalJobScheduler(jobs_dir=os.getcwd() + '/jobs')
+
+        # optionally, local docker jobs run in containers that were started ahead of time
+        self._docker_warm_pool: DockerWarmPool = None
+        if os.getenv('DOCKER_WARM_POOL', '') in ['1', 'true', 'True'] and os.environ.get('CONTAINER_METHOD', 'docker') == 'docker':
+            self._docker_warm_pool = DockerWarmPool(jobs_dir=os.getcwd() + '/jobs')
+
         self._slurm_job_handlers_by_processor: Dict[str, SlurmJobHandler] = {}
         for app in self._apps:
             for processor in app._processors:
                 if app._slurm_opts is not None:
                     self._slurm_job_handlers_by_processor[processor._name] = SlurmJobHandler(self, app._slurm_opts)
+        self._slurm_job_reconciler = SlurmJobReconciler()
+        self._timestamp_last_slurm_reconcile = 0
+        self._timestamp_last_aws_batch_reconcile = 0
+        # job id -> when we first saw that its slurm or Batch job ended
+        self._ended_backend_job_timestamps: Dict[str, float] = {}
 
         spec_apps = []
         for app in self._apps:
@@ -59,132 +170,535 @@ class Daemon:
         _post_api_request(req)
 
         print('Getting pubsub info')
-        pubsub_subscription = get_pubsub_subscription(compute_resource_id=self._compute_resource_id, compute_resource_private_key=self._compute_resource_private_key)
-        self._pubsub_client = PubsubClient(
-            pubnub_subscribe_key=pubsub_subscription['pubnubSubscribeKey'],
-            pubnub_channel=pubsub_subscription['pubnubChannel'],
-            pubnub_user=pubsub_subscription['pubnubUser'],
-            compute_resource_id=self._compute_resource_id
-        )
-    def start(self):
-        timer_handle_jobs = 0
+        self._pubsub_subscription = get_pubsub_subscription(compute_resource_id=self._compute_resource_id, compute_resource_private_key=self._compute_resource_private_key)
+        self._pubsub_client: PubsubClient = None
 
-        # Start cleaning up old job directories
+        # The event loop is created in start()
+        # All blocking work (API requests, starting processes) runs on a single worker thread
+        # so that the handlers never run concurrently with one another
+        self._loop: asyncio.AbstractEventLoop = None
+        self._handle_jobs_event: asyncio.Event = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        # ... except for starting AWS Batch jobs, which is mostly waiting on round trips, so a burst is started concurrently
+        self._aws_batch_start_executor = ThreadPoolExecutor(max_workers=max_concurrent_aws_batch_submissions)
+    def start(self):
+        # Start cleaning up the directories of finished jobs
         # It's important to do this in a separate process
         # because it can take a long time to delete all the files in the tmp directories (remfile is the culprit)
         # and we don't want to block the main process from handling jobs
-        multiprocessing.Process(target=_cleanup_old_job_working_directories, args=(os.getcwd() + '/jobs',)).start()
+        multiprocessing.Process(target=_run_job_directory_collector, args=(os.getcwd() + '/jobs', self._journal_path), daemon=True).start()
 
         print('Starting compute resource')
+        asyncio.run(self._run())
+    async def _run(self):
+        self._loop = asyncio.get_running_loop()
+        self._handle_jobs_event = asyncio.Event()
+        self._handle_jobs_event.set() # handle jobs right away on startup
+
+        # Reap local job processes as soon as they exit
+        self._loop.add_signal_handler(signal.SIGCHLD, self._on_sigchld)
+
+        # Messages arrive on the thread of the pubsub client and are handed to the event loop
+        self._pubsub_client = _create_pubsub_client(
+            subscription=self._pubsub_subscription,
+            compute_resource_id=self._compute_resource_id,
+            on_message=lambda msg: self._loop.call_soon_threadsafe(self._handle_pubsub_message, msg),
+            relay_url=os.getenv('PUBSUB_RELAY_URL', '') or None
+        )
+
+        # One request for the statuses of all the jobs we run, rather than each job asking for its own
+        self._job_heartbeat_supported = True
+        self._call_later(job_heartbeat_interval_sec, self._job_heartbeat)
+
         while True:
-            elapsed_handle_jobs = time.time() - timer_handle_jobs
-            need_to_handle_jobs = elapsed_handle_jobs > 60
-            messages = self._pubsub_client.take_messages()
-            for msg in messages:
-                if msg['type'] == 'newPendingJob':
-                    need_to_handle_jobs = True
-                if msg['type'] == 'jobStatusChaged':
-                    need_to_handle_jobs = True
-            if need_to_handle_jobs:
-                timer_handle_jobs = time.time()
-                self._handle_jobs()
-            
-            for slurm_job_handler in self._slurm_job_handlers_by_processor.values():
-                slurm_job_handler.do_work()
-
-            time.sleep(1)
-    def _handle_jobs(self):
-        signature = sign_message({'type': 'computeResource.getUnfinishedJobs'}, self._compute_resource_id, self._compute_resource_private_key)
+            # Sleep until a pubsub message asks us to handle jobs, or until the periodic resync is due
+            try:
+                await asyncio.wait_for(self._handle_jobs_event.wait(), timeout=handle_jobs_resync_interval_sec)
+            except asyncio.TimeoutError:
+                pass
+            self._handle_jobs_event.clear()
+            await self._loop.run_in_executor(self._executor, self._run_guarded, self._handle_jobs)
+    def _handle_pubsub_message(self, msg: dict):
+        # called on the event loop thread
+        if msg['type'] == 'newPendingJob':
+            self._handle_jobs_event.set()
+        elif msg['type'] == 'jobStatusChanged':
+            self._handle_jobs_event.set()
+        elif msg['type'] == 'jobCanceled':
+            job_id = msg['jobId']
+            self._loop.run_in_executor(self._executor, self._run_guarded, lambda: self._cancel_job(job_id))
+            self._handle_jobs_event.set()
+    def _on_sigchld(self):
+        # called on the event loop thread
+        self._loop.run_in_executor(self._executor, self._run_guarded, self._reap_local_job_processes)
+    def _reap_local_job_processes(self):
+        num_exited = self._local_job_supervisor.reap()
+        if num_exited > 0:
+            # capacity was freed, so maybe we can start more jobs
+            self._loop.call_soon_threadsafe(self._handle_jobs_event.set)
+    def _on_local_job_process_exit(self, job_id: str, job_private_key: Union[str, None], returncode: Union[int, None]):
+        description = _describe_returncode(returncode)
+        print(f'Job process {job_id} {description}')
+        self._journal.record_state(job_id=job_id, state='finished', detail=f'process {description}')
+        if self._docker_warm_pool is not None:
+            self._docker_warm_pool.release(job_id)
+        if returncode == 0:
+            return
+        # The job wrapper reports the final status itself and then exits normally
+        # So if the job is still unfinished, the wrapper was killed or crashed, and nobody else is going to report it
+        job = self._unfinished_jobs.get(job_id, None)
+        if job is None:
+            return
+        msg = f'Job process {description}'
+        try:
+            _set_job_status(job_id=job_id, job_private_key=job_private_key or job['jobPrivateKey'], status='failed', error=msg)
+        except Exception as e:
+            # for example, the job completed after our last sync
+            print(f'Unable to set job status to failed: {str(e)}')
+    def _job_heartbeat(self):
+        try:
+            self._send_job_heartbeat()
+        finally:
+            if self._job_heartbeat_supported:
+                self._call_later(job_heartbeat_interval_sec, self._job_heartbeat)
+    def _send_job_heartbeat(self):
+        entries = [e for e in self._journal.get_active_jobs() if e.handle_type in job_heartbeat_handle_types]
+        if len(entries) == 0:
+            return
+        try:
+            resp = self._get_job_statuses([e.job_id for e in entries])
+        except Exception as e:
+            if 'Invalid request' in str(e):
+                # the wrappers find no control file and ask the API themselves, as before
+                print('The API does not support computeResource.getJobStatuses, job wrappers will poll their job status')
+                self._job_heartbeat_supported = False
+                return
+            raise
+        for entry in entries:
+            status = resp['jobStatuses'].get(entry.job_id, None)
+            path = self._get_job_control_file_path(entry)
+            if path is None:
+                continue
+            try:
+                _write_job_control_file(path, status=status if status is not None else 'deleted')
+            except Exception as e:
+                print(f'Unable to write the control file of job {entry.job_id}: {str(e)}')
+    def _get_job_statuses(self, job_ids: List[str], *, include_resource_usage: bool = False) -> dict:
         req = {
-            'type': 'computeResource.getUnfinishedJobs',
+            'type': 'computeResource.getJobStatuses',
             'computeResourceId': self._compute_resource_id,
-            'signature': signature,
-            'nodeId': self._node_id,
-            'nodeName': self._node_name
+            'signature': sign_message({'type': 'computeResource.getJobStatuses'}, self._compute_resource_id, self._compute_resource_private_key),
+            'jobIds': job_ids
         }
-        resp = _post_api_request(req)
-        jobs = resp['jobs']
+        if include_resource_usage:
+            req['includeResourceUsage'] = True
+        return _post_api_request(req)
+    def _cancel_job(self, job_id: str):
+        """Tell the wrapper of a job that was deleted to stop it, rather than letting it find out at the next heartbeat"""
+        entry = self._journal.get_job(job_id)
+        if entry is None or entry.state in terminal_states:
+            return
+        # anyone who can publish to our channel could send this, so make sure with the API that the job is really gone
+        if not self._job_heartbeat_supported:
+            return # the wrapper finds out by polling its job status
+        try:
+            resp = self._get_job_statuses([job_id])
+        except Exception as e:
+            print(f'Unable to confirm that job {job_id} was canceled, not canceling it: {str(e)}')
+            return
+        if resp['jobStatuses'].get(job_id, None) is not None:
+            print(f'Ignoring cancellation of job {job_id}, which still exists')
+            return
+        print(f'Canceling job {job_id}')
+        if entry.handle_type == 'aws_batch_job':
+            # the wrapper can't be reached, but Batch stops the container
+            _get_aws_batch_executor().terminate_job(entry.handle, reason='The job was canceled')
+            return
+        if entry.handle_type in job_heartbeat_handle_types:
+            path = self._get_job_control_file_path(entry)
+            if path is not None:
+                _write_job_control_file(path, status='deleted')
+        # in case the wrapper is stuck or can't see the control file
+        self._call_later(job_cancel_kill_timeout_sec, lambda: self._kill_canceled_job(job_id))
+    def _get_job_control_file_path(self, entry: JobJournalEntry) -> Union[str, None]:
+        """None if the job has no working directory (any more) or its app is not known"""
+        working_dir = f'{os.getcwd()}/jobs/{entry.job_id}'
+        if not os.path.isdir(working_dir):
+            return None
+        app = self._find_app_with_processor(entry.processor_name)
+        if app is None:
+            return None
+        return _get_job_control_file_path(working_dir, containerized=bool(app._executable_container))
+    def _kill_canceled_job(self, job_id: str):
+        entry = self._journal.get_job(job_id)
+        if entry is None or entry.state in terminal_states:
+            return
+        if entry.handle_type == 'pid':
+            if not self._local_job_supervisor.is_running(job_id):
+                return
+            print(f'Job {job_id} is still running after it was canceled, terminating it')
+            # the wrapper kills the processes of the job when it gets SIGTERM
+            self._local_job_supervisor.signal(job_id, signal.SIGTERM)
+            app = self._find_app_with_processor(entry.processor_name)
+            if app is not None and app._executable_container and os.environ.get('CONTAINER_METHOD', 'docker') == 'docker':
+                # neither docker run (it has a tty) nor docker exec passes signals on to the container
+                if self._docker_warm_pool is None or not self._docker_warm_pool.kill_job(job_id):
+                    _kill_docker_container(_get_job_container_name(job_id))
+        elif entry.handle_type == 'slurm_array_task':
+            print(f'Job {job_id} is still running after it was canceled, canceling SLURM job {entry.handle}')
+            subprocess.run(['scancel', entry.handle], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=60)
+        # the tasks of an srun batch can't be canceled one by one
+    def _call_later(self, delay: float, func: Callable[[], None]):
+        """Run func on the worker thread after delay seconds. This is safe to call from any thread."""
+        def callback():
+            self._loop.run_in_executor(self._executor, self._run_guarded, func)
+        self._loop.call_soon_threadsafe(self._loop.call_later, delay, callback)
+    def _run_guarded(self, func: Callable[[], None]):
+        try:
+            func()
+        except Exception as e:
+            print(f'Error in compute resource daemon: {str(e)}')
+    def _handle_jobs(self):
+        jobs = self._sync_unfinished_jobs()
+        self._local_job_supervisor.reap()
+        self._reconcile_journal()
+
+        # Split the jobs by resource type in a single pass
+        local_jobs: List[dict] = []
+        aws_batch_jobs: List[dict] = []
+        slurm_jobs: List[dict] = []
+        for job in jobs:
+            resource_type = self._get_job_resource_type(job)
+            if resource_type == 'local':
+                local_jobs.append(job)
+            elif resource_type == 'aws_batch':
+                aws_batch_jobs.append(job)
+            elif resource_type == 'slurm':
+                slurm_jobs.append(job)
 
         # Local jobs
-        local_jobs = [job for job in jobs if self._is_local_job(job)]
-        num_non_pending_local_jobs = len([job for job in local_jobs if job['status'] != 'pending'])
-        if num_non_pending_local_jobs < max_simultaneous_local_jobs:
-            pending_local_jobs = [job for job in local_jobs if job['status'] == 'pending']
-            pending_local_jobs = _sort_jobs_by_timestamp_created(pending_local_jobs)
-            num_to_start = min(max_simultaneous_local_jobs - num_non_pending_local_jobs, len(pending_local_jobs))
-            local_jobs_to_start = pending_local_jobs[:num_to_start]
-            for job in local_jobs_to_start:
-                self._start_job(job)
+        # The supervisor knows which local jobs are actually running on this node
+        running_local_jobs = [self._unfinished_jobs[job_id] for job_id in self._local_job_supervisor.get_running_job_ids() if job_id in self._unfinished_jobs]
+        pending_local_jobs = [job for job in local_jobs if job['status'] == 'pending' and job['jobId'] not in self._attempted_to_start_job_ids]
+        pending_local_jobs = _sort_jobs_by_timestamp_created(pending_local_jobs)
+        local_jobs_to_start, local_jobs_too_large = self._local_job_scheduler.schedule(
+            running_jobs=running_local_jobs,
+            pending_jobs=pending_local_jobs,
+            get_requirements=self._get_job_resource_requirements
+        )
+        for job in local_jobs_too_large:
+            rr = self._get_job_resource_requirements(job)
+            capacity = self._local_job_scheduler.get_capacity()
+            self._fail_job(job, f'Job requires more resources than this compute resource node provides ({rr.num_cpus:g} CPUs, {rr.memory_gb:g} GB memory, {rr.disk_gb:g} GB disk required; {capacity.num_cpus:g} CPUs, {capacity.memory_gb:.1f} GB memory, {capacity.disk_gb:.1f} GB disk available)')
+        for job in local_jobs_to_start:
+            self._start_job(job)
+        if self._docker_warm_pool is not None:
+            # so that containers of images that are no longer in demand are removed
+            self._docker_warm_pool.maintain()
         
         # AWS Batch jobs
-        aws_batch_jobs = [job for job in jobs if self._is_aws_batch_job(job)]
-        for job in aws_batch_jobs:
-            self._start_job(job)
+        # _start_job is safe to run concurrently for distinct jobs, and we wait for all of them before moving on
+        pending_aws_batch_jobs = [job for job in aws_batch_jobs if self._job_is_pending(job) and job['jobId'] not in self._attempted_to_start_job_ids]
+        list(self._aws_batch_start_executor.map(self._start_job_guarded, pending_aws_batch_jobs))
         
         # SLURM jobs
-        slurm_jobs = [job for job in jobs if self._is_slurm_job(job) and self._job_is_pending(job)]
-        for job in slurm_jobs:
+        # a job that was handed to slurm stays pending on the server until it runs, so it must not be added again
+        pending_slurm_jobs = [job for job in slurm_jobs if self._job_is_pending(job) and job['jobId'] not in self._attempted_to_start_job_ids]
+        for job in pending_slurm_jobs:
             processor_name = job['processorName']
             if processor_name not in self._slurm_job_handlers_by_processor:
                 raise Exception(f'Unexpected: Could not find slurm job handler for processor {processor_name}')
             self._slurm_job_handlers_by_processor[processor_name].add_job(job)
+        if time.time() - self._timestamp_last_slurm_reconcile >= slurm_reconcile_interval_sec:
+            self._timestamp_last_slurm_reconcile = time.time()
+            self._reconcile_slurm_jobs()
+        if time.time() - self._timestamp_last_aws_batch_reconcile >= aws_batch_reconcile_interval_sec:
+            self._timestamp_last_aws_batch_reconcile = time.time()
+            self._reconcile_aws_batch_jobs()
 
+    def _sync_unfinished_jobs(self) -> List[dict]:
+        """Bring the local mirror of unfinished jobs up to date and return its contents"""
+        elapsed_since_full_sync = time.time() - self._timestamp_last_full_unfinished_jobs_sync
+        full_sync = self._unfinished_jobs_cursor is None or elapsed_since_full_sync > full_unfinished_jobs_sync_interval_sec
+        signature = sign_message({'type': 'computeResource.getUnfinishedJobs'}, self._compute_resource_id, self._compute_resource_private_key)
+        req = {
+            'type': 'computeResource.getUnfinishedJobs',
+            'computeResourceId': self._compute_resource_id,
+            'signature': signature,
+            'nodeId': self._node_id,
+            'nodeName': self._node_name
+        }
+        resp = None
+        if self._incremental_unfinished_jobs_sync_supported:
+            try:
+                resp = _post_api_request({**req, 'sinceCursor': 0 if full_sync else self._unfinished_jobs_cursor})
+            except Exception as e:
+                if 'Invalid request' not in str(e):
+                    raise
+                print('The API does not support incremental syncs of unfinished jobs, getting all of them every time')
+                self._incremental_unfinished_jobs_sync_supported = False
+            if resp is not None and 'cursor' not in resp:
+                # the API ignored sinceCursor, so these are all the unfinished jobs
+                print('The API did not return a cursor, getting all the unfinished jobs every time')
+                self._incremental_unfinished_jobs_sync_supported = False
+                full_sync = True
+        if resp is None:
+            resp = _post_api_request(req)
+            full_sync = True
+        if full_sync:
+            self._unfinished_jobs = {job['jobId']: job for job in resp['jobs']}
+            self._timestamp_last_full_unfinished_jobs_sync = time.time()
+        else:
+            # resp['jobs'] only contains the jobs that changed since the cursor
+            for job in resp['jobs']:
+                self._unfinished_jobs[job['jobId']] = job
+            unfinished_job_ids = set(resp['unfinishedJobIds'])
+            for job_id in list(self._unfinished_jobs.keys()):
+                if job_id not in unfinished_job_ids:
+                    del self._unfinished_jobs[job_id]
+        self._unfinished_jobs_cursor = resp.get('cursor', None)
+        return list(self._unfinished_jobs.values())
+    def _reconcile_journal(self):
+        """Record the server-side status of the jobs we started"""
+        finished_aws_batch_job_ids: List[str] = []
+        for entry in self._journal.get_active_jobs():
+            job = self._unfinished_jobs.get(entry.job_id, None)
+            if job is None:
+                self._journal.record_state(job_id=entry.job_id, state='finished')
+                if entry.handle_type == 'aws_batch_job':
+                    finished_aws_batch_job_ids.append(entry.job_id)
+                continue
+            if job['status'] != entry.state:
+                self._journal.record_state(job_id=entry.job_id, state=job['status'])
+        if len(finished_aws_batch_job_ids) > 0 and self._aws_batch_right_sizing:
+            # only the ones that completed are recorded
+            self._record_job_resource_usage(finished_aws_batch_job_ids)
+    def _reconcile_slurm_jobs(self):
+        """Fail or requeue the jobs whose slurm job ended without the job wrapper reporting a final status"""
+        entries = [e for e in self._journal.get_active_jobs() if e.handle_type in ['slurm_batch', 'slurm_array_task']]
+        if len(entries) == 0:
+            return
+        ended_jobs = self._slurm_job_reconciler.get_ended_jobs(entries)
+        now = time.time()
+        for entry in entries:
+            slurm_state = ended_jobs.get(entry.job_id, None)
+            if slurm_state is None:
+                self._ended_backend_job_timestamps.pop(entry.job_id, None)
+                continue
+            timestamp_ended = self._ended_backend_job_timestamps.setdefault(entry.job_id, now)
+            if now - timestamp_ended < slurm_ended_job_grace_period_sec:
+                continue
+            del self._ended_backend_job_timestamps[entry.job_id]
+            job = self._unfinished_jobs.get(entry.job_id, None)
+            if job is None:
+                self._journal.record_state(job_id=entry.job_id, state='finished', detail=f'slurm job {entry.handle} {slurm_state}')
+                continue
+            if slurm_state == slurm_state_not_found:
+                msg = f'SLURM job {entry.handle} is no longer known to SLURM'
+            else:
+                msg = f'SLURM job {entry.handle} ended with state {slurm_state}'
+            handler = self._slurm_job_handlers_by_processor.get(job['processorName'], None)
+            # if the job is still starting, the job wrapper never ran, so it is safe to run it again
+            if slurm_state in slurm_requeue_states and job['status'] == 'starting' and handler is not None:
+                num_requeues = self._journal.get_num_transitions(job_id=entry.job_id, state='requeued')
+                if num_requeues < max_slurm_requeues:
+                    print(f'Requeuing job {entry.job_id}: {msg}')
+                    self._journal.record_requeue(job_id=entry.job_id, detail=msg)
+                    handler.add_job(job, requeue=True)
+                    continue
+            self._fail_started_job(job, msg)
+    def _reconcile_aws_batch_jobs(self):
+        """Fail or resubmit the jobs whose Batch job ended without the job wrapper reporting a final status"""
+        entries = [e for e in self._journal.get_active_jobs() if e.handle_type == 'aws_batch_job']
+        if len(entries) == 0:
+            return
+        descriptions = _get_aws_batch_executor().describe_jobs([e.handle for e in entries])
+        now = time.time()
+        for entry in entries:
+            desc = descriptions.get(entry.handle, None)
+            if desc is None:
+                ended = now - entry.timestamp_updated > aws_batch_job_not_found_grace_period_sec
+            else:
+                ended = desc['status'] in aws_batch_terminal_statuses
+            if not ended:
+                self._ended_backend_job_timestamps.pop(entry.job_id, None)
+                continue
+            timestamp_ended = self._ended_backend_job_timestamps.setdefault(entry.job_id, now)
+            if now - timestamp_ended < aws_batch_ended_job_grace_period_sec:
+                continue
+            del self._ended_backend_job_timestamps[entry.job_id]
+            job = self._unfinished_jobs.get(entry.job_id, None)
+            if job is None:
+                self._journal.record_state(job_id=entry.job_id, state='finished', detail=f'aws batch job {entry.handle} {desc["status"] if desc is not None else "not found"}')
+                continue
+            if desc is None:
+                msg = f'AWS Batch job {entry.handle} is no longer known to AWS Batch'
+            elif desc['status'] == 'FAILED':
+                msg = f'AWS Batch job {entry.handle} failed: {_get_aws_batch_job_failure_reason(desc)}'
+            else:
+                msg = f'AWS Batch job {entry.handle} exited without reporting a final status'
+            # if the job is still starting, the job wrapper never ran, so it is safe to run it again
+            if desc is not None and _aws_batch_job_lost_its_host(desc) and job['status'] == 'starting':
+                num_resubmits = self._journal.get_num_transitions(job_id=entry.job_id, state='requeued')
+                if num_resubmits < max_aws_batch_resubmits:
+                    print(f'Resubmitting job {entry.job_id}: {msg}')
+                    self._journal.record_requeue(job_id=entry.job_id, detail=msg)
+                    self._start_job(job, requeue=True)
+                    continue
+            self._fail_started_job(job, msg)
+    def _fail_started_job(self, job: dict, msg: str):
+        job_id = job['jobId']
+        print(f'Job {job_id} failed: {msg}')
+        self._journal.record_state(job_id=job_id, state='finished', detail=msg)
+        try:
+            _set_job_status(job_id=job_id, job_private_key=job['jobPrivateKey'], status='failed', error=msg)
+        except Exception as e:
+            # for example, the job wrapper reported the status after our last sync
+            print(f'Unable to set job status to failed: {str(e)}')
     def _get_job_resource_type(self, job: dict) -> str:
-        processor_name = job['processorName']
-        app: App = self._find_app_with_processor(processor_name)
-        if app is None:
+        route = self._processor_routes.get(job['processorName'], None)
+        if route is None:
             return None
-        if app._aws_batch_job_queue is not None:
-            return 'aws_batch'
-        elif app._slurm_opts is not None:
-            return 'slurm'
-        else:
-            return 'local'
-    def _is_local_job(self, job: dict) -> bool:
-        return self._get_job_resource_type(job) == 'local'
-    def _is_aws_batch_job(self, job: dict) -> bool:
-        return self._get_job_resource_type(job) == 'aws_batch'
-    def _is_slurm_job(self, job: dict) -> bool:
-        return self._get_job_resource_type(job) == 'slurm'
+        return route[1]
     def _job_is_pending(self, job: dict) -> bool:
         return job['status'] == 'pending'
-    def _start_job(self, job: dict, run_process: bool = True, return_shell_command: bool = False):
+    def _get_job_resource_requirements(self, job: dict) -> ResourceRequirements:
+        processor_name = job['processorName']
+        resource_type = self._get_job_resource_type(job)
+        rr = self._resource_requirements_by_processor.get(processor_name, None)
+        if rr is None:
+            app = self._find_app_with_processor(processor_name)
+            if resource_type == 'aws_batch':
+                rr = _get_processor_resource_requirements(app, processor_name, defaults=default_aws_batch_resource_requirements)
+            else:
+                rr = _get_processor_resource_requirements(app, processor_name)
+            self._resource_requirements_by_processor[processor_name] = rr
+        rr_job = _apply_job_resource_overrides(rr, job)
+        if rr_job is rr and resource_type == 'aws_batch' and self._aws_batch_right_sizing:
+            # only when the job does not ask for specific resources
+            rr_job = _right_size_resource_requirements(rr, self._journal.get_resource_usage_history(processor_name=processor_name))
+        return rr_job
+    def _get_job_resource_limits(self, job: dict) -> ResourceLimits:
+        processor_name = job['processorName']
+        rl = self._resource_limits_by_processor.get(processor_name, None)
+        if rl is None:
+            rl = _get_processor_resource_limits(self._find_app_with_processor(processor_name), processor_name)
+            self._resource_limits_by_processor[processor_name] = rl
+        return _apply_job_resource_limit_overrides(rl, job)
+    def _record_job_resource_usage(self, job_ids: List[str]):
+        """Record the resource usage that the job wrappers reported for these completed jobs, for right-sizing"""
+        if not self._job_resource_usage_supported:
+            return
+        try:
+            resp = self._get_job_statuses(job_ids, include_resource_usage=True)
+        except Exception as e:
+            if 'Invalid request' in str(e):
+                print('The API does not report the resource usage of jobs, AWS Batch jobs will not be right-sized')
+                self._job_resource_usage_supported = False
+                return
+            raise
+        usages = resp.get('jobResourceUsages', None) or {}
+        for job_id in job_ids:
+            if resp['jobStatuses'].get(job_id, None) != 'completed':
+                continue
+            u = usages.get(job_id, None)
+            if u is None:
+                continue # e.g., an older job wrapper
+            entry = self._journal.get_job(job_id)
+            if entry is None:
+                continue
+            self._journal.record_resource_usage(
+                job_id=job_id,
+                processor_name=entry.processor_name,
+                usage=ResourceUsage(peak_memory_gb=u['peakMemoryGb'], mean_cpus=u['meanCpus'])
+            )
+    def _fail_job(self, job: dict, msg: str):
         job_id = job['jobId']
         if job_id in self._attempted_to_start_job_ids:
-            return '' # see above comment about why this is necessary
+            return
         self._attempted_to_start_job_ids.add(job_id)
+        self._journal.record_start_attempt(job_id=job_id, processor_name=job['processorName'], resource_type=self._get_job_resource_type(job))
+        self._journal.record_state(job_id=job_id, state='start_failed', detail=msg)
+        print(f'Job {job_id} failed: {msg}')
+        _set_job_status(job_id=job_id, job_private_key=job['jobPrivateKey'], status='failed', error=msg)
+    def _start_job_guarded(self, job: dict):
+        try:
+            self._start_job(job)
+        except Exception as e:
+            # so that one failure does not hide the others
+            print(f'Error starting job {job["jobId"]}: {str(e)}')
+    def _start_job(self, job: dict, run_process: bool = True, return_shell_command: bool = False, requeue: bool = False):
+        job_id = job['jobId']
         job_private_key = job['jobPrivateKey']
         processor_name = job['processorName']
+        resource_type = self._get_job_resource_type(job)
+        if not requeue:
+            if job_id in self._attempted_to_start_job_ids:
+                return '' # see above comment about why this is necessary
+            self._attempted_to_start_job_ids.add(job_id)
+            self._journal.record_start_attempt(job_id=job_id, processor_name=processor_name, resource_type=resource_type)
         app = self._find_app_with_processor(processor_name)
         if app is None:
             msg = f'Could not find app with processor name {processor_name}'
             print(msg)
+            self._journal.record_state(job_id=job_id, state='start_failed', detail=msg)
             _set_job_status(job_id=job_id, job_private_key=job_private_key, status='failed', error=msg)
             return ''
         try:
             print(f'Starting job {job_id} {processor_name}')
-            return _start_job(
+            ret = _start_job(
                 job_id=job_id,
                 job_private_key=job_private_key,
                 processor_name=processor_name,
                 app=app,
                 run_process=run_process,
-                return_shell_command=return_shell_command
+                return_shell_command=return_shell_command,
+                set_status_to_starting=not requeue, # a requeued job is already starting
+                resource_requirements=self._get_job_resource_requirements(job) if resource_type == 'aws_batch' else None,
+                resource_limits=self._get_job_resource_limits(job),
+                docker_warm_pool=self._docker_warm_pool if resource_type == 'local' else None,
+                singularity_image_cache=self._singularity_image_cache
             )
         except Exception as e:
             msg = f'Failed to start job: {str(e)}'
             print(msg)
+            self._journal.record_state(job_id=job_id, state='start_failed', detail=msg)
+            if self._docker_warm_pool is not None:
+                self._docker_warm_pool.release(job_id) # in case a warm container was reserved for it
             _set_job_status(job_id=job_id, job_private_key=job_private_key, status='failed', error=msg)
             return ''
+        if return_shell_command:
+            # the handle is recorded once the slurm batch is submitted
+            return ret
+        if resource_type == 'aws_batch':
+            self._journal.record_handle(job_id=job_id, handle_type='aws_batch_job', handle=ret)
+        else:
+            handle = self._local_job_supervisor.add(job_id=job_id, job_private_key=job_private_key, process=ret)
+            self._journal.record_handle(job_id=job_id, handle_type='pid', handle=handle)
+        return ''
 
     def _find_app_with_processor(self, processor_name: str) -> App:
-        for app in self._apps:
-            for p in app._processors:
-                if p._name == processor_name:
-                    return app
-        return None
+        route = self._processor_routes.get(processor_name, None)
+        if route is None:
+            return None
+        return route[0]
+
+def _build_processor_routes(apps: List[App]) -> Dict[str, Tuple[App, str]]:
+    routes: Dict[str, Tuple[App, str]] = {}
+    for app in apps:
+        if app._aws_batch_job_queue is not None:
+            resource_type = 'aws_batch'
+        elif app._slurm_opts is not None:
+            resource_type = 'slurm'
+        else:
+            resource_type = 'local'
+        for p in app._processors:
+            # if two apps have a processor with the same name, the first app wins
+            if p._name not in routes:
+                routes[p._name] = (app, resource_type)
+    return routes
 
-def _load_apps(*, compute_resource_id: str, compute_resource_private_key: str):
+def _load_apps(*, compute_resource_id: str, compute_resource_private_key: str, singularity_image_cache: SingularityImageCache = None, app_spec_cache: AppSpecCache = None):
     signature = sign_message({'type': 'computeResource.getApps'}, compute_resource_id, compute_resource_private_key)
     req = {
         'type': 'computeResource.getApps',
@@ -192,51 +706,80 @@ def _load_apps(*, compute_resource_id: str, compute_resource_private_key: str):
         'signature': signature
     }
     resp = _post_api_request(req)
-    ret = []
-    for a in resp['apps']:
-        container = a.get('container', None)
-        aws_batch_opts: dict = a.get('awsBatch', None)
-        slurm_opts: dict = a.get('slurm', None)
-        s = []
-        if container is not None:
-            s.append(f'container: {container}')
-        if aws_batch_opts is not None:
-            if container is None:
-                raise Exception(f'App {a["executablePath"]} has awsBatch but not container')
-            if slurm_opts is not None:
-                raise Exception(f'App {a["executablePath"]} has awsBatch opts but also has slurm opts')
-            aws_batch_job_queue = aws_batch_opts.get('jobQueue', None)
-            aws_batch_job_definition = aws_batch_opts.get('jobDefinition', None)
-            s.append(f'awsBatchJobQueue: {aws_batch_job_queue}')
-            s.append(f'awsBatchJobDefinition: {aws_batch_job_definition}')
-        else:
-            aws_batch_job_queue = None
-            aws_batch_job_definition = None
+    if len(resp['apps']) == 0:
+        return []
+    # Getting the spec of an app may mean running a container, so the apps are loaded concurrently
+    with ThreadPoolExecutor(max_workers=min(max_concurrent_app_loads, len(resp['apps']))) as executor:
+        return list(executor.map(
+            lambda a: _load_app(a, singularity_image_cache=singularity_image_cache, app_spec_cache=app_spec_cache),
+            resp['apps']
+        ))
+
+def _load_app(a: dict, *, singularity_image_cache: SingularityImageCache, app_spec_cache: AppSpecCache) -> App:
+    container = a.get('container', None)
+    aws_batch_opts: dict = a.get('awsBatch', None)
+    slurm_opts: dict = a.get('slurm', None)
+    s = []
+    if container is not None:
+        s.append(f'container: {container}')
+    if aws_batch_opts is not None:
+        if container is None:
+            raise Exception(f'App {a["executablePath"]} has awsBatch but not container')
         if slurm_opts is not None:
-            slurm_cpus_per_task = slurm_opts.get('cpusPerTask', None)
-            slurm_partition = slurm_opts.get('partition', None)
-            slurm_time = slurm_opts.get('time', None)
-            slurm_other_opts = slurm_opts.get('otherOpts', None)
-            s.append(f'slurmCpusPerTask: {slurm_cpus_per_task}')
-            s.append(f'slurmPartition: {slurm_partition}')
-            s.append(f'slurmTime: {slurm_time}')
-            s.append(f'slurmOtherOpts: {slurm_other_opts}')
-        else:
-            slurm_cpus_per_task = None
-            slurm_partition = None
-            slurm_time = None
-            slurm_other_opts = None
-        print(f'Loading app {a["executablePath"]} | {" | ".join(s)}')
-        app = App.from_executable(
-            a['executablePath'],
-            container=container,
-            aws_batch_job_queue=aws_batch_job_queue,
-            aws_batch_job_definition=aws_batch_job_definition,
-            slurm_opts=slurm_opts
-        )
-        print(f'  {len(app._processors)} processors')
-        ret.append(app)
-    return ret
+            raise Exception(f'App {a["executablePath"]} has awsBatch opts but also has slurm opts')
+        aws_batch_job_queue = aws_batch_opts.get('jobQueue', None)
+        aws_batch_job_definition = aws_batch_opts.get('jobDefinition', None)
+        s.append(f'awsBatchJobQueue: {aws_batch_job_queue}')
+        s.append(f'awsBatchJobDefinition: {aws_batch_job_definition}')
+    else:
+        aws_batch_job_queue = None
+        aws_batch_job_definition = None
+    if slurm_opts is not None:
+        slurm_cpus_per_task = slurm_opts.get('cpusPerTask', None)
+        slurm_partition = slurm_opts.get('partition', None)
+        slurm_time = slurm_opts.get('time', None)
+        slurm_other_opts = slurm_opts.get('otherOpts', None)
+        s.append(f'slurmCpusPerTask: {slurm_cpus_per_task}')
+        s.append(f'slurmPartition: {slurm_partition}')
+        s.append(f'slurmTime: {slurm_time}')
+        s.append(f'slurmOtherOpts: {slurm_other_opts}')
+    else:
+        slurm_cpus_per_task = None
+        slurm_partition = None
+        slurm_time = None
+        slurm_other_opts = None
+    print(f'Loading app {a["executablePath"]} | {" | ".join(s)}')
+    container_image_path = None
+    if container and singularity_image_cache is not None:
+        try:
+            container_image_path = singularity_image_cache.get_image_path(container)
+        except Exception as e:
+            print(f'Unable to get cached singularity image for {container}: {str(e)}')
+    spec_cache_key = None
+    spec = None
+    if app_spec_cache is not None:
+        spec_cache_key = _get_app_spec_cache_key(executable_path=a['executablePath'], container=container, container_image_path=container_image_path)
+        if spec_cache_key is not None:
+            spec = app_spec_cache.get(spec_cache_key)
+            if spec is not None:
+                print(f'Using cached spec for app {a["executablePath"]}')
+    app = App.from_executable(
+        a['executablePath'],
+        container=container,
+        aws_batch_job_queue=aws_batch_job_queue,
+        aws_batch_job_definition=aws_batch_job_definition,
+        slurm_opts=slurm_opts,
+        container_image_path=container_image_path,
+        spec=spec
+    )
+    print(f'  {a["executablePath"]}: {len(app._processors)} processors')
+    if app_spec_cache is not None and spec is None:
+        if spec_cache_key is None:
+            # e.g., the docker image was pulled just now
+            spec_cache_key = _get_app_spec_cache_key(executable_path=a['executablePath'], container=container, container_image_path=container_image_path)
+        if spec_cache_key is not None:
+            app_spec_cache.set(spec_cache_key, app.get_spec())
+    return app
 
 def start_compute_resource_node(dir: str):
     config_fname = os.path.join(dir, '.protocaas-compute-resource-node.yaml')
@@ -248,7 +791,8 @@ def start_compute_resource_node(dir: str):
         the_config = {}
     for k in env_var_keys:
         if k in the_config:
-            os.environ[k] = the_config[k]
+            # the yaml may contain numbers, e.g., LOCAL_JOB_NUM_CPUS: 32
+            os.environ[k] = str(the_config[k]) if the_config[k] is not None else ''
 
     daemon = Daemon(dir=dir)
     daemon.start()
@@ -263,92 +807,11 @@ def get_pubsub_subscription(*, compute_resource_id: str, compute_resource_privat
     resp = _post_api_request(req)
     return resp['subscription']
 
+def _kill_docker_container(container_name: str):
+    try:
+        subprocess.run(['docker', 'kill', container_name], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=60)
+    except Exception as e:
+        print(f'Unable to kill docker container {container_name}: {str(e)}')
+
 def _sort_jobs_by_timestamp_created(jobs: List[dict]) -> List[dict]:
     return sorted(jobs, key=lambda job: job['timestampCreated'])
-
-def _cleanup_old_job_working_directories(dir: str):
-    """Delete working dirs that are more than 24 hours old"""
-    jobs_dir = Path(dir)
-    while True:
-        if not jobs_dir.exists():
-            continue
-        for job_dir in jobs_dir.iterdir():
-            if job_dir.is_dir():
-                elapsed = time.time() - job_dir.stat().st_mtime
-                if elapsed > 24 * 60 * 60:
-                    print(f'Removing old working dir {job_dir}')
-                    shutil.rmtree(job_dir)
-        time.sleep(60)
-
-class SlurmJobHandler:
-    def __init__(self, daemon: Daemon, slurm_opts: dict):
-        self._daemon = daemon
-        self._slurm_opts = slurm_opts
-        self._jobs = []
-        self._job_ids = set()
-        self._time_of_last_job_added = 0
-    def add_job(self, job: dict):
-        job_id = job['jobId']
-        if job_id not in self._job_ids:
-            self._jobs.append(job)
-            self._job_ids.add(job_id)
-            self._time_of_last_job_added = time.time()
-    def do_work(self):
-        if len(self._jobs) == 0:
-            return
-        elapsed_since_last_job_added = time.time() - self._time_of_last_job_added
-        # wait a bit before starting jobs because maybe more will be added, and we want to start them all at once
-        if elapsed_since_last_job_added < 5:
-            return
-        max_jobs_in_batch = 20
-        num_jobs_to_start = min(max_jobs_in_batch, len(self._jobs))
-        if num_jobs_to_start > 0:
-            jobs_to_start = self._jobs[:num_jobs_to_start]
-            self._jobs = self._jobs[num_jobs_to_start:]
-            for job in jobs_to_start:
-                self._job_ids.remove(job['jobId'])
-            self._run_slurm_batch(jobs_to_start)
-    def _run_slurm_batch(self, jobs: List[dict]):
-        if not os.path.exists('slurm_scripts'):
-            os.mkdir('slurm_scripts')
-        random_str = os.urandom(16).hex()
-        slurm_script_fname = f'slurm_scripts/slurm_batch_{random_str}.sh'
-        script_has_at_least_one_job = False # important to do this so we don't run an empty script
-        with open(slurm_script_fname, 'w') as f:
-            f.write('#!/bin/bash\n')
-            f.write('\n')
-            f.write('set -e\n')
-            f.write('\n')
-            for ii, job in enumerate(jobs):
-                cmd = self._daemon._start_job(job, run_process=False, return_shell_command=True)
-                if cmd:
-                    f.write(f'if [ "$SLURM_PROCID" == "{ii}" ]; then\n')
-                    f.write(f'    {cmd}\n')
-                    f.write('fi\n')
-                    f.write('\n')
-                    script_has_at_least_one_job = True
-            f.write('\n')
-        if script_has_at_least_one_job:
-            # run the slurm script with srun
-            slurm_cpus_per_task = self._slurm_opts.get('cpusPerTask', None)
-            slurm_partition = self._slurm_opts.get('partition', None)
-            slurm_time = self._slurm_opts.get('time', None)
-            slurm_other_opts = self._slurm_opts.get('otherOpts', None)
-            oo = []
-            if slurm_cpus_per_task is not None:
-                oo.append(f'--cpus-per-task={slurm_cpus_per_task}')
-            if slurm_partition is not None:
-                oo.append(f'--partition={slurm_partition}')
-            if slurm_time is not None:
-                oo.append(f'--time={slurm_time}')
-            if slurm_other_opts is not None:
-                oo.append(slurm_other_opts.split(' '))
-            slurm_opts_str = ' '.join(oo)
-            cmd = f'srun -n {len(jobs)} {slurm_opts_str} bash {slurm_script_fname}'
-            print(f'Running slurm batch: {cmd}')
-            subprocess.Popen(
-                cmd.split(' '),
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-                start_new_session=True
-            )
\ No newline at end of file
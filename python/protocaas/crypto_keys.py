@@ -1,33 +1,71 @@
+from typing import Dict, Tuple
 import os
 import base64
+import hashlib
+import threading
+import simplejson
 import numpy as np
 
 def sign_message(msg: dict, public_key_hex: str, private_key_hex: str) -> str:
-    return _sign_message(msg, public_key_hex, private_key_hex)
+    return _get_signer(public_key_hex, private_key_hex).sign(msg)
 
 ed25519PubKeyPrefix = "302a300506032b6570032100"
 ed25519PrivateKeyPrefix = "302e020100300506032b657004220420"
 
 def _deterministic_json_dumps(x: dict):
-    import simplejson
     return simplejson.dumps(x, separators=(',', ':'), indent=None, allow_nan=False, sort_keys=True)
 
 def _sha1_of_string(txt: str) -> str:
-    import hashlib
     hh = hashlib.sha1(txt.encode('utf-8'))
     ret = hh.hexdigest()
     return ret
 
+# number of distinct messages whose signatures are kept by a Signer (the daemon signs the same few messages over and over)
+max_cached_signatures_per_signer = 1000
+
+class Signer:
+    """Signs messages with a keypair that is parsed once
+
+    Ed25519 signatures are deterministic, so the signature of each message is
+    cached. The signature is only verified against the public key (a sanity
+    check of the keypair) if PROTOCAAS_DEBUG is set.
+    """
+    def __init__(self, public_key_hex: str, private_key_hex: str):
+        from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+        self._privk = Ed25519PrivateKey.from_private_bytes(bytes.fromhex(private_key_hex))
+        self._pubk = Ed25519PublicKey.from_public_bytes(bytes.fromhex(public_key_hex))
+        self._verify = bool(os.environ.get('PROTOCAAS_DEBUG', ''))
+        self._cache: Dict[str, str] = {} # message json -> signature
+        self._lock = threading.Lock()
+    def sign(self, msg: dict) -> str:
+        msg_json = _deterministic_json_dumps(msg)
+        with self._lock:
+            signature = self._cache.get(msg_json, None)
+        if signature is not None:
+            return signature
+        msg_bytes = bytes.fromhex(_sha1_of_string(msg_json))
+        signature = self._privk.sign(msg_bytes).hex()
+        if self._verify:
+            self._pubk.verify(bytes.fromhex(signature), msg_bytes)
+        with self._lock:
+            if len(self._cache) >= max_cached_signatures_per_signer:
+                # most messages are constant, so the ones that are not (e.g., with a timestamp) are simply dropped
+                self._cache.clear()
+            self._cache[msg_json] = signature
+        return signature
+
+_signers: Dict[Tuple[str, str], Signer] = {}
+_signers_lock = threading.Lock()
+
+def _get_signer(public_key_hex: str, private_key_hex: str) -> Signer:
+    key = (public_key_hex, private_key_hex)
+    with _signers_lock:
+        if key not in _signers:
+            _signers[key] = Signer(public_key_hex, private_key_hex)
+        return _signers[key]
+
 def _sign_message(msg: dict, public_key_hex: str, private_key_hex: str) -> str:
-    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
-    msg_json = _deterministic_json_dumps(msg)
-    msg_hash = _sha1_of_string(msg_json)
-    msg_bytes = bytes.fromhex(msg_hash)
-    privk = Ed25519PrivateKey.from_private_bytes(bytes.fromhex(private_key_hex))
-    pubk = Ed25519PublicKey.from_public_bytes(bytes.fromhex(public_key_hex))
-    signature = privk.sign(msg_bytes).hex()
-    pubk.verify(bytes.fromhex(signature), msg_bytes)
-    return signature
+    return _get_signer(public_key_hex, private_key_hex).sign(msg)
 
 def _verify_signature(msg: dict, public_key_hex: str, signature: str):
     from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
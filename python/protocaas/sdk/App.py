@@ -94,10 +94,14 @@ class App:
             app._processors.append(processor)
         return app
     @staticmethod
-    def from_executable(executable_path: str, container: str=None, aws_batch_job_queue: str=None, aws_batch_job_definition: str=None, slurm_opts: dict=None):
+    def from_executable(executable_path: str, container: str=None, aws_batch_job_queue: str=None, aws_batch_job_definition: str=None, slurm_opts: dict=None, container_image_path: str=None, spec: dict=None):
+        # container_image_path: a local image file (e.g., a SIF) to use instead of pulling the container (singularity only)
+        # spec: a spec that was previously obtained from the executable, in which case the executable is not run
         with TemporaryDirectory() as tmpdir:
             spec_fname = os.path.join(tmpdir, 'spec.json')
-            if not container:
+            if spec is not None:
+                pass
+            elif not container:
                 # run executable with SPEC_OUTPUT_FILE set to spec_fname
                 env = os.environ.copy()
                 env['SPEC_OUTPUT_FILE'] = spec_fname
@@ -119,7 +123,7 @@ class App:
                         '--env', f'SPEC_OUTPUT_FILE={spec_fname}',
                         '--bind', f'{tmpdir}:{tmpdir}',
                         '--nv',
-                        f'docker://{container}',
+                        container_image_path if container_image_path else f'docker://{container}',
                         executable_path
                     ]
                     print(f'Running: {" ".join(cmd)}')
@@ -128,8 +132,9 @@ class App:
                     )
                 else:
                     raise Exception(f'Unknown container method: {container_method}')
-            with open(spec_fname, 'r') as f:
-                spec = json.load(f)
+            if spec is None:
+                with open(spec_fname, 'r') as f:
+                    spec = json.load(f)
             a = App.from_spec(spec)
             setattr(a, '_executable_path', executable_path)
             setattr(a, "_executable_container", container)
@@ -0,0 +1,125 @@
+from typing import List, Tuple
+import time
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from ._post_api_request import _post_api_request
+
+
+# how long to wait for more requests before sending a batch
+batch_window_sec = 0.05
+
+# must not exceed the maximum batch size of the API
+max_requests_per_batch = 200
+
+# post() gives up after this long, in case the batching thread is stuck (each request itself times out much sooner, see _post_api_request)
+max_batched_request_wait_sec = 60 * 15
+
+class ApiRequestBatcher:
+    """Coalesces the API requests that are made at about the same time (e.g., from several threads) into batch requests
+
+    post() blocks until the response of its own request is available. If the
+    API does not support batch requests, the requests are sent one by one.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue: List[Tuple[dict, Future]] = []
+        self._has_queued = threading.Event()
+        self._batch_supported = True
+        self._thread: threading.Thread = None
+    def post(self, req: dict) -> dict:
+        if not self._batch_supported:
+            return _post_api_request(req)
+        future = Future()
+        with self._lock:
+            self._queue.append((req, future))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self._has_queued.set()
+        try:
+            return future.result(timeout=max_batched_request_wait_sec)
+        except FutureTimeoutError:
+            with self._lock:
+                # so that it is not sent after all
+                self._queue = [item for item in self._queue if item[1] is not future]
+            raise Exception(f'Timed out waiting for the response to batched request {req.get("type", None)}')
+    def _run(self):
+        while True:
+            items: List[Tuple[dict, Future]] = []
+            try:
+                self._has_queued.wait()
+                time.sleep(batch_window_sec)
+                with self._lock:
+                    items = self._queue[:max_requests_per_batch]
+                    self._queue = self._queue[max_requests_per_batch:]
+                    if len(self._queue) == 0:
+                        self._has_queued.clear()
+                if len(items) > 0:
+                    self._send(items)
+            except Exception as e:
+                # keep the thread alive for the requests that come next, and don't leave anyone waiting
+                print(f'Unexpected error sending batched requests: {str(e)}')
+                for _, future in items:
+                    _fail(future, e)
+    def _send(self, items: List[Tuple[dict, Future]]):
+        if len(items) == 1 or not self._batch_supported:
+            for req, future in items:
+                _resolve(future, lambda: _post_api_request(req))
+            return
+        try:
+            resp = _post_api_request({
+                'type': 'batch',
+                'requests': [req for req, _ in items]
+            })
+        except Exception as e:
+            if 'Invalid request' in str(e):
+                # Either the API predates batch requests, or one of the requests is invalid (which the API does not tell apart),
+                # so send them one by one, which gives the caller of an invalid request its error
+                print('Batch request rejected, sending the requests one by one')
+                for req, future in items:
+                    _resolve(future, lambda: _post_api_request(req))
+                if not any(_is_invalid_request_error(future) for _, future in items):
+                    # each request is fine on its own, so it is the batch request that the API does not support
+                    print('The API does not support batch requests, sending requests one by one from now on')
+                    self._batch_supported = False
+            else:
+                for _, future in items:
+                    _fail(future, e)
+            return
+        responses = resp.get('responses', None)
+        if not isinstance(responses, list) or len(responses) != len(items):
+            e = Exception(f'Unexpected batch response: {len(items)} requests but {len(responses) if isinstance(responses, list) else "no"} responses')
+            for _, future in items:
+                _fail(future, e)
+            return
+        for (_, future), r in zip(items, responses):
+            if 'error' in r:
+                _fail(future, ValueError(f'Error posting protocaas request: Error: {r["error"]}'))
+            else:
+                _succeed(future, r.get('response', None))
+
+def _is_invalid_request_error(future: Future) -> bool:
+    e = future.exception()
+    return e is not None and 'Invalid request' in str(e)
+
+def _resolve(future: Future, func):
+    try:
+        _succeed(future, func())
+    except Exception as e:
+        _fail(future, e)
+
+# after an unexpected error, some of the futures of a batch may already be resolved
+
+def _succeed(future: Future, result):
+    if not future.done():
+        future.set_result(result)
+
+def _fail(future: Future, e: Exception):
+    if not future.done():
+        future.set_exception(e)
+
+_batcher = ApiRequestBatcher()
+
+def _post_api_request_batched(req: dict) -> dict:
+    """Same as _post_api_request, but sent together with the other requests that are made at about the same time"""
+    return _batcher.post(req)
@@ -0,0 +1,178 @@
+from typing import Union
+import os
+import math
+import time
+
+
+# The compute resource node passes the limits of a job to the job wrapper in the environment variables
+# JOB_WALL_TIME_LIMIT_SEC, JOB_MEMORY_LIMIT_GB and JOB_CPU_LIMIT (see _get_resource_limits_env_vars in
+# compute_resource/_resource_requirements.py). A limit that is not set is not enforced.
+
+# The cgroups of the jobs are created in JOB_CGROUP_PARENT, if set: a cgroup (v2) that the user running the node can
+# write to, with no processes of its own (cgroup v2 does not allow enabling controllers for the children of a cgroup that has processes)
+# Without it, the wrapper checks the memory of the jobs (no RLIMIT_AS: address space is not memory, and JVMs, Go runtimes,
+# CUDA and numba reserve far more of it than they use, so such a limit fails jobs that are well within their memory limit)
+
+# libraries that size their thread pools by these, when the cpus can't be limited with a cgroup
+thread_count_env_vars = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'NUMEXPR_NUM_THREADS']
+
+class JobLimitEnforcer:
+    """Enforces the wall time, memory and cpu limits of a job
+
+    The wall time is enforced by the wrapper (see check()). Memory and cpus are
+    limited by a cgroup (v2) of the job, if JOB_CGROUP_PARENT is set and the
+    job process can join the cgroup. Otherwise the wrapper fails the job when
+    the memory (RSS) of all its processes together exceeds the limit (see
+    check()), and the cpus can only be suggested to the job, through the usual
+    thread count environment variables.
+    """
+    def __init__(self, *, job_id: str):
+        self.wall_time_limit_sec = _get_limit_from_env('JOB_WALL_TIME_LIMIT_SEC')
+        self.memory_limit_gb = _get_limit_from_env('JOB_MEMORY_LIMIT_GB')
+        self.cpu_limit = _get_limit_from_env('JOB_CPU_LIMIT')
+        self._job_id = job_id
+        self._cgroup_dir: Union[str, None] = None
+        self._timestamp_started = time.time()
+        self._oom_kill_count_before = 0
+    def prepare(self, env: dict):
+        """Call before starting the job process, with its environment (which may be modified)"""
+        self._timestamp_started = time.time()
+        if (self.memory_limit_gb is not None or self.cpu_limit is not None) and os.environ.get('JOB_CGROUP_PARENT', ''):
+            try:
+                self._cgroup_dir = _create_job_cgroup(
+                    f'protocaas-job-{self._job_id}',
+                    memory_limit_gb=self.memory_limit_gb,
+                    cpu_limit=self.cpu_limit
+                )
+            except Exception as e:
+                print(f'Unable to create a cgroup for the job, checking its memory instead: {str(e)}')
+                self._cgroup_dir = None
+        if self.cpu_limit is not None:
+            for k in thread_count_env_vars:
+                if k not in env:
+                    env[k] = str(max(1, math.floor(self.cpu_limit)))
+        # a container (e.g., docker run --memory) may also have a limit, in which case its OOM kills are counted in our own cgroup
+        self._oom_kill_count_before = _get_oom_kill_count(self._get_memory_events_cgroup_dir())
+    def preexec(self):
+        """Runs in the job process, before the executable"""
+        if self._cgroup_dir is not None:
+            try:
+                with open(f'{self._cgroup_dir}/cgroup.procs', 'w') as f:
+                    f.write(str(os.getpid()))
+            except Exception:
+                pass # the parent notices in started()
+    def started(self, pid: int):
+        """Call once the job process was started"""
+        if self._cgroup_dir is not None:
+            if not _cgroup_has_process(self._cgroup_dir, pid):
+                print('Unable to move the job into its cgroup, checking its memory instead')
+                self._remove_cgroup()
+        if self._cgroup_dir is not None:
+            print(f'Job is limited by cgroup {self._cgroup_dir}')
+    def check(self, *, memory_gb: Union[float, None]):
+        """Raises if the job exceeded a limit. memory_gb is the current memory (RSS) of all its processes."""
+        if self.wall_time_limit_sec is not None:
+            if time.time() - self._timestamp_started > self.wall_time_limit_sec:
+                raise ValueError(f'Job exceeded its wall time limit of {_format_number(self.wall_time_limit_sec)} sec')
+        if self.memory_limit_gb is not None and self._cgroup_dir is None and memory_gb is not None:
+            if memory_gb > self.memory_limit_gb:
+                raise ValueError(f'Job exceeded its memory limit of {_format_number(self.memory_limit_gb)} GB (its processes used {memory_gb:.2f} GB)')
+    def describe_failure(self, returncode: int) -> str:
+        """The error message for a job process that exited with a nonzero return code, saying whether a limit was the cause"""
+        if self.memory_limit_gb is None:
+            return f'Error running job: return code {returncode}'
+        if _get_oom_kill_count(self._get_memory_events_cgroup_dir()) > self._oom_kill_count_before:
+            return f'Job exceeded its memory limit of {_format_number(self.memory_limit_gb)} GB (it was killed by the out-of-memory killer)'
+        return f'Error running job: return code {returncode}'
+    def cleanup(self):
+        """Call once all the processes of the job have exited"""
+        self._remove_cgroup()
+    def _get_memory_events_cgroup_dir(self) -> Union[str, None]:
+        if self._cgroup_dir is not None:
+            return self._cgroup_dir
+        return _get_own_cgroup_dir()
+    def _remove_cgroup(self):
+        if self._cgroup_dir is None:
+            return
+        try:
+            os.rmdir(self._cgroup_dir)
+        except Exception as e:
+            print(f'Unable to remove cgroup {self._cgroup_dir}: {str(e)}')
+        self._cgroup_dir = None
+
+def _create_job_cgroup(name: str, *, memory_limit_gb: Union[float, None], cpu_limit: Union[float, None]) -> str:
+    parent = os.environ['JOB_CGROUP_PARENT']
+    if not os.path.exists(f'{parent}/cgroup.subtree_control'):
+        raise Exception(f'Not a cgroup v2 directory: {parent}')
+    controllers = []
+    if memory_limit_gb is not None:
+        controllers.append('memory')
+    if cpu_limit is not None:
+        controllers.append('cpu')
+    with open(f'{parent}/cgroup.subtree_control', 'r') as f:
+        enabled = f.read().split()
+    missing = [c for c in controllers if c not in enabled]
+    if len(missing) > 0:
+        with open(f'{parent}/cgroup.subtree_control', 'w') as f:
+            f.write(' '.join([f'+{c}' for c in missing]))
+    path = f'{parent}/{name}'
+    os.makedirs(path, exist_ok=True)
+    if memory_limit_gb is not None:
+        _write_cgroup_file(path, 'memory.max', str(int(memory_limit_gb * 1024 * 1024 * 1024)))
+        if os.path.exists(f'{path}/memory.swap.max'):
+            # otherwise a job over its limit swaps (slowing down its neighbors) instead of failing
+            _write_cgroup_file(path, 'memory.swap.max', '0')
+    if cpu_limit is not None:
+        period = 100000
+        _write_cgroup_file(path, 'cpu.max', f'{int(cpu_limit * period)} {period}')
+    return path
+
+def _write_cgroup_file(path: str, name: str, value: str):
+    with open(f'{path}/{name}', 'w') as f:
+        f.write(value)
+
+def _get_own_cgroup_dir() -> Union[str, None]:
+    if not os.path.exists('/sys/fs/cgroup/cgroup.controllers'):
+        return None # not cgroup v2
+    try:
+        with open('/proc/self/cgroup', 'r') as f:
+            for line in f:
+                if line.startswith('0::'):
+                    return '/sys/fs/cgroup' + line[3:].strip().rstrip('/')
+    except Exception:
+        pass
+    return None
+
+def _cgroup_has_process(path: str, pid: int) -> bool:
+    try:
+        with open(f'{path}/cgroup.procs', 'r') as f:
+            return str(pid) in f.read().split()
+    except Exception:
+        return False
+
+def _get_oom_kill_count(path: Union[str, None]) -> int:
+    if path is None:
+        return 0
+    try:
+        with open(f'{path}/memory.events', 'r') as f:
+            for line in f:
+                a = line.split()
+                if len(a) == 2 and a[0] == 'oom_kill':
+                    return int(a[1])
+    except Exception:
+        pass
+    return 0
+
+def _get_limit_from_env(name: str) -> Union[float, None]:
+    value = os.environ.get(name, '')
+    if not value:
+        return None
+    try:
+        x = float(value)
+    except ValueError:
+        print(f'WARNING: ignoring invalid value of {name}: {value}')
+        return None
+    return x if x > 0 else None
+
+def _format_number(x: float) -> str:
+    return str(int(x)) if x == int(x) else str(x)
@@ -1,12 +1,113 @@
 import os
+import json
+import gzip
+import time
+import random
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 
 
+# requests that can be sent again without changing the outcome, so they are retried after a transient failure
+# (e.g., processor.setJobStatus is not, because the server rejects a repeated status transition)
+idempotent_request_types = set([
+    'processor.getJob',
+    'processor.setJobConsoleOutput',
+    'processor.appendJobConsoleOutput', # the API skips what it already has
+    'processor.getOutputUploadUrl',
+    'computeResource.getUnfinishedJobs',
+    'computeResource.getApps',
+    'computeResource.getPubsubSubscription',
+    'computeResource.getJobStatuses',
+    'computeResource.setSpec',
+    'client.loadProject'
+])
+
+# HTTP status codes that indicate a transient failure (e.g., the serverless function timed out or was throttled)
+retryable_status_codes = set([429, 500, 502, 503, 504])
+
+# request bodies larger than this are gzipped when PROTOCAAS_API_GZIP is set
+gzip_min_body_size = 16 * 1024
+
+# enough connections for the concurrent AWS Batch submissions of the compute resource daemon
+max_pooled_connections = 16
+
+_session: requests.Session = None
+_session_lock = threading.Lock()
+
+def _get_session() -> requests.Session:
+    """The session is shared by all threads so that connections to the API are kept alive and reused"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_pooled_connections)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+        return _session
+
 def _post_api_request(req):
-    """Post a request to the protocaas API"""
+    """Post a request to the protocaas API
+
+    Requests time out after PROTOCAAS_API_TIMEOUT_SEC (default 60). Failed
+    connections are retried, and so are transient server errors if the
+    request is idempotent, up to PROTOCAAS_API_MAX_RETRIES times (default 3)
+    with jittered exponential backoff. A request is idempotent if its type is in
+    idempotent_request_types, or if it is a batch of such requests. For idempotent
+    requests, the transient failures include read timeouts and HTTP 502, 503 and 504
+    (e.g., the serverless function timed out or its gateway did).
+    """
     protocaas_url = os.environ.get('PROTOCAAS_URL', 'https://protocaas.vercel.app')
-    resp = requests.post(f'{protocaas_url}/api/protocaas', json=req)
+    timeout_sec = float(os.environ.get('PROTOCAAS_API_TIMEOUT_SEC', '') or 60)
+    max_retries = int(os.environ.get('PROTOCAAS_API_MAX_RETRIES', '') or 3)
+    idempotent = _is_idempotent(req)
+
+    data = json.dumps(req).encode('utf-8')
+    headers = {'Content-Type': 'application/json'}
+    if os.environ.get('PROTOCAAS_API_GZIP', '') and len(data) > gzip_min_body_size:
+        data = gzip.compress(data, compresslevel=6)
+        # the API only decompresses octet-stream bodies, because it would otherwise try to parse them as JSON
+        headers = {'Content-Type': 'application/octet-stream', 'Content-Encoding': 'gzip'}
+
+    session = _get_session()
+    num_retries = 0
+    while True:
+        try:
+            resp = session.post(f'{protocaas_url}/api/protocaas', data=data, headers=headers, timeout=(10, timeout_sec))
+        except (requests.exceptions.ConnectionError, requests.exceptions.ReadTimeout, requests.exceptions.Timeout) as e:
+            # a request that never connected (e.g., connection refused during a deploy) was not received, so it is safe to send again in any case
+            # otherwise (e.g., ReadTimeout) it may have been handled, so it is only sent again if that does not change the outcome
+            if num_retries < max_retries and (idempotent or _was_not_sent(e)):
+                num_retries += 1
+                _sleep_before_retry(num_retries, f'{req.get("type", None)}: {str(e)}')
+                continue
+            raise
+        if resp.status_code in retryable_status_codes and idempotent and num_retries < max_retries:
+            num_retries += 1
+            _sleep_before_retry(num_retries, f'{req.get("type", None)}: status {resp.status_code}')
+            continue
+        break
     if resp.status_code != 200:
         msg = resp.text
         raise ValueError(f'Error posting protocaas request: {msg}')
-    return resp.json()
\ No newline at end of file
+    return resp.json()
+
+def _was_not_sent(e: Exception) -> bool:
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    # requests wraps the error of urllib3, whose reason says whether the connection was ever made
+    reason = getattr(e.args[0], 'reason', None) if len(e.args) > 0 else None
+    return isinstance(reason, NewConnectionError)
+
+def _is_idempotent(req: dict) -> bool:
+    if req.get('type', None) == 'batch':
+        requests0 = req.get('requests', [])
+        return len(requests0) > 0 and all(_is_idempotent(r) for r in requests0)
+    return req.get('type', None) in idempotent_request_types
+
+def _sleep_before_retry(num_retries: int, reason: str):
+    # full jitter, so that many processes that failed together do not retry together
+    delay = random.uniform(0, min(0.5 * 2 ** num_retries, 10))
+    print(f'Retrying protocaas request in {delay:.1f} sec ({reason})')
+    time.sleep(delay)
@@ -0,0 +1,186 @@
+from typing import Dict, List, Union
+import os
+import time
+import resource
+import threading
+
+
+# how often the processes of a job are sampled
+# each sample reads the stat file of every process on the machine, which takes a few ms
+resource_usage_sampling_interval_sec = 5
+
+# the time series is kept at most this long by averaging neighboring points, so that it stays compact whatever the duration of the job
+max_resource_usage_time_series_length = 360
+
+_clock_ticks_per_sec = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+_page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+class ProcessTreeSampler:
+    """Samples the cpu time, memory (RSS) and I/O of all the processes of a job, from /proc
+
+    The processes of the job are the ones in the session of the job process
+    (it is started with start_new_session=True), which includes the processes
+    that it started, even if their parents exited.
+
+    get_resource_usage() returns a summary and a time series of the cpus used
+    (averaged over each interval) and the memory used (largest sample of each
+    interval). Where /proc is not available (e.g., macOS), only the summary
+    from the resource usage of the reaped child processes is reported.
+    """
+    def __init__(self, pid: int):
+        self._pid = pid
+        self._enabled = os.path.isdir('/proc')
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread = None
+        self._timestamp_started = time.time()
+        # counters of the processes seen in the last sample: pid -> (ppid, cpu sec, read bytes, write bytes)
+        self._last_processes: Dict[int, tuple] = {}
+        # counters of the processes that went away without being reaped by a process of the job (including the job process itself)
+        self._gone_cpu_sec = 0
+        self._gone_read_bytes = 0
+        self._gone_write_bytes = 0
+        self._cpu_sec = 0
+        self._read_bytes = 0
+        self._write_bytes = 0
+        self._peak_memory_bytes = 0
+        self._memory_bytes: Union[int, None] = None
+        self._timestamp_last_sample = self._timestamp_started
+        # the time series, and the interval that is being accumulated into its next point
+        self._interval_sec = resource_usage_sampling_interval_sec
+        self._series_cpus: List[float] = []
+        self._series_memory_gb: List[float] = []
+        self._pending_cpu_sec = 0
+        self._pending_elapsed_sec = 0
+        self._pending_memory_bytes = 0
+    def start(self):
+        if not self._enabled:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+    def get_memory_gb(self) -> Union[float, None]:
+        """The memory (RSS) of the processes of the job at the last sample, or None if there was none yet"""
+        with self._lock:
+            return self._memory_bytes / 1e9 if self._memory_bytes is not None else None
+    def get_resource_usage(self) -> dict:
+        """The resource usage of the job so far, in the form of the resourceUsage field of a job"""
+        # the reaped processes are accounted for exactly, so this makes up for what the samples missed (e.g., short-lived processes)
+        ru = resource.getrusage(resource.RUSAGE_CHILDREN)
+        ru_maxrss_bytes = ru.ru_maxrss * 1024 # KB on Linux
+        with self._lock:
+            wall_time_sec = time.time() - self._timestamp_started
+            cpu_time_sec = max(self._cpu_sec, ru.ru_utime + ru.ru_stime)
+            ret = {
+                'wallTimeSec': round(wall_time_sec, 3),
+                'cpuTimeSec': round(cpu_time_sec, 3),
+                'meanCpus': round(cpu_time_sec / wall_time_sec, 3) if wall_time_sec > 0 else 0,
+                'peakMemoryGb': round(max(self._peak_memory_bytes, ru_maxrss_bytes) / 1e9, 4),
+                'ioReadBytes': max(self._read_bytes, ru.ru_inblock * 512),
+                'ioWriteBytes': max(self._write_bytes, ru.ru_oublock * 512)
+            }
+            if self._enabled:
+                ret['timeSeries'] = {
+                    'intervalSec': self._interval_sec,
+                    'cpus': list(self._series_cpus),
+                    'memoryGb': list(self._series_memory_gb)
+                }
+        return ret
+    def _run(self):
+        while not self._stop_event.wait(resource_usage_sampling_interval_sec):
+            try:
+                self._sample()
+            except Exception as e:
+                print(f'WARNING: problem sampling the resource usage of the job: {str(e)}')
+        try:
+            self._sample() # so that the end of the job is included
+        except Exception:
+            pass
+    def _sample(self):
+        processes = _get_session_processes(self._pid)
+        timestamp = time.time()
+        with self._lock:
+            for pid, p in self._last_processes.items():
+                if pid in processes:
+                    continue
+                # if its parent is (still) in the job, the counters of this process were added to those of the parent when it was reaped
+                if p[0] not in processes:
+                    self._gone_cpu_sec += p[1]
+                    self._gone_read_bytes += p[2]
+                    self._gone_write_bytes += p[3]
+            self._last_processes = {pid: p[:4] for pid, p in processes.items()}
+            cpu_sec = self._gone_cpu_sec + sum(p[1] for p in processes.values())
+            memory_bytes = sum(p[4] for p in processes.values())
+            # the totals only go up, even if a process went away unnoticed
+            elapsed_sec = timestamp - self._timestamp_last_sample
+            self._timestamp_last_sample = timestamp
+            delta_cpu_sec = max(0, cpu_sec - self._cpu_sec)
+            self._cpu_sec = max(self._cpu_sec, cpu_sec)
+            self._read_bytes = max(self._read_bytes, self._gone_read_bytes + sum(p[2] for p in processes.values()))
+            self._write_bytes = max(self._write_bytes, self._gone_write_bytes + sum(p[3] for p in processes.values()))
+            self._peak_memory_bytes = max(self._peak_memory_bytes, memory_bytes)
+            self._memory_bytes = memory_bytes
+            self._pending_cpu_sec += delta_cpu_sec
+            self._pending_elapsed_sec += elapsed_sec
+            self._pending_memory_bytes = max(self._pending_memory_bytes, memory_bytes)
+            if self._pending_elapsed_sec >= self._interval_sec * 0.99:
+                self._series_cpus.append(round(self._pending_cpu_sec / self._pending_elapsed_sec, 3))
+                self._series_memory_gb.append(round(self._pending_memory_bytes / 1e9, 4))
+                self._pending_cpu_sec = 0
+                self._pending_elapsed_sec = 0
+                self._pending_memory_bytes = 0
+                if len(self._series_cpus) >= max_resource_usage_time_series_length:
+                    self._downsample()
+    def _downsample(self):
+        # merge neighboring points, from now on each point covers twice as long
+        n = len(self._series_cpus) // 2 * 2
+        self._series_cpus = [round((self._series_cpus[i] + self._series_cpus[i + 1]) / 2, 3) for i in range(0, n, 2)] + self._series_cpus[n:]
+        self._series_memory_gb = [max(self._series_memory_gb[i], self._series_memory_gb[i + 1]) for i in range(0, n, 2)] + self._series_memory_gb[n:]
+        self._interval_sec *= 2
+
+def _get_session_processes(sid: int) -> Dict[int, tuple]:
+    """pid -> (ppid, cpu sec, read bytes, write bytes, rss bytes) for the processes in the session sid
+
+    The cpu time and the I/O of a process include those of its child processes that it reaped.
+    """
+    ret: Dict[int, tuple] = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        stat = _read_proc_stat(name)
+        if stat is None:
+            continue
+        # the fields after the command name (which is in parentheses and can contain spaces)
+        fields = stat[stat.rfind(')') + 2:].split()
+        if int(fields[3]) != sid:
+            continue
+        ppid = int(fields[1])
+        cpu_sec = sum(int(x) for x in fields[11:15]) / _clock_ticks_per_sec # utime, stime, cutime, cstime
+        rss_bytes = int(fields[21]) * _page_size
+        read_bytes, write_bytes = _read_proc_io(name)
+        ret[int(name)] = (ppid, cpu_sec, read_bytes, write_bytes, rss_bytes)
+    return ret
+
+def _read_proc_stat(pid: str) -> Union[str, None]:
+    try:
+        with open(f'/proc/{pid}/stat', 'r') as f:
+            return f.read()
+    except Exception:
+        return None # the process exited
+
+def _read_proc_io(pid: str):
+    read_bytes = 0
+    write_bytes = 0
+    try:
+        with open(f'/proc/{pid}/io', 'r') as f:
+            for line in f:
+                if line.startswith('read_bytes:'):
+                    read_bytes = int(line.split()[1])
+                elif line.startswith('write_bytes:'):
+                    write_bytes = int(line.split()[1])
+    except Exception:
+        pass # not permitted, or the process exited
+    return read_bytes, write_bytes
@@ -1,16 +1,22 @@
 import os
+import json
+import gzip
+import base64
 import threading
-import queue
 import time
+import signal
 import subprocess
 from ._post_api_request import _post_api_request
+from ._process_tree_sampler import ProcessTreeSampler
+from ._job_limits import JobLimitEnforcer
 
 
 # This function is called internally by the compute resource daemon through the protocaas CLI
 # * Sets the job status to running in the database via the API
 # * Runs the job in a separate process by calling the app executable with the appropriate env vars
 # * Monitors the job output, updating the database periodically via the API
-# * Sets the job status to completed or failed in the database via the API
+# * Samples the resource usage of the job (cpu, memory, I/O) and enforces its limits (wall time, memory, cpus)
+# * Sets the job status to completed or failed in the database via the API, along with the resource usage
 
 def _run_job(*, job_id: str, job_private_key: str, app_executable: str):
     _debug_log(f'Running job {job_id}')
@@ -23,32 +29,38 @@ def _run_job(*, job_id: str, job_private_key: str, app_executable: str):
     env['JOB_INTERNAL'] = '1'
     env['PYTHONUNBUFFERED'] = '1'
     print(f'Running {app_executable} (Job ID: {job_id})) (Job private key: {job_private_key})')
+    job_limits = JobLimitEnforcer(job_id=job_id)
+    job_limits.prepare(env)
     _debug_log('Opening subprocess')
     proc = subprocess.Popen(
         cmd,
         env=env,
         stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT
+        stderr=subprocess.STDOUT,
+        start_new_session=True, # so that the job and everything it starts can be killed together
+        preexec_fn=job_limits.preexec
     )
+    job_limits.started(proc.pid)
+    resource_usage_sampler = ProcessTreeSampler(proc.pid)
+    resource_usage_sampler.start()
 
-    def output_reader(proc, outq: queue.Queue):
-        while True:
-            try:
-                x = proc.stdout.read(1)
-            except:
-                break
-            if len(x) == 0:
-                break
-            outq.put(x)
-    outq = queue.Queue()
-    output_reader_thread = threading.Thread(target=output_reader, args=(proc, outq))
+    # the compute resource node (or docker, or slurm) asks us to stop with SIGTERM
+    # we can't simply exit, because the job is in its own process group and would keep running
+    terminate_requested = threading.Event()
+    try:
+        signal.signal(signal.SIGTERM, lambda signum, frame: terminate_requested.set())
+    except ValueError:
+        pass # not on the main thread
+
+    console_output = ConsoleOutputBuffer()
+    console_output_uploader = ConsoleOutputUploader(job_id=job_id, job_private_key=job_private_key, console_output=console_output)
+    output_reader_thread = threading.Thread(target=_read_output, args=(proc.stdout.fileno(), console_output))
     output_reader_thread.start()
 
-    all_output = b''
-    last_newline_index_in_output = -1
     last_report_console_output_time = time.time()
-    console_output_changed = False
     last_check_job_exists_time = time.time()
+    job_control_file = os.environ.get('JOB_CONTROL_FILE', '')
+    job_control_file_watcher = JobControlFileWatcher(job_control_file) if job_control_file else None
 
     succeeded = False
     try:
@@ -58,47 +70,44 @@ def _run_job(*, job_id: str, job_private_key: str, app_executable: str):
                 # don't check this now -- wait until after we had a chance to read the last console output
             except subprocess.TimeoutExpired:
                 retcode = None
-            while True:
-                try:
-                    x = outq.get(block=False)
-
-                    if x == b'\n':
-                        last_newline_index_in_output = len(all_output)
-                    if x == b'\r':
-                        # handle carriage return (e.g. in progress bar)
-                        all_output = all_output[:last_newline_index_in_output + 1]
-                    all_output += x
-                    console_output_changed = True
-                except queue.Empty:
-                    break
-            
-            if console_output_changed:
+            if console_output.changed:
                 elapsed = time.time() - last_report_console_output_time
                 if elapsed > 10:
                     last_report_console_output_time = time.time()
-                    console_output_changed = False
                     try:
-                        _debug_log('Setting job console output')
-                        _set_job_console_output(job_id=job_id, job_private_key=job_private_key, console_output=all_output.decode('utf-8'))
+                        _debug_log('Uploading job console output')
+                        console_output_uploader.upload()
                     except Exception as e:
                         print('WARNING: problem setting console output: ' + str(e))
                         pass
             if retcode is not None:
                 if retcode != 0:
-                    raise ValueError(f'Error running job: return code {retcode}')
+                    raise ValueError(job_limits.describe_failure(retcode))
                 break
 
+            if terminate_requested.is_set():
+                raise ValueError('Job was terminated')
+            job_limits.check(memory_gb=resource_usage_sampler.get_memory_gb())
+
+            # the compute resource node writes the control file when it is told that the job was canceled,
+            # so we look at it every time around (it is only read if it was written)
+            job_status = job_control_file_watcher.get_new_status() if job_control_file_watcher is not None else None
             elapsed = time.time() - last_check_job_exists_time
-            if elapsed > 30:
+            if job_status is None and elapsed > 30:
                 last_check_job_exists_time = time.time()
-                # this should throw an exception if the job does not exist
-                try:
-                    job_status = _get_job_status(job_id=job_id, job_private_key=job_private_key)
-                except:
-                    raise ValueError('Job does not exist (was probably canceled)')
-                if job_status != 'running':
-                    raise ValueError(f'Unexpected job status: {job_status}')
-            time.sleep(5)
+                # the compute resource node keeps the status of the job in the control file
+                # if there is no recent one (e.g., the job runs on AWS Batch, or the node is down), we ask the API ourselves
+                job_status = _get_job_status_from_control_file(job_control_file) if job_control_file else None
+                if job_status is None:
+                    # this should throw an exception if the job does not exist
+                    try:
+                        job_status = _get_job_status(job_id=job_id, job_private_key=job_private_key)
+                    except:
+                        raise ValueError('Job does not exist (was probably canceled)')
+            if job_status == 'deleted':
+                raise ValueError('Job does not exist (was probably canceled)')
+            if job_status is not None and job_status != 'running':
+                raise ValueError(f'Unexpected job status: {job_status}')
         succeeded = True # No exception
     except Exception as e:
         _debug_log(f'Error running job: {str(e)}')
@@ -106,17 +115,24 @@ def _run_job(*, job_id: str, job_private_key: str, app_executable: str):
         error_message = str(e)
     finally:
         _debug_log('Closing subprocess')
+        try:
+            _terminate_process_group(proc, timeout_sec=job_kill_timeout_sec)
+        except Exception as e:
+            print('WARNING: problem terminating the job process: ' + str(e))
+        job_limits.cleanup()
+        # the reader stops at the end of the output, which is what we want for the final console output,
+        # but a process that the job left behind could keep the pipe open
+        output_reader_thread.join(timeout=10)
         try:
             proc.stdout.close()
-            proc.stderr.close()
-            proc.terminate()
         except Exception:
             pass
-        output_reader_thread.join()
-    if console_output_changed:
-        _debug_log('Setting final job console output')
+        resource_usage_sampler.stop()
+    resource_usage = resource_usage_sampler.get_resource_usage()
+    if console_output.changed:
+        _debug_log('Uploading final job console output')
         try:
-            _set_job_console_output(job_id=job_id, job_private_key=job_private_key, console_output=all_output.decode('utf-8'))
+            console_output_uploader.upload()
         except Exception as e:
             _debug_log('WARNING: problem setting final console output: ' + str(e))
             print('WARNING: problem setting final console output: ' + str(e))
@@ -126,16 +142,206 @@ def _run_job(*, job_id: str, job_private_key: str, app_executable: str):
         if succeeded:
             _debug_log('Setting job status to completed')
             print('Job completed')
-            _set_job_status(job_id=job_id, job_private_key=job_private_key, status='completed')
+            _set_job_status(job_id=job_id, job_private_key=job_private_key, status='completed', resource_usage=resource_usage)
         else:
             _debug_log('Setting job status to failed: ' + error_message)
             print('Job failed: ' + error_message)
-            _set_job_status(job_id=job_id, job_private_key=job_private_key, status='failed', error=error_message)
+            _set_job_status(job_id=job_id, job_private_key=job_private_key, status='failed', error=error_message, resource_usage=resource_usage)
     except Exception as e:
         _debug_log('WARNING: problem setting final job status: ' + str(e))
         print('WARNING: problem setting final job status: ' + str(e))
         pass
     
+class ConsoleOutputBuffer:
+    """The console output of a job, as it would appear in a terminal that only handles newlines and carriage returns
+
+    A carriage return (e.g., in a progress bar) erases the current line, but is
+    itself kept. The output is appended in chunks by the reader thread.
+
+    The raw output that has not been acknowledged by the API yet is also kept,
+    for appending it to the console output of the job (see ConsoleOutputUploader).
+    """
+    def __init__(self):
+        self._data = bytearray()
+        self._last_newline_index = -1
+        self._lock = threading.Lock()
+        self._unsent = bytearray() # raw output from _unsent_offset on
+        self._unsent_offset = 0
+        self._keep_unsent = True
+        self._changed = False
+    def append(self, chunk: bytes):
+        with self._lock:
+            start = 0
+            while True:
+                r = chunk.find(b'\r', start)
+                segment = chunk[start:] if r == -1 else chunk[start:r]
+                n = segment.rfind(b'\n')
+                if n >= 0:
+                    self._last_newline_index = len(self._data) + n
+                self._data += segment
+                if r == -1:
+                    break
+                del self._data[self._last_newline_index + 1:]
+                self._data += b'\r'
+                start = r + 1
+            if self._keep_unsent:
+                self._unsent += chunk
+            self._changed = True
+    @property
+    def changed(self) -> bool:
+        """Whether there is output that has not been uploaded"""
+        with self._lock:
+            return self._changed or len(self._unsent) > 0
+    def get_text(self) -> str:
+        with self._lock:
+            self._changed = False
+            # the output may end in the middle of a multi-byte character
+            return self._data.decode('utf-8', errors='replace')
+    def get_unsent(self, max_bytes: int):
+        """The offset and the bytes of the raw output that has not been acknowledged"""
+        with self._lock:
+            self._changed = False
+            return self._unsent_offset, bytes(self._unsent[:max_bytes])
+    def acknowledge(self, size: int):
+        """The API has the raw output up to size"""
+        with self._lock:
+            n = size - self._unsent_offset
+            if n > 0:
+                del self._unsent[:n]
+                self._unsent_offset = size
+    def stop_keeping_unsent(self):
+        with self._lock:
+            self._keep_unsent = False
+            self._unsent = bytearray()
+
+# the raw output is appended at most this much per request (the request size of the API is limited)
+max_console_output_append_size = 1024 * 1024
+
+class ConsoleOutputUploader:
+    """Uploads the console output of a job
+
+    Only the output that is new since the last upload is sent, compressed. If
+    the API does not support appending console output, the whole console
+    output is set instead, as before.
+    """
+    def __init__(self, *, job_id: str, job_private_key: str, console_output: ConsoleOutputBuffer):
+        self._job_id = job_id
+        self._job_private_key = job_private_key
+        self._console_output = console_output
+        self._append_supported = True
+    def upload(self):
+        if self._append_supported:
+            try:
+                if self._append():
+                    return
+            except Exception as e:
+                if 'Invalid request' not in str(e):
+                    raise
+                print('The API does not support appending console output')
+            print('Setting the whole console output from now on')
+            self._append_supported = False
+            self._console_output.stop_keeping_unsent()
+        _set_job_console_output(job_id=self._job_id, job_private_key=self._job_private_key, console_output=self._console_output.get_text())
+    def _append(self) -> bool:
+        while True:
+            offset, data = self._console_output.get_unsent(max_console_output_append_size)
+            if len(data) == 0:
+                return True
+            resp = _append_job_console_output(job_id=self._job_id, job_private_key=self._job_private_key, offset=offset, data=data)
+            if resp['consoleOutputSize'] < offset:
+                # we no longer have the output from there, so it can't be continued
+                print(f'Console output of the job has {resp["consoleOutputSize"]} bytes, expected {offset}')
+                return False
+            self._console_output.acknowledge(resp['consoleOutputSize'])
+
+# how much of the output is read at once
+output_read_chunk_size = 1024 * 64
+
+def _read_output(fd: int, console_output: ConsoleOutputBuffer):
+    while True:
+        try:
+            x = os.read(fd, output_read_chunk_size)
+        except Exception:
+            break
+        if len(x) == 0:
+            break
+        console_output.append(x)
+
+# how long the job gets to exit after SIGTERM before it is killed
+job_kill_timeout_sec = 3
+
+def _terminate_process_group(proc: subprocess.Popen, *, timeout_sec: float):
+    """Terminate the job process and whatever it started (its process group), and kill them if they do not exit in time
+
+    This also cleans up the processes that a job which exited normally left behind.
+    """
+    pgid = proc.pid # the job process is the leader of its process group
+    try:
+        os.killpg(pgid, signal.SIGTERM)
+    except ProcessLookupError:
+        return # nothing left
+    timer = time.time()
+    while time.time() - timer < timeout_sec:
+        proc.poll() # reap the job process, so that it does not count as remaining
+        if not _process_group_exists(pgid):
+            return
+        time.sleep(0.1)
+    print(f'Killing the job processes that did not exit within {timeout_sec} sec')
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    try:
+        proc.wait(timeout=1)
+    except subprocess.TimeoutExpired:
+        pass
+
+def _process_group_exists(pgid: int) -> bool:
+    try:
+        os.killpg(pgid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+# the control file is written every 30 sec while the compute resource node is up, so an older one is ignored
+max_job_control_file_age_sec = 60 * 3
+
+def _get_job_status_from_control_file(path: str):
+    """The status of the job according to the compute resource node, or None if it has not said recently"""
+    try:
+        with open(path, 'r') as f:
+            x = json.load(f)
+    except Exception:
+        return None # not written yet
+    if time.time() - x.get('timestamp', 0) > max_job_control_file_age_sec:
+        return None
+    status = x.get('status', None)
+    if status == 'starting':
+        return None # the node looked before we set the status to running
+    return status
+
+class JobControlFileWatcher:
+    """Notices when the compute resource node writes the control file of the job
+
+    Only the modification time is looked at until the file is written again,
+    so this is cheap enough to call every second.
+    """
+    def __init__(self, path: str):
+        self._path = path
+        self._mtime = None
+    def get_new_status(self):
+        """The status in the control file if it was written since the last call, otherwise None"""
+        try:
+            mtime = os.stat(self._path).st_mtime_ns
+        except Exception:
+            return None # not written yet
+        if mtime == self._mtime:
+            return None
+        self._mtime = mtime
+        return _get_job_status_from_control_file(self._path)
+
 def _get_job_status(*, job_id: str, job_private_key: str) -> str:
     """Get a job from the protocaas API"""
     req = {
@@ -146,8 +352,11 @@ def _get_job_status(*, job_id: str, job_private_key: str) -> str:
     res = _post_api_request(req)
     return res['status']
 
-def _set_job_status(*, job_id: str, job_private_key: str, status: str, error: str = None):
-    """Set the status of a job in the protocaas API"""
+def _set_job_status(*, job_id: str, job_private_key: str, status: str, error: str = None, resource_usage: dict = None):
+    """Set the status of a job in the protocaas API
+
+    The resource usage (see ProcessTreeSampler) can be given with the final status.
+    """
     req = {
         'type': 'processor.setJobStatus',
         'jobId': job_id,
@@ -156,7 +365,17 @@ def _set_job_status(*, job_id: str, job_private_key: str, status: str, error: st
     }
     if error is not None:
         req['error'] = error
-    resp = _post_api_request(req)
+    if resource_usage is not None:
+        req['resourceUsage'] = resource_usage
+    try:
+        resp = _post_api_request(req)
+    except Exception as e:
+        if resource_usage is None or 'Invalid request' not in str(e):
+            raise
+        # the API predates resourceUsage, and a rejected request changed nothing, so it is safe to send it again
+        print('The API does not accept the resource usage of the job')
+        del req['resourceUsage']
+        resp = _post_api_request(req)
     if not resp['success']:
         raise Exception(f'Error setting job status: {resp["error"]}')
 
@@ -170,6 +389,17 @@ def _set_job_console_output(*, job_id: str, job_private_key: str, console_output
     }
     resp = _post_api_request(req)
 
+def _append_job_console_output(*, job_id: str, job_private_key: str, offset: int, data: bytes):
+    """Append to the console output of a job in the protocaas API, starting at offset of the raw output"""
+    req = {
+        'type': 'processor.appendJobConsoleOutput',
+        'jobId': job_id,
+        'jobPrivateKey': job_private_key,
+        'offset': offset,
+        'data': base64.b64encode(gzip.compress(data, compresslevel=6)).decode('ascii')
+    }
+    return _post_api_request(req)
+
 def _debug_log(msg: str):
     # write to protocaas-job.log
     timestamp_str = time.strftime('%Y-%m-%d %H:%M:%S')
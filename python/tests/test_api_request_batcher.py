@@ -0,0 +1,49 @@
+import threading
+import protocaas.sdk._api_request_batcher as api_request_batcher_module
+from protocaas.sdk._api_request_batcher import ApiRequestBatcher
+
+
+_invalid_request_error = 'Error posting protocaas request: Invalid request'
+
+def _post_all(batcher: ApiRequestBatcher, reqs):
+    """Posts the requests concurrently, so that they are sent in one batch, and returns the response or error of each"""
+    results = [None] * len(reqs)
+    def post(i, req):
+        try:
+            results[i] = batcher.post(req)
+        except Exception as e:
+            results[i] = e
+    threads = [threading.Thread(target=post, args=(i, req)) for i, req in enumerate(reqs)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=10)
+    return results
+
+def test_invalid_request_in_batch_does_not_disable_batching(monkeypatch):
+    def post_api_request(req):
+        if req['type'] == 'batch':
+            # the API validates the requests of a batch, and rejects the whole batch if one is invalid
+            if any(r['type'] == 'invalid' for r in req['requests']):
+                raise Exception(_invalid_request_error)
+            return {'responses': [{'response': 'batched'} for _ in req['requests']]}
+        if req['type'] == 'invalid':
+            raise Exception(_invalid_request_error)
+        return 'single'
+    monkeypatch.setattr(api_request_batcher_module, '_post_api_request', post_api_request)
+    batcher = ApiRequestBatcher()
+    results = _post_all(batcher, [{'type': 'a'}, {'type': 'invalid'}, {'type': 'b'}])
+    assert results[0] == 'single' and results[2] == 'single'
+    assert 'Invalid request' in str(results[1])
+    assert batcher._batch_supported
+    assert _post_all(batcher, [{'type': 'a'}, {'type': 'b'}]) == ['batched', 'batched']
+
+def test_batching_is_disabled_if_the_api_rejects_batch_requests(monkeypatch):
+    def post_api_request(req):
+        if req['type'] == 'batch':
+            raise Exception(_invalid_request_error)
+        return 'single'
+    monkeypatch.setattr(api_request_batcher_module, '_post_api_request', post_api_request)
+    batcher = ApiRequestBatcher()
+    assert _post_all(batcher, [{'type': 'a'}, {'type': 'b'}]) == ['single', 'single']
+    assert not batcher._batch_supported
@@ -0,0 +1,131 @@
+import pytest
+pytest.importorskip('boto3')
+import boto3
+from botocore.stub import Stubber, ANY
+import protocaas.compute_resource.AwsBatchExecutor as aws_batch_executor_module
+import protocaas.compute_resource._start_job as start_job_module
+from protocaas.compute_resource.AwsBatchExecutor import AwsBatchExecutor
+from protocaas.compute_resource._resource_requirements import ResourceRequirements
+
+
+job_queue = 'test-queue'
+job_definition = 'test-job-definition'
+container = 'ghcr.io/test/app:latest'
+command = 'python /app/main.py'
+
+@pytest.fixture
+def stubbed_client(monkeypatch):
+    monkeypatch.setattr(start_job_module, '_get_kachery_cloud_credentials', lambda: (None, None))
+    client = boto3.client('batch', region_name='us-east-1', aws_access_key_id='testing', aws_secret_access_key='testing')
+    with Stubber(client) as stubber:
+        yield client, stubber
+        stubber.assert_no_pending_responses()
+
+def _add_describe_job_definitions(stubber: Stubber):
+    stubber.add_response(
+        'describe_job_definitions',
+        {
+            'jobDefinitions': [{
+                'jobDefinitionName': job_definition,
+                'jobDefinitionArn': f'arn:aws:batch:us-east-1:123456789012:job-definition/{job_definition}:1',
+                'revision': 1,
+                'type': 'container',
+                'containerProperties': {'image': container, 'command': command.split(' ')}
+            }]
+        },
+        {'jobDefinitionName': job_definition}
+    )
+
+def _add_submit_job(stubber: Stubber, job_id: str, batch_job_id: str, *, vcpus: str, memory_mib: str):
+    stubber.add_response(
+        'submit_job',
+        {'jobName': f'protocaas-job-{job_id}', 'jobId': batch_job_id},
+        {
+            'jobName': f'protocaas-job-{job_id}',
+            'jobQueue': job_queue,
+            'jobDefinition': job_definition,
+            'containerOverrides': {
+                'environment': ANY,
+                'resourceRequirements': [
+                    {'type': 'VCPU', 'value': vcpus},
+                    {'type': 'MEMORY', 'value': memory_mib}
+                ]
+            }
+        }
+    )
+
+def _submit(executor: AwsBatchExecutor, job_id: str, resource_requirements: ResourceRequirements = None):
+    return executor.submit_job(
+        job_id=job_id,
+        job_private_key='private-key',
+        aws_batch_job_queue=job_queue,
+        aws_batch_job_definition=job_definition,
+        container=container,
+        command=command,
+        resource_requirements=resource_requirements
+    )
+
+def test_job_definition_is_validated_once_per_ttl(stubbed_client, monkeypatch):
+    client, stubber = stubbed_client
+    executor = AwsBatchExecutor(client=client)
+    _add_describe_job_definitions(stubber)
+    _add_submit_job(stubber, 'j1', 'b1', vcpus='4', memory_mib='16384')
+    _add_submit_job(stubber, 'j2', 'b2', vcpus='4', memory_mib='16384')
+    assert _submit(executor, 'j1') == 'b1'
+    assert _submit(executor, 'j2') == 'b2'
+    # once the validation expired, the job definition is looked up again
+    monkeypatch.setattr(aws_batch_executor_module, 'job_definition_cache_ttl_sec', 0)
+    _add_describe_job_definitions(stubber)
+    _add_submit_job(stubber, 'j3', 'b3', vcpus='4', memory_mib='16384')
+    assert _submit(executor, 'j3') == 'b3'
+
+def test_submit_job_is_sized_by_resource_requirements(stubbed_client):
+    client, stubber = stubbed_client
+    executor = AwsBatchExecutor(client=client)
+    _add_describe_job_definitions(stubber)
+    # rounded up to whole vCPUs and MiB
+    _add_submit_job(stubber, 'j1', 'b1', vcpus='3', memory_mib='3277')
+    _add_submit_job(stubber, 'j2', 'b2', vcpus='1', memory_mib='512')
+    assert _submit(executor, 'j1', ResourceRequirements(num_cpus=2.5, memory_gb=3.2, disk_gb=0)) == 'b1'
+    assert _submit(executor, 'j2', ResourceRequirements(num_cpus=0.5, memory_gb=0.5, disk_gb=0)) == 'b2'
+
+def test_job_definition_mismatch_is_rejected(stubbed_client):
+    client, stubber = stubbed_client
+    executor = AwsBatchExecutor(client=client)
+    _add_describe_job_definitions(stubber)
+    with pytest.raises(Exception, match='container does not match'):
+        executor.submit_job(
+            job_id='j1',
+            job_private_key='private-key',
+            aws_batch_job_queue=job_queue,
+            aws_batch_job_definition=job_definition,
+            container='ghcr.io/test/other:latest',
+            command=command
+        )
+
+def _batch_job_description(batch_job_id: str, status: str) -> dict:
+    return {
+        'jobName': f'protocaas-job-{batch_job_id}',
+        'jobId': batch_job_id,
+        'jobQueue': job_queue,
+        'status': status,
+        'startedAt': 0,
+        'jobDefinition': job_definition
+    }
+
+def test_describe_jobs_is_chunked(stubbed_client):
+    client, stubber = stubbed_client
+    executor = AwsBatchExecutor(client=client)
+    batch_job_ids = [f'b{i}' for i in range(250)]
+    for i in range(0, 250, 100):
+        chunk = batch_job_ids[i:i + 100]
+        # a job that Batch no longer knows about is left out of the response
+        stubber.add_response(
+            'describe_jobs',
+            {'jobs': [_batch_job_description(b, 'RUNNING') for b in chunk if b != 'b150']},
+            {'jobs': chunk}
+        )
+    descriptions = executor.describe_jobs(batch_job_ids)
+    assert len(descriptions) == 249
+    assert 'b150' not in descriptions
+    assert descriptions['b249']['status'] == 'RUNNING'
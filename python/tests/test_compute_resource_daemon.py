@@ -0,0 +1,171 @@
+from typing import Dict, List
+import time
+import pytest
+import protocaas.compute_resource.start_compute_resource_node as daemon_module
+from protocaas.compute_resource.start_compute_resource_node import Daemon, max_aws_batch_resubmits
+from protocaas.compute_resource.JobJournal import JobJournal
+from protocaas.compute_resource.AwsBatchExecutor import AwsBatchExecutor
+
+
+class _FakeApi:
+    """Answers the requests of the daemon from a set of jobs"""
+    def __init__(self):
+        self.jobs: Dict[str, dict] = {} # job id -> job (including finished ones)
+        self.resource_usages: Dict[str, dict] = {}
+        self.requests: List[dict] = []
+    def post(self, req: dict) -> dict:
+        self.requests.append(req)
+        if req['type'] == 'computeResource.getUnfinishedJobs':
+            unfinished_jobs = [job for job in self.jobs.values() if job['status'] not in ['completed', 'failed']]
+            return {
+                'type': 'computeResource.getUnfinishedJobs',
+                'jobs': unfinished_jobs,
+                'unfinishedJobIds': [job['jobId'] for job in unfinished_jobs],
+                'cursor': time.time()
+            }
+        if req['type'] == 'computeResource.getJobStatuses':
+            resp = {
+                'type': 'computeResource.getJobStatuses',
+                'jobStatuses': {job_id: self.jobs[job_id]['status'] if job_id in self.jobs else None for job_id in req['jobIds']}
+            }
+            if req.get('includeResourceUsage', False):
+                resp['jobResourceUsages'] = {job_id: self.resource_usages.get(job_id, None) for job_id in req['jobIds']}
+            return resp
+        raise Exception(f'Unexpected request: {req["type"]}')
+
+def _create_job(job_id: str, status: str) -> dict:
+    return {'jobId': job_id, 'jobPrivateKey': f'key-{job_id}', 'processorName': 'proc1', 'status': status, 'timestampCreated': time.time()}
+
+@pytest.fixture
+def daemon(tmp_path, monkeypatch):
+    api = _FakeApi()
+    monkeypatch.setattr(daemon_module, '_post_api_request', api.post)
+    monkeypatch.setattr(daemon_module, 'sign_message', lambda msg, compute_resource_id, compute_resource_private_key: 'signature')
+    # only the state that syncing and reconciling needs, rather than loading apps from the API
+    d = Daemon.__new__(Daemon)
+    d._compute_resource_id = 'cr1'
+    d._compute_resource_private_key = 'private-key'
+    d._node_id = 'node1'
+    d._node_name = 'node1'
+    d._journal = JobJournal(str(tmp_path / 'journal.db'))
+    d._unfinished_jobs = {}
+    d._unfinished_jobs_cursor = None
+    d._incremental_unfinished_jobs_sync_supported = True
+    d._timestamp_last_full_unfinished_jobs_sync = 0
+    d._aws_batch_right_sizing = True
+    d._job_resource_usage_supported = True
+    d._ended_backend_job_timestamps = {}
+    d.api = api
+    return d
+
+def test_usage_of_completed_aws_batch_jobs_is_recorded(daemon):
+    api = daemon.api
+    for job_id in ['j1', 'j2', 'j3']:
+        api.jobs[job_id] = _create_job(job_id, 'running')
+        daemon._journal.record_start_attempt(job_id=job_id, processor_name='proc1', resource_type='aws_batch')
+        daemon._journal.record_handle(job_id=job_id, handle_type='aws_batch_job', handle=f'batch-{job_id}')
+    daemon._sync_unfinished_jobs()
+    daemon._reconcile_journal()
+    assert daemon._journal.get_resource_usage_history(processor_name='proc1') == []
+
+    api.jobs['j1']['status'] = 'completed'
+    api.resource_usages['j1'] = {'wallTimeSec': 100, 'cpuTimeSec': 250, 'meanCpus': 2.5, 'peakMemoryGb': 3.2, 'ioReadBytes': 0, 'ioWriteBytes': 0}
+    api.jobs['j2']['status'] = 'failed'
+    api.resource_usages['j2'] = {'wallTimeSec': 10, 'cpuTimeSec': 10, 'meanCpus': 1, 'peakMemoryGb': 9.9, 'ioReadBytes': 0, 'ioWriteBytes': 0}
+    daemon._sync_unfinished_jobs()
+    daemon._reconcile_journal()
+
+    # only the completed one
+    history = daemon._journal.get_resource_usage_history(processor_name='proc1')
+    assert [(u.peak_memory_gb, u.mean_cpus) for u in history] == [(3.2, 2.5)]
+    assert daemon._journal.get_job('j1').state == 'finished'
+    assert daemon._journal.get_job('j3').state == 'running'
+
+@pytest.fixture
+def batch_stubber(daemon, monkeypatch):
+    """The daemon talks to a stubbed Batch API, and its job status updates and submissions are recorded"""
+    boto3 = pytest.importorskip('boto3')
+    from botocore.stub import Stubber
+    client = boto3.client('batch', region_name='us-east-1', aws_access_key_id='testing', aws_secret_access_key='testing')
+    executor = AwsBatchExecutor(client=client)
+    monkeypatch.setattr(daemon_module, '_get_aws_batch_executor', lambda: executor)
+    monkeypatch.setattr(daemon_module, 'aws_batch_ended_job_grace_period_sec', 0)
+    daemon.failed_jobs = {}
+    monkeypatch.setattr(daemon_module, '_set_job_status', lambda *, job_id, job_private_key, status, error: daemon.failed_jobs.__setitem__(job_id, error))
+    daemon.resubmitted_job_ids = []
+    def start_job(job: dict, requeue: bool = False):
+        assert requeue
+        daemon.resubmitted_job_ids.append(job['jobId'])
+        num = len(daemon.resubmitted_job_ids)
+        daemon._journal.record_handle(job_id=job['jobId'], handle_type='aws_batch_job', handle=f'batch-{job["jobId"]}-{num}')
+    daemon._start_job = start_job
+    with Stubber(client) as stubber:
+        yield stubber
+        stubber.assert_no_pending_responses()
+
+def _add_aws_batch_job(daemon, job_id: str, status: str):
+    daemon.api.jobs[job_id] = _create_job(job_id, status)
+    daemon._journal.record_start_attempt(job_id=job_id, processor_name='proc1', resource_type='aws_batch')
+    daemon._journal.record_handle(job_id=job_id, handle_type='aws_batch_job', handle=f'batch-{job_id}')
+
+def _add_describe_jobs(stubber, descriptions: List[dict]):
+    stubber.add_response(
+        'describe_jobs',
+        {'jobs': [{'jobQueue': 'q', 'startedAt': 0, 'jobDefinition': 'd', **d} for d in descriptions]},
+        {'jobs': [d['jobId'] for d in descriptions]}
+    )
+
+def test_failed_aws_batch_job_is_failed(daemon, batch_stubber):
+    _add_aws_batch_job(daemon, 'j1', 'running')
+    daemon._sync_unfinished_jobs()
+    _add_describe_jobs(batch_stubber, [{
+        'jobName': 'protocaas-job-j1', 'jobId': 'batch-j1', 'status': 'FAILED',
+        'attempts': [{'container': {'reason': 'OutOfMemoryError: Container killed due to memory usage'}}]
+    }])
+    daemon._reconcile_aws_batch_jobs()
+    assert daemon.failed_jobs == {'j1': 'AWS Batch job batch-j1 failed: OutOfMemoryError: Container killed due to memory usage'}
+    assert daemon._journal.get_job('j1').state == 'finished'
+    assert daemon.resubmitted_job_ids == []
+
+def test_aws_batch_job_that_lost_its_host_while_starting_is_resubmitted(daemon, batch_stubber):
+    _add_aws_batch_job(daemon, 'j1', 'starting')
+    daemon._sync_unfinished_jobs()
+    for i in range(max_aws_batch_resubmits + 1):
+        handle = daemon._journal.get_job('j1').handle
+        _add_describe_jobs(batch_stubber, [{
+            'jobName': 'protocaas-job-j1', 'jobId': handle, 'status': 'FAILED',
+            'statusReason': 'Host EC2 (instance i-0123) terminated.'
+        }])
+        daemon._reconcile_aws_batch_jobs()
+        if i < max_aws_batch_resubmits:
+            assert daemon.resubmitted_job_ids == ['j1'] * (i + 1)
+            assert daemon.failed_jobs == {}
+    # gives up after max_aws_batch_resubmits
+    assert daemon.resubmitted_job_ids == ['j1'] * max_aws_batch_resubmits
+    assert list(daemon.failed_jobs.keys()) == ['j1']
+    assert daemon._journal.get_job('j1').state == 'finished'
+
+def test_aws_batch_job_that_lost_its_host_while_running_is_not_resubmitted(daemon, batch_stubber):
+    _add_aws_batch_job(daemon, 'j1', 'running')
+    daemon._sync_unfinished_jobs()
+    _add_describe_jobs(batch_stubber, [{
+        'jobName': 'protocaas-job-j1', 'jobId': 'batch-j1', 'status': 'FAILED',
+        'statusReason': 'Host EC2 (instance i-0123) terminated.'
+    }])
+    daemon._reconcile_aws_batch_jobs()
+    assert daemon.resubmitted_job_ids == []
+    assert list(daemon.failed_jobs.keys()) == ['j1']
+
+def test_aws_batch_job_not_found_is_failed_after_grace_period(daemon, batch_stubber, monkeypatch):
+    _add_aws_batch_job(daemon, 'j1', 'running')
+    daemon._sync_unfinished_jobs()
+    # a job that was just submitted may not be known to Batch yet
+    batch_stubber.add_response('describe_jobs', {'jobs': []}, {'jobs': ['batch-j1']})
+    daemon._reconcile_aws_batch_jobs()
+    assert daemon.failed_jobs == {}
+    assert daemon._journal.get_job('j1').state == 'started'
+    monkeypatch.setattr(daemon_module, 'aws_batch_job_not_found_grace_period_sec', -1)
+    batch_stubber.add_response('describe_jobs', {'jobs': []}, {'jobs': ['batch-j1']})
+    daemon._reconcile_aws_batch_jobs()
+    assert daemon.failed_jobs == {'j1': 'AWS Batch job batch-j1 is no longer known to AWS Batch'}
+    assert daemon._journal.get_job('j1').state == 'finished'
@@ -0,0 +1,100 @@
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+import protocaas.sdk._post_api_request as post_api_request_module
+from protocaas.sdk._post_api_request import _post_api_request
+
+
+class _StubApi:
+    """A local API that answers with the given (status code, delay in sec) in turn, and then with 200"""
+    def __init__(self, behaviors):
+        self.behaviors = list(behaviors)
+        self.num_requests = 0
+        stub = self
+        class RequestHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                i = stub.num_requests
+                stub.num_requests += 1
+                status_code, delay_sec = stub.behaviors[i] if i < len(stub.behaviors) else (200, 0)
+                time.sleep(delay_sec)
+                body = json.dumps({'success': True, 'attempt': i}).encode('utf-8') if status_code == 200 else b'error'
+                try:
+                    self.send_response(status_code)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass # the client timed out
+            def log_message(self, format, *args):
+                pass
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), RequestHandler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def stub_api(monkeypatch):
+    stubs = []
+    def create(behaviors):
+        stub = _StubApi(behaviors)
+        stubs.append(stub)
+        monkeypatch.setenv('PROTOCAAS_URL', stub.url)
+        return stub
+    monkeypatch.setenv('PROTOCAAS_API_TIMEOUT_SEC', '0.5')
+    monkeypatch.setenv('PROTOCAAS_API_MAX_RETRIES', '3')
+    # no backoff delays
+    monkeypatch.setattr(post_api_request_module.random, 'uniform', lambda a, b: 0)
+    yield create
+    for stub in stubs:
+        stub.close()
+
+@pytest.mark.parametrize('status_code', [502, 503, 504])
+def test_idempotent_request_is_retried_after_gateway_error(stub_api, status_code):
+    stub = stub_api([(status_code, 0), (status_code, 0)])
+    resp = _post_api_request({'type': 'computeResource.getUnfinishedJobs'})
+    assert resp['attempt'] == 2
+    assert stub.num_requests == 3
+
+def test_idempotent_request_is_retried_after_read_timeout(stub_api):
+    stub = stub_api([(200, 2)])
+    resp = _post_api_request({'type': 'processor.getJob'})
+    assert resp['attempt'] == 1
+    assert stub.num_requests == 2
+
+def test_batch_of_idempotent_requests_is_retried(stub_api):
+    stub = stub_api([(503, 0)])
+    resp = _post_api_request({'type': 'batch', 'requests': [{'type': 'processor.getJob'}, {'type': 'computeResource.getJobStatuses'}]})
+    assert resp['attempt'] == 1
+    assert stub.num_requests == 2
+
+def test_non_idempotent_request_is_not_retried(stub_api):
+    stub = stub_api([(503, 0)])
+    with pytest.raises(ValueError):
+        _post_api_request({'type': 'processor.setJobStatus'})
+    assert stub.num_requests == 1
+    stub2 = stub_api([(200, 2)])
+    with pytest.raises(Exception):
+        _post_api_request({'type': 'batch', 'requests': [{'type': 'processor.getJob'}, {'type': 'processor.setJobStatus'}]})
+    assert stub2.num_requests == 1
+
+def test_gives_up_after_max_retries(stub_api):
+    stub = stub_api([(503, 0)] * 10)
+    with pytest.raises(ValueError):
+        _post_api_request({'type': 'computeResource.getApps'})
+    assert stub.num_requests == 4
+
+def test_refused_connection_is_retried_even_if_not_idempotent(monkeypatch):
+    monkeypatch.setenv('PROTOCAAS_URL', 'http://127.0.0.1:1') # nothing listens there
+    monkeypatch.setenv('PROTOCAAS_API_MAX_RETRIES', '2')
+    retries = []
+    monkeypatch.setattr(post_api_request_module, '_sleep_before_retry', lambda num_retries, reason: retries.append(num_retries))
+    with pytest.raises(Exception):
+        _post_api_request({'type': 'processor.setJobStatus'})
+    assert retries == [1, 2]
@@ -0,0 +1,96 @@
+import os
+import time
+import stat
+from protocaas.compute_resource.JobJournal import JobJournalEntry
+from protocaas.compute_resource.SlurmJobReconciler import SlurmJobReconciler, slurm_state_not_found, slurm_job_not_found_grace_period_sec
+
+
+def _make_stub_command(dirpath, name: str, *, output: str, returncode: int = 0):
+    # a script that prints the given output, in place of sacct or squeue
+    output_path = os.path.join(dirpath, f'{name}.out')
+    with open(output_path, 'w') as f:
+        f.write(output)
+    script_path = os.path.join(dirpath, name)
+    with open(script_path, 'w') as f:
+        f.write(f'#!/bin/sh\ncat "{output_path}"\nexit {returncode}\n')
+    os.chmod(script_path, os.stat(script_path).st_mode | stat.S_IXUSR)
+    return script_path
+
+def _make_entry(job_id: str, *, handle_type: str, handle: str, age_sec: float = 0):
+    timestamp = time.time() - age_sec
+    return JobJournalEntry(
+        job_id=job_id,
+        processor_name='proc1',
+        resource_type='slurm',
+        state='started',
+        handle_type=handle_type,
+        handle=handle,
+        timestamp_created=timestamp,
+        timestamp_updated=timestamp
+    )
+
+def test_sacct_states(tmp_path):
+    sacct = _make_stub_command(str(tmp_path), 'sacct', output='\n'.join([
+        '1001|slurm_batch_aaa|COMPLETED',
+        '1002|slurm_batch_bbb|CANCELLED by 1234',
+        '1003|slurm_batch_ccc|RUNNING',
+        # requeued after a node failure, so it is pending again
+        '1004|slurm_batch_ddd|NODE_FAIL',
+        '1004|slurm_batch_ddd|PENDING',
+        '1005_1|job_array|FAILED',
+        # pending array tasks are collapsed into a single row
+        '1005_[2-4,7%2]|job_array|PENDING',
+        '1006_[1-3]|job_array_2|CANCELLED by 0',
+        ''
+    ]))
+    reconciler = SlurmJobReconciler(sacct_command=sacct, squeue_command='/nonexistent/squeue')
+    entries = [
+        _make_entry('j1', handle_type='slurm_batch', handle='slurm_batch_aaa'),
+        _make_entry('j2', handle_type='slurm_batch', handle='slurm_batch_bbb'),
+        _make_entry('j3', handle_type='slurm_batch', handle='slurm_batch_ccc'),
+        _make_entry('j4', handle_type='slurm_batch', handle='slurm_batch_ddd'),
+        _make_entry('j5', handle_type='slurm_array_task', handle='1005_1'),
+        _make_entry('j6', handle_type='slurm_array_task', handle='1005_3'),
+        _make_entry('j7', handle_type='slurm_array_task', handle='1005_7'),
+        _make_entry('j8', handle_type='slurm_array_task', handle='1006_2'),
+        _make_entry('j9', handle_type='pid', handle='12345')
+    ]
+    ended = reconciler.get_ended_jobs(entries)
+    assert ended == {
+        'j1': 'COMPLETED',
+        'j2': 'CANCELLED',
+        'j5': 'FAILED',
+        'j8': 'CANCELLED'
+    }
+
+def test_not_found_after_grace_period(tmp_path):
+    sacct = _make_stub_command(str(tmp_path), 'sacct', output='1001|slurm_batch_aaa|RUNNING\n')
+    reconciler = SlurmJobReconciler(sacct_command=sacct, squeue_command='/nonexistent/squeue')
+    entries = [
+        _make_entry('j1', handle_type='slurm_batch', handle='slurm_batch_missing_new'),
+        _make_entry('j2', handle_type='slurm_batch', handle='slurm_batch_missing_old', age_sec=slurm_job_not_found_grace_period_sec + 10),
+        _make_entry('j3', handle_type='slurm_array_task', handle='2000_5', age_sec=slurm_job_not_found_grace_period_sec + 10),
+        _make_entry('j4', handle_type='slurm_batch', handle='slurm_batch_aaa', age_sec=slurm_job_not_found_grace_period_sec + 10)
+    ]
+    ended = reconciler.get_ended_jobs(entries)
+    assert ended == {
+        'j2': slurm_state_not_found,
+        'j3': slurm_state_not_found
+    }
+
+def test_falls_back_to_squeue(tmp_path):
+    sacct = _make_stub_command(str(tmp_path), 'sacct', output='', returncode=1)
+    squeue = _make_stub_command(str(tmp_path), 'squeue', output='\n'.join([
+        '1001|slurm_batch_aaa|RUNNING',
+        '1005_[2-3]|job_array|PENDING',
+        ''
+    ]))
+    reconciler = SlurmJobReconciler(sacct_command=sacct, squeue_command=squeue)
+    entries = [
+        _make_entry('j1', handle_type='slurm_batch', handle='slurm_batch_aaa', age_sec=slurm_job_not_found_grace_period_sec + 10),
+        _make_entry('j2', handle_type='slurm_array_task', handle='1005_3', age_sec=slurm_job_not_found_grace_period_sec + 10),
+        # no longer listed by squeue, so it ended
+        _make_entry('j3', handle_type='slurm_array_task', handle='1005_1', age_sec=slurm_job_not_found_grace_period_sec + 10)
+    ]
+    ended = reconciler.get_ended_jobs(entries)
+    assert ended == {'j3': slurm_state_not_found}
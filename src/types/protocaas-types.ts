@@ -54,6 +54,38 @@ export const isProtocaasProject = (x: any): x is ProtocaasProject => {
     })
 }
 
+// Reported by the job wrapper along with the final status of the job
+// The time series has a point per intervalSec: the mean number of cpus used and the peak memory (RSS) in that interval
+export type ProtocaasJobResourceUsage = {
+    wallTimeSec: number
+    cpuTimeSec: number
+    meanCpus: number
+    peakMemoryGb: number
+    ioReadBytes: number
+    ioWriteBytes: number
+    timeSeries?: {
+        intervalSec: number
+        cpus: number[]
+        memoryGb: number[]
+    }
+}
+
+export const isProtocaasJobResourceUsage = (x: any): x is ProtocaasJobResourceUsage => {
+    return validateObject(x, {
+        wallTimeSec: isNumber,
+        cpuTimeSec: isNumber,
+        meanCpus: isNumber,
+        peakMemoryGb: isNumber,
+        ioReadBytes: isNumber,
+        ioWriteBytes: isNumber,
+        timeSeries: optional(y => validateObject(y, {
+            intervalSec: isNumber,
+            cpus: isArrayOf(isNumber),
+            memoryGb: isArrayOf(isNumber)
+        }))
+    })
+}
+
 export type ProtocaasJob = {
     projectId: string
     workspaceId: string
@@ -89,8 +121,10 @@ export type ProtocaasJob = {
     timestampStarting?: number
     timestampStarted?: number
     timestampFinished?: number
+    timestampModified?: number
     outputFileIds?: string[]
     processorSpec: ComputeResourceSpecProcessor
+    resourceUsage?: ProtocaasJobResourceUsage
 }
 
 export const isProtocaasJob = (x: any): x is ProtocaasJob => {
@@ -129,8 +163,10 @@ export const isProtocaasJob = (x: any): x is ProtocaasJob => {
         timestampStarting: optional(isNumber),
         timestampStarted: optional(isNumber),
         timestampFinished: optional(isNumber),
+        timestampModified: optional(isNumber),
         outputFileIds: optional(isArrayOf(isString)),
-        processorSpec: isComputeResourceSpecProcessor
+        processorSpec: isComputeResourceSpecProcessor,
+        resourceUsage: optional(isProtocaasJobResourceUsage)
     })
 }
 